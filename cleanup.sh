@@ -35,15 +35,10 @@ stop_all_vms() {
     echo -e "\n${YELLOW}Stopping all QEMU VMs...${NC}"
     
     # Stop VMs managed by vm_manager.py
-    if [ -f "config/vms.yaml" ]; then
+    if [ -f "config/inventory.db" ] || [ -f "config/vms.yaml" ]; then
         echo "Stopping managed VMs..."
         if command -v python3 &> /dev/null && [ -f "src/vm_manager.py" ]; then
-            for vm in $(python3 -c "import yaml; vms = yaml.safe_load(open('config/vms.yaml')).get('vms', {}); print(' '.join(vms.keys()))" 2>/dev/null || echo ""); do
-                if [ -n "$vm" ]; then
-                    echo "  Stopping VM: $vm"
-                    python3 src/vm_manager.py stop --name "$vm" 2>/dev/null || echo "    (VM was not running)"
-                fi
-            done
+            python3 src/vm_manager.py stop --all 2>/dev/null || echo "    (Could not stop managed VMs)"
         fi
     fi
     
@@ -139,7 +134,7 @@ cleanup_files() {
         echo
         if [[ $REPLY =~ ^[Yy]$ ]]; then
             echo "Cleaning Ubuntu netboot files..."
-            rm -rf images/ubuntu/* 2>/dev/null || true
+            rm -rf images/ubuntu/* images/assets 2>/dev/null || true
             echo -e "${GREEN}✓ Ubuntu netboot files removed${NC}"
             echo -e "${YELLOW}Note: Run 'make setup' or 'make setup-pxe' to re-download${NC}"
         else
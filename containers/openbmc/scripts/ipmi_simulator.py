@@ -1,13 +1,26 @@
 #!/usr/bin/env python3
 """
 BMC IPMI Simulator
-Provides IPMI interface for managing VMs
+Provides IPMI-over-LAN (RMCP/RMCP+) for managing VMs
 """
 
-import socket
-import json
+import argparse
+import asyncio
+import hashlib
+import hmac
 import logging
-from datetime import datetime
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sensor_engine import SensorArray
+from state_store import StateStore
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # AES-CBC-128 cipher suites are disabled without it
+    Cipher = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,50 +28,649 @@ logging.basicConfig(
 )
 logger = logging.getLogger('ipmi-simulator')
 
+RMCP_HEADER = b'\x06\x00\xff\x07'
+ASF_IANA = b'\x00\x00\x11\xbe'
+
+# RMCP+ payload types
+PAYLOAD_IPMI = 0x00
+PAYLOAD_OPEN_SESSION_REQUEST = 0x10
+PAYLOAD_OPEN_SESSION_RESPONSE = 0x11
+PAYLOAD_RAKP1 = 0x12
+PAYLOAD_RAKP2 = 0x13
+PAYLOAD_RAKP3 = 0x14
+PAYLOAD_RAKP4 = 0x15
+
+# Authentication algorithm -> (hash, integrity check value length)
+AUTH_ALGORITHMS = {
+    0x01: (hashlib.sha1, 12),     # RAKP-HMAC-SHA1
+    0x03: (hashlib.sha256, 16),   # RAKP-HMAC-SHA256
+}
+# Integrity algorithm -> (hash, auth code length)
+INTEGRITY_ALGORITHMS = {
+    0x00: (None, 0),              # none
+    0x01: (hashlib.sha1, 12),     # HMAC-SHA1-96
+    0x04: (hashlib.sha256, 16),   # HMAC-SHA256-128
+}
+CONFIDENTIALITY_ALGORITHMS = {0x00} | ({0x01} if Cipher else set())  # none, AES-CBC-128
+
+# Cipher suite id -> (auth, integrity, confidentiality)
+CIPHER_SUITES = {
+    1: (0x01, 0x00, 0x00),
+    2: (0x01, 0x01, 0x00),
+    3: (0x01, 0x01, 0x01),
+    15: (0x03, 0x00, 0x00),
+    16: (0x03, 0x04, 0x00),
+    17: (0x03, 0x04, 0x01),
+}
+
+# Network functions and commands
+NETFN_CHASSIS = 0x00
+NETFN_SENSOR = 0x04
+NETFN_APP = 0x06
+NETFN_STORAGE = 0x0A
+
+CC_OK = 0x00
+CC_PARAM_NOT_SUPPORTED = 0x80
+CC_INVALID_RESERVATION = 0xC5
+CC_INVALID_COMMAND = 0xC1
+CC_INVALID_DATA = 0xCC
+CC_NOT_PRESENT = 0xCB
+CC_INSUFFICIENT_PRIVILEGE = 0xD4
+
+PRIV_USER = 0x02
+PRIV_OPERATOR = 0x03
+PRIV_ADMIN = 0x04
+
+# Boot device selector (Set System Boot Options param 5) <-> Redfish target
+BOOT_DEVICES = {0x00: 'None', 0x01: 'Pxe', 0x02: 'Hdd', 0x05: 'Cd', 0x06: 'BiosSetup'}
+BOOT_SELECTORS = {v: k for k, v in BOOT_DEVICES.items()}
+
+# (number, name, sensor type, entity id, base unit, sensor engine channel,
+#  reading while the engine is not running, M)
+SENSORS = [
+    (0x01, 'CPU Temp', 0x01, 0x03, 0x01, 'cpu_temp', 45.0, 1),
+    (0x02, 'System Temp', 0x01, 0x07, 0x01, 'system_temp', 28.0, 1),
+    (0x03, 'Fan1', 0x04, 0x1D, 0x12, 'fan1_speed', 2400, 100),
+    (0x04, 'Fan2', 0x04, 0x1D, 0x12, 'fan2_speed', 2400, 100),
+    (0x05, 'Fan3', 0x04, 0x1D, 0x12, 'fan3_speed', 2400, 100),
+    (0x06, 'Fan4', 0x04, 0x1D, 0x12, 'fan4_speed', 2400, 100),
+    (0x07, 'Inlet Temp', 0x01, 0x37, 0x01, 'inlet_temp', 22.0, 1),
+    (0x08, 'PSU1 Power', 0x08, 0x0A, 0x06, 'psu1_watts', 45.0, 2),
+    (0x09, 'PSU2 Power', 0x08, 0x0A, 0x06, 'psu2_watts', 45.0, 2),
+]
+
+DEFAULT_USERS = {'openbmc': '0penBmc', 'admin': 'admin'}
+MAX_SESSIONS = 4096
+SESSION_TIMEOUT = 60.0
+
+
+def checksum(data):
+    return (-sum(data)) & 0xff
+
+
+def build_sdr(record_id, sensor):
+    """Build a Full Sensor Record (type 0x01) for one sensor"""
+    number, name, sensor_type, entity, unit, _, _, m = sensor
+    name_bytes = name.encode()[:16]
+    body = bytes([
+        0x20, 0x00, number,              # owner id, owner LUN, sensor number
+        entity, 0x01,                    # entity id, instance
+        0x7f, 0x40,                      # initialization, capabilities
+        sensor_type, 0x01,               # sensor type, threshold reading type
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00,  # event / reading masks
+        0x00, unit, 0x00,                # unsigned, base unit, modifier
+        0x00,                            # linear
+        m & 0xff, ((m >> 8) & 0x03) << 6,  # M, tolerance
+        0x00, 0x00, 0x00, 0x00,          # B, accuracy, direction, exponents
+        0x00, 0x00, 0x00, 0x00, 0xff, 0x00,  # analog flags, nominal/max/min
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00,  # thresholds
+        0x00, 0x00,                      # hysteresis
+        0x00, 0x00, 0x00,                # reserved, OEM
+        0xc0 | len(name_bytes),
+    ]) + name_bytes
+    header = struct.pack('<HBBB', record_id, 0x51, 0x01, len(body))
+    return header + body
+
+
+class IPMISession:
+    """RMCP+ session state from Open Session through RAKP and beyond"""
+
+    def __init__(self, bmc_sid, console_sid, addr, system_id, auth, integrity, confidentiality,
+                 privilege):
+        self.bmc_sid = bmc_sid
+        self.console_sid = console_sid
+        # Sessions share one table across the per-system ports; each belongs
+        # to the peer and the system (port) it was opened on
+        self.addr = addr
+        self.system_id = system_id
+        self.auth = auth
+        self.integrity = integrity
+        self.confidentiality = confidentiality
+        self.max_privilege = privilege
+        self.privilege = PRIV_USER
+        self.established = False
+        self.user = None
+        self.role = None
+        self.console_random = None
+        self.bmc_random = None
+        self.k1 = None
+        self.k2 = None
+        self.outbound_seq = 0
+        self.last_active = time.monotonic()
+
+
+class IPMIProtocol(asyncio.DatagramProtocol):
+    """
+    One UDP endpoint; all sessions for it are handled on the event loop.
+    Each packet gets its own task, so one waiting on the state store does
+    not hold up the others.
+    """
+
+    def __init__(self, simulator, system_id):
+        self.simulator = simulator
+        self.system_id = system_id
+        self.transport = None
+        self.tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        task = asyncio.ensure_future(self.respond(data, addr))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def respond(self, data, addr):
+        try:
+            response = await self.simulator.handle_packet(data, addr, self.system_id)
+        except Exception as e:
+            logger.warning(f"Dropping malformed packet from {addr}: {e}")
+            return
+        if response:
+            self.transport.sendto(response, addr)
+
+
 class IPMISimulator:
-    def __init__(self, host='0.0.0.0', port=623):
+    def __init__(self, host='0.0.0.0', port=623, system_id='1', system_count=1,
+                 users=None, store=None):
         self.host = host
         self.port = port
-        self.state_file = '/var/lib/openbmc/state.json'
+        self.system_id = system_id
+        self.system_count = system_count
+        self.users = users or DEFAULT_USERS
+        self.store = store or StateStore()
+        self.sensors = SensorArray()
+        self.sessions = {}
+        self.guid = hashlib.md5(b'dc-simulator-bmc').digest()
+        self.sdr_records = [build_sdr(i, sensor) for i, sensor in enumerate(SENSORS)]
+        self.sdr_reservation = 1
+        # SQLite stays off the event loop: reads never wait for the write lock
+        # in WAL mode, and writes queue on one thread as SQLite would anyway
+        self.store_readers = ThreadPoolExecutor(4, thread_name_prefix='ipmi-store-read')
+        self.store_writer = ThreadPoolExecutor(1, thread_name_prefix='ipmi-store-write')
         self.load_state()
-    
-    def load_state(self):
-        """Load BMC state from file"""
-        try:
-            with open(self.state_file, 'r') as f:
-                self.state = json.load(f)
-        except FileNotFoundError:
-            self.state = {
-                'power_state': 'off',
-                'boot_device': 'hdd',
-                'sensors': {
-                    'cpu_temp': 45.0,
-                    'system_temp': 28.0,
-                    'fan1_speed': 2400
-                }
-            }
-            self.save_state()
-    
-    def save_state(self):
-        """Save BMC state to file"""
-        with open(self.state_file, 'w') as f:
-            json.dump(self.state, f, indent=2)
-    
+
+    def load_state(self, system_id=None):
+        """Load a system's BMC state from the shared store"""
+        system_id = system_id or self.system_id
+        self.state = self.store.get(system_id) or self.store.update(system_id, lambda s: s)
+        return self.state
+
+    def save_state(self, fn, system_id=None, event=None):
+        """Atomically update a system's BMC state in the shared store"""
+        self.state = self.store.update(system_id or self.system_id, fn, event)
+        return self.state
+
+    async def read_state(self, system_id):
+        """load_state on a store reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.store_readers, self.load_state, system_id)
+
+    async def write_state(self, fn, system_id, event=None):
+        """save_state on the store writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.store_writer, self.save_state, fn, system_id, event)
+
+    # Packet framing
+
+    async def handle_packet(self, data, addr, system_id):
+        if len(data) < 5 or data[0] != 0x06:
+            return None
+        if data[3] == 0x06:
+            return self.handle_asf(data)
+        if data[3] != 0x07:
+            return None
+        if data[4] == 0x06:
+            return await self.handle_rmcp_plus(data, addr, system_id)
+        if data[4] == 0x00:
+            return await self.handle_ipmi15(data, system_id)
+        return None
+
+    def handle_asf(self, data):
+        """Answer an ASF Presence Ping so discovery tools see an IPMI BMC"""
+        if data[4:8] != ASF_IANA or data[8] != 0x80:
+            return None
+        tag = data[9]
+        pong = ASF_IANA + b'\x00\x00\x00\x00' + b'\x81\x00' + b'\x00' * 6
+        return b'\x06\x00\xff\x06' + ASF_IANA + bytes([0x40, tag, 0x00, len(pong)]) + pong
+
+    async def handle_ipmi15(self, data, system_id):
+        """Session-less IPMI v1.5 messages, used before an RMCP+ session exists"""
+        length = data[13]
+        message = data[14:14 + length]
+        response = await self.handle_ipmi_message(message, None, system_id)
+        if response is None:
+            return None
+        return RMCP_HEADER + b'\x00' + b'\x00' * 8 + bytes([len(response)]) + response
+
+    async def handle_rmcp_plus(self, data, addr, system_id):
+        payload_type = data[5]
+        encrypted = bool(payload_type & 0x80)
+        authenticated = bool(payload_type & 0x40)
+        payload_type &= 0x3f
+        sid, seq, length = struct.unpack('<IIH', data[6:16])
+        payload = data[16:16 + length]
+
+        if payload_type == PAYLOAD_OPEN_SESSION_REQUEST:
+            return self.open_session(payload, addr, system_id)
+        if payload_type == PAYLOAD_RAKP1:
+            return self.rakp1(payload, addr, system_id)
+        if payload_type == PAYLOAD_RAKP3:
+            return self.rakp3(payload, addr, system_id)
+        if payload_type != PAYLOAD_IPMI:
+            return None
+
+        if sid == 0:
+            # Pre-session commands only (auth capabilities, cipher suites)
+            response = await self.handle_ipmi_message(payload, None, system_id)
+            return self.wrap_rmcp_plus(None, response) if response else None
+
+        session = self.session_for(sid, addr, system_id)
+        if session is None or not session.established:
+            return None
+        if session.integrity:
+            if not authenticated or not self.verify_integrity(session, data):
+                return None
+        if encrypted:
+            payload = self.decrypt(session, payload)
+        session.last_active = time.monotonic()
+
+        response = await self.handle_ipmi_message(payload, session, system_id)
+        if response is None:
+            return None
+        return self.wrap_rmcp_plus(session, response)
+
+    def wrap_rmcp_plus(self, session, payload, payload_type=PAYLOAD_IPMI):
+        """Frame a payload as an RMCP+ packet, encrypting and signing if negotiated"""
+        if session is None or not session.established:
+            header = bytes([0x06, payload_type]) + struct.pack('<IIH', 0, 0, len(payload))
+            return RMCP_HEADER + header + payload
+
+        flags = 0
+        if session.confidentiality:
+            payload = self.encrypt(session, payload)
+            flags |= 0x80
+        if session.integrity:
+            flags |= 0x40
+        session.outbound_seq = (session.outbound_seq + 1) & 0xffffffff or 1
+        packet = bytes([0x06, payload_type | flags]) + struct.pack(
+            '<IIH', session.console_sid, session.outbound_seq, len(payload)) + payload
+        if session.integrity:
+            digest, code_length = INTEGRITY_ALGORITHMS[session.integrity]
+            pad = (4 - (len(packet) + 2) % 4) % 4
+            packet += b'\xff' * pad + bytes([pad, 0x07])
+            packet += hmac.new(session.k1, packet, digest).digest()[:code_length]
+        return RMCP_HEADER + packet
+
+    def verify_integrity(self, session, data):
+        digest, code_length = INTEGRITY_ALGORITHMS[session.integrity]
+        signed, code = data[4:-code_length], data[-code_length:]
+        expected = hmac.new(session.k1, signed, digest).digest()[:code_length]
+        return hmac.compare_digest(code, expected)
+
+    def encrypt(self, session, payload):
+        pad = (16 - (len(payload) + 1) % 16) % 16
+        plaintext = payload + bytes(range(1, pad + 1)) + bytes([pad])
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(session.k2[:16]), modes.CBC(iv)).encryptor()
+        return iv + encryptor.update(plaintext) + encryptor.finalize()
+
+    def decrypt(self, session, payload):
+        iv, ciphertext = payload[:16], payload[16:]
+        decryptor = Cipher(algorithms.AES(session.k2[:16]), modes.CBC(iv)).decryptor()
+        plaintext = decryptor.update(ciphertext) + decryptor.finalize()
+        return plaintext[:-(plaintext[-1] + 1)]
+
+    # Session establishment (Open Session, RAKP 1-4)
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        for sid in [sid for sid, s in self.sessions.items()
+                    if now - s.last_active > SESSION_TIMEOUT]:
+            del self.sessions[sid]
+
+    def session_for(self, sid, addr, system_id):
+        """The session with this id if it was opened by addr on system_id's port"""
+        session = self.sessions.get(sid)
+        if session is None or session.addr != addr or session.system_id != system_id:
+            return None
+        return session
+
+    def open_session(self, payload, addr, system_id):
+        tag, privilege = payload[0], payload[1]
+        console_sid = struct.unpack('<I', payload[4:8])[0]
+        auth, integrity, confidentiality = payload[12], payload[20], payload[28]
+
+        status = 0x00
+        if len(self.sessions) >= MAX_SESSIONS:
+            self.expire_sessions()
+            if len(self.sessions) >= MAX_SESSIONS:
+                status = 0x01
+        if auth not in AUTH_ALGORITHMS:
+            status = 0x04
+        elif integrity not in INTEGRITY_ALGORITHMS:
+            status = 0x05
+        elif confidentiality not in CONFIDENTIALITY_ALGORITHMS:
+            status = 0x10
+        if status:
+            response = bytes([tag, status, 0x00, 0x00]) + struct.pack('<I', console_sid)
+            return self.wrap_rmcp_plus(None, response, PAYLOAD_OPEN_SESSION_RESPONSE)
+
+        bmc_sid = struct.unpack('<I', os.urandom(4))[0] or 1
+        while bmc_sid in self.sessions:
+            bmc_sid = (bmc_sid + 1) & 0xffffffff or 1
+        session = IPMISession(bmc_sid, console_sid, addr, system_id, auth, integrity,
+                              confidentiality, privilege or PRIV_ADMIN)
+        self.sessions[bmc_sid] = session
+
+        response = bytes([tag, 0x00, session.max_privilege, 0x00])
+        response += struct.pack('<II', console_sid, bmc_sid)
+        response += bytes([0x00, 0, 0, 0x08, auth, 0, 0, 0])
+        response += bytes([0x01, 0, 0, 0x08, integrity, 0, 0, 0])
+        response += bytes([0x02, 0, 0, 0x08, confidentiality, 0, 0, 0])
+        return self.wrap_rmcp_plus(None, response, PAYLOAD_OPEN_SESSION_RESPONSE)
+
+    def rakp1(self, payload, addr, system_id):
+        tag = payload[0]
+        bmc_sid = struct.unpack('<I', payload[4:8])[0]
+        session = self.session_for(bmc_sid, addr, system_id)
+        if session is None or session.established:
+            return None
+        session.console_random = payload[8:24]
+        session.role = payload[24]
+        user = payload[28:28 + payload[27]]
+
+        password = self.users.get(user.decode(errors='replace'))
+        if password is None or (session.role & 0x0f) > session.max_privilege:
+            del self.sessions[bmc_sid]
+            status = 0x0d if password is None else 0x09
+            response = bytes([tag, status, 0, 0]) + struct.pack('<I', session.console_sid)
+            return self.wrap_rmcp_plus(None, response, PAYLOAD_RAKP2)
+
+        session.user = user
+        session.kuid = password.encode()
+        session.bmc_random = os.urandom(16)
+        digest = AUTH_ALGORITHMS[session.auth][0]
+        role_user = bytes([session.role, len(user)]) + user
+        auth_code = hmac.new(
+            session.kuid,
+            struct.pack('<II', session.console_sid, bmc_sid) + session.console_random
+            + session.bmc_random + self.guid + role_user,
+            digest
+        ).digest()
+        response = bytes([tag, 0x00, 0, 0]) + struct.pack('<I', session.console_sid)
+        response += session.bmc_random + self.guid + auth_code
+        return self.wrap_rmcp_plus(None, response, PAYLOAD_RAKP2)
+
+    def rakp3(self, payload, addr, system_id):
+        tag, status = payload[0], payload[1]
+        bmc_sid = struct.unpack('<I', payload[4:8])[0]
+        session = self.session_for(bmc_sid, addr, system_id)
+        if session is None or session.user is None or session.established:
+            return None
+        if status != 0x00:
+            del self.sessions[bmc_sid]
+            return None
+
+        digest, icv_length = AUTH_ALGORITHMS[session.auth]
+        role_user = bytes([session.role, len(session.user)]) + session.user
+        expected = hmac.new(
+            session.kuid,
+            session.bmc_random + struct.pack('<I', session.console_sid) + role_user,
+            digest
+        ).digest()
+        if not hmac.compare_digest(payload[8:8 + len(expected)], expected):
+            del self.sessions[bmc_sid]
+            response = bytes([tag, 0x0f, 0, 0]) + struct.pack('<I', session.console_sid)
+            return self.wrap_rmcp_plus(None, response, PAYLOAD_RAKP4)
+
+        sik = hmac.new(session.kuid, session.console_random + session.bmc_random + role_user,
+                       digest).digest()
+        session.k1 = hmac.new(sik, b'\x01' * 20, digest).digest()
+        session.k2 = hmac.new(sik, b'\x02' * 20, digest).digest()
+        icv = hmac.new(sik, session.console_random + struct.pack('<I', bmc_sid) + self.guid,
+                       digest).digest()[:icv_length]
+        response = bytes([tag, 0x00, 0, 0]) + struct.pack('<I', session.console_sid) + icv
+        packet = self.wrap_rmcp_plus(None, response, PAYLOAD_RAKP4)
+        session.established = True
+        session.last_active = time.monotonic()
+        return packet
+
+    # IPMI message dispatch
+
+    async def handle_ipmi_message(self, message, session, system_id):
+        if len(message) < 7:
+            return None
+        rs_addr, netfn_lun, rq_addr, rq_seq, cmd = message[0], message[1], message[3], message[4], message[5]
+        netfn = netfn_lun >> 2
+        data = message[6:-1]
+
+        if session is None and (netfn, cmd) not in ((NETFN_APP, 0x38), (NETFN_APP, 0x54)):
+            return None
+
+        handler = self.COMMANDS.get((netfn, cmd))
+        if handler is None:
+            completion, body = CC_INVALID_COMMAND, b''
+        else:
+            try:
+                result = handler(self, data, session, system_id)
+                # Handlers that touch the state store are coroutines
+                completion, body = await result if asyncio.iscoroutine(result) else result
+            except (IndexError, struct.error):
+                completion, body = CC_INVALID_DATA, b''
+
+        header = bytes([rq_addr, ((netfn + 1) << 2) | (netfn_lun & 0x03)])
+        rest = bytes([rs_addr, rq_seq, cmd, completion]) + body
+        return header + bytes([checksum(header)]) + rest + bytes([checksum(rest)])
+
+    def require(self, session, privilege):
+        return session is not None and session.privilege >= privilege
+
+    def cmd_get_device_id(self, data, session, system_id):
+        # Device rev without device SDRs; chassis, SDR repository and sensor device
+        return CC_OK, bytes([0x20, 0x01, 0x01, 0x00, 0x02, 0x83,
+                             0x00, 0x00, 0x00, 0x00, 0x00])
+
+    def cmd_get_channel_auth_capabilities(self, data, session, system_id):
+        return CC_OK, bytes([0x01, 0x80, 0x04, 0x02, 0x00, 0x00, 0x00, 0x00])
+
+    def cmd_get_channel_cipher_suites(self, data, session, system_id):
+        index = data[2] & 0x3f
+        records = b''
+        for suite, (auth, integrity, confidentiality) in CIPHER_SUITES.items():
+            if confidentiality in CONFIDENTIALITY_ALGORITHMS:
+                records += bytes([0xc0, suite, auth, 0x40 | integrity, 0x80 | confidentiality])
+        return CC_OK, bytes([0x01]) + records[index * 16:(index + 1) * 16]
+
+    def cmd_set_session_privilege(self, data, session, system_id):
+        requested = data[0] & 0x0f
+        if requested:
+            if requested > min(session.max_privilege, session.role & 0x0f or PRIV_ADMIN):
+                return CC_INSUFFICIENT_PRIVILEGE, b''
+            session.privilege = requested
+        return CC_OK, bytes([session.privilege])
+
+    def cmd_close_session(self, data, session, system_id):
+        sid = struct.unpack('<I', data[0:4])[0]
+        closing = self.sessions.get(sid)
+        if closing is None or closing.system_id != system_id:
+            return 0x87, b''
+        del self.sessions[sid]
+        return CC_OK, b''
+
+    async def cmd_get_chassis_status(self, data, session, system_id):
+        state = await self.read_state(system_id)
+        power = 0x01 if state.get('power_state') == 'On' else 0x00
+        return CC_OK, bytes([power, 0x00, 0x00])
+
+    async def cmd_chassis_control(self, data, session, system_id):
+        if not self.require(session, PRIV_OPERATOR):
+            return CC_INSUFFICIENT_PRIVILEGE, b''
+        control = data[0] & 0x0f
+        # Published with the same ResetType names as the Redfish Reset action
+        reset_type = {0x00: 'ForceOff', 0x01: 'On', 0x02: 'ForceRestart',
+                      0x03: 'ForceRestart', 0x05: 'GracefulShutdown'}.get(control)
+        if reset_type is None:
+            return CC_INVALID_DATA, b''
+        power_state = 'Off' if reset_type in ('ForceOff', 'GracefulShutdown') else 'On'
+
+        def apply_control(state):
+            state['power_state'] = power_state
+            return state
+
+        await self.write_state(apply_control, system_id, event={'reset_type': reset_type})
+        logger.info(f"System {system_id} chassis control {control:#x} -> {power_state}")
+        return CC_OK, b''
+
+    def cmd_chassis_identify(self, data, session, system_id):
+        return CC_OK, b''
+
+    async def cmd_set_boot_options(self, data, session, system_id):
+        if not self.require(session, PRIV_OPERATOR):
+            return CC_INSUFFICIENT_PRIVILEGE, b''
+        parameter = data[0] & 0x7f
+        if parameter != 0x05:
+            # Set-in-progress, boot info acknowledge etc. are accepted as no-ops
+            return CC_OK, b''
+        flags, selector = data[1], (data[2] >> 2) & 0x0f
+        if selector not in BOOT_DEVICES:
+            return CC_INVALID_DATA, b''
+
+        def apply_boot(state):
+            state['boot_device'] = BOOT_DEVICES[selector]
+            if not flags & 0x80:
+                state['boot_override'] = 'Disabled'
+            else:
+                state['boot_override'] = 'Continuous' if flags & 0x40 else 'Once'
+            return state
+
+        await self.write_state(apply_boot, system_id)
+        logger.info(f"System {system_id} boot device set to {BOOT_DEVICES[selector]}")
+        return CC_OK, b''
+
+    async def cmd_get_boot_options(self, data, session, system_id):
+        parameter = data[0] & 0x7f
+        if parameter == 0x00:
+            return CC_OK, bytes([0x01, parameter, 0x00])
+        if parameter == 0x04:
+            return CC_OK, bytes([0x01, parameter, 0x00, 0x00])
+        if parameter != 0x05:
+            return CC_PARAM_NOT_SUPPORTED, b''
+        state = await self.read_state(system_id)
+        override = state.get('boot_override', 'Disabled')
+        flags = 0x00
+        if override != 'Disabled':
+            flags = 0x80 | (0x40 if override == 'Continuous' else 0x00)
+        selector = BOOT_SELECTORS.get(state.get('boot_device'), 0x00)
+        return CC_OK, bytes([0x01, parameter, flags, selector << 2, 0x00, 0x00, 0x00])
+
+    def sensor_reading(self, sensor, system_id):
+        """Raw (linearized) reading for one sensor from the shared sensor arrays"""
+        channel, default, m = sensor[5], sensor[6], sensor[7]
+        readings = self.sensors.read(system_id)
+        value = readings[channel] if readings else default
+        return max(0, min(255, int(round(value / m))))
+
+    def cmd_get_sensor_reading(self, data, session, system_id):
+        for sensor in SENSORS:
+            if sensor[0] == data[0]:
+                return CC_OK, bytes([self.sensor_reading(sensor, system_id), 0x40, 0x00])
+        return CC_NOT_PRESENT, b''
+
+    def cmd_get_sdr_repository_info(self, data, session, system_id):
+        return CC_OK, bytes([0x51]) + struct.pack('<HH', len(self.sdr_records), 0) \
+            + b'\x00' * 8 + bytes([0x02])
+
+    def cmd_reserve_sdr_repository(self, data, session, system_id):
+        self.sdr_reservation = (self.sdr_reservation % 0xffff) + 1
+        return CC_OK, struct.pack('<H', self.sdr_reservation)
+
+    def cmd_get_sdr(self, data, session, system_id):
+        reservation, record_id, offset, count = struct.unpack('<HHBB', data[0:6])
+        if offset and reservation != self.sdr_reservation:
+            return CC_INVALID_RESERVATION, b''
+        if record_id >= len(self.sdr_records):
+            return CC_NOT_PRESENT, b''
+        record = self.sdr_records[record_id]
+        next_id = record_id + 1 if record_id + 1 < len(self.sdr_records) else 0xffff
+        end = len(record) if count == 0xff else offset + count
+        return CC_OK, struct.pack('<H', next_id) + record[offset:end]
+
+    COMMANDS = {
+        (NETFN_APP, 0x01): cmd_get_device_id,
+        (NETFN_APP, 0x38): cmd_get_channel_auth_capabilities,
+        (NETFN_APP, 0x3B): cmd_set_session_privilege,
+        (NETFN_APP, 0x3C): cmd_close_session,
+        (NETFN_APP, 0x54): cmd_get_channel_cipher_suites,
+        (NETFN_CHASSIS, 0x01): cmd_get_chassis_status,
+        (NETFN_CHASSIS, 0x02): cmd_chassis_control,
+        (NETFN_CHASSIS, 0x04): cmd_chassis_identify,
+        (NETFN_CHASSIS, 0x08): cmd_set_boot_options,
+        (NETFN_CHASSIS, 0x09): cmd_get_boot_options,
+        (NETFN_SENSOR, 0x2D): cmd_get_sensor_reading,
+        (NETFN_STORAGE, 0x20): cmd_get_sdr_repository_info,
+        (NETFN_STORAGE, 0x22): cmd_reserve_sdr_repository,
+        (NETFN_STORAGE, 0x23): cmd_get_sdr,
+    }
+
+    async def serve(self):
+        """Bind one UDP endpoint per system and expire idle sessions"""
+        loop = asyncio.get_running_loop()
+        for offset in range(self.system_count):
+            system_id = str(int(self.system_id) + offset)
+            await loop.create_datagram_endpoint(
+                lambda system_id=system_id: IPMIProtocol(self, system_id),
+                local_addr=(self.host, self.port + offset)
+            )
+        while True:
+            await asyncio.sleep(SESSION_TIMEOUT / 2)
+            self.expire_sessions()
+
     def run(self):
         """Run IPMI simulator"""
         logger.info(f"Starting IPMI simulator on {self.host}:{self.port}")
+        if self.system_count > 1:
+            logger.info(f"Systems {self.system_id}..{int(self.system_id) + self.system_count - 1} "
+                        f"on ports {self.port}..{self.port + self.system_count - 1}")
+        if Cipher is None:
+            logger.info("cryptography not installed; AES cipher suites (3, 17) disabled")
         logger.info("IPMI interface ready")
         logger.info("Use: ipmitool -I lanplus -H <host> -U openbmc -P 0penBmc")
-        
-        # Keep running
+
         try:
-            while True:
-                import time
-                time.sleep(10)
-                logger.debug(f"Current state: {self.state}")
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
             logger.info("IPMI simulator stopped")
 
+
 if __name__ == '__main__':
-    simulator = IPMISimulator()
+    parser = argparse.ArgumentParser(description='IPMI-over-LAN BMC simulator')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to bind')
+    parser.add_argument('--port', type=int, default=623, help='UDP port for the first system')
+    parser.add_argument('--system-id', default='1', help='First system served')
+    parser.add_argument('--systems', type=int, default=1,
+                        help='Number of systems; system N listens on port + N - 1')
+    args = parser.parse_args()
+
+    simulator = IPMISimulator(args.host, args.port, args.system_id, args.systems)
     simulator.run()
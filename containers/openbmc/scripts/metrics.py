@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+BMC Metrics
+Prometheus-style counters, gauges and histograms shared across gunicorn
+workers: each process publishes a snapshot file and any worker can render
+the totals for /metrics
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('metrics')
+
+METRICS_DIR = os.environ.get('OPENBMC_METRICS_DIR', '/run/openbmc/metrics')
+
+# Seconds; fine at the low end where cached Redfish reads land
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+class Metrics:
+    """
+    Metrics for one process.
+
+    Updates only touch in-process dicts under a lock. A background thread
+    writes them to <directory>/<pid>.json every flush_interval, so render()
+    in any worker sees every worker's values at most that old (its own are
+    always current). Files of exited workers keep counting towards
+    counters and histograms; their gauges are dropped.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self.descriptions = {}    # name -> (type, help)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}      # key -> [bucket counts..., sum, count]
+
+    def _check_process(self):
+        # Values and the flush thread must not cross a fork (gunicorn workers)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._reset()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Metrics directory unavailable, serving local values only: {e}")
+            return
+        thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        thread.start()
+
+    def describe(self, name, kind, text):
+        """Register a metric's type ('counter', 'gauge', 'histogram') and help text"""
+        self.descriptions[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        self._check_process()
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name, value, **labels):
+        """Move a gauge up or down"""
+        self._check_process()
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        self._check_process()
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[n, dict(l), v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, dict(l), v] for (n, l), v in self.gauges.items()],
+                'histograms': [[n, dict(l), list(h)] for (n, l), h in self.histograms.items()],
+            }
+
+    def _flush_loop(self):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                tmp = f"{path}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(self.snapshot(), f, separators=(',', ':'))
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"Metrics flush failed: {e}")
+
+    def collect(self):
+        """Snapshots of every process, with this process's live values"""
+        own = self.snapshot()
+        snapshots = [own]
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith('.json') or name == f"{own['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not os.path.exists(f"/proc/{snapshot['pid']}"):
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self):
+        """All processes' metrics summed, in the Prometheus text format"""
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                key = _key(name, labels)
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in snapshot['gauges']:
+                key = _key(name, labels)
+                gauges[key] = gauges.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = _key(name, labels)
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, v in enumerate(values):
+                    total[i] += v
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            _, text = self.descriptions.get(name, (kind, name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), values in sorted(histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {values[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return '\n'.join(lines) + '\n'
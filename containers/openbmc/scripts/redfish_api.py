@@ -4,9 +4,19 @@ Redfish API Server
 Provides RESTful API for BMC management
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, request
+from flask import jsonify as flask_jsonify
+from datetime import datetime, timezone
+import hashlib
 import json
 import logging
+import os
+import re
+import time
+
+from metrics import Metrics
+from sensor_engine import SensorArray
+from state_store import StateStore
 
 app = Flask(__name__)
 
@@ -16,122 +26,557 @@ logging.basicConfig(
 )
 logger = logging.getLogger('redfish-api')
 
-# State management
-STATE_FILE = '/var/lib/openbmc/state.json'
+# State management (shared by all gunicorn workers)
+SYSTEM_COUNT = int(os.environ.get('REDFISH_SYSTEM_COUNT', '1'))
+PAGE_SIZE = int(os.environ.get('REDFISH_PAGE_SIZE', '1000'))
+# Seconds between SSE keep-alive comments on an idle stream
+SSE_KEEPALIVE = float(os.environ.get('REDFISH_SSE_KEEPALIVE', '15'))
+# Serialized documents kept per worker before the cache is dropped and refilled
+DOCUMENT_CACHE_SIZE = int(os.environ.get('REDFISH_DOCUMENT_CACHE_SIZE', '100000'))
 
-def load_state():
-    try:
-        with open(STATE_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return {
-            'power_state': 'Off',
-            'boot_device': 'Hdd',
-            'boot_override': 'Disabled'
-        }
+metrics = Metrics()
+metrics.describe('redfish_requests_total', 'counter', 'Requests by route, method and status')
+metrics.describe('redfish_request_duration_seconds', 'histogram',
+                 'Time from receiving a request to returning its response')
+metrics.describe('redfish_serialize_duration_seconds', 'histogram',
+                 'Time spent encoding JSON response bodies')
+metrics.describe('redfish_response_bytes_total', 'counter', 'Response body bytes by route')
+metrics.describe('redfish_document_cache_total', 'counter',
+                 'Serialized document lookups by result (hit, miss, not_modified)')
+metrics.describe('redfish_requests_in_flight', 'gauge', 'Requests being handled per worker')
+metrics.describe('redfish_worker_requests_total', 'counter', 'Requests handled per worker')
+metrics.describe('state_store_duration_seconds', 'histogram',
+                 'State store load (get) and save (update) latency')
+metrics.describe('state_store_bytes_total', 'counter',
+                 'State JSON bytes decoded on load and written on save')
 
-def save_state(state):
-    with open(STATE_FILE, 'w') as f:
-        json.dump(state, f, indent=2)
+def record_store(operation, seconds, nbytes):
+    metrics.observe('state_store_duration_seconds', seconds, operation=operation)
+    if nbytes:
+        metrics.inc('state_store_bytes_total', nbytes, operation=operation)
 
-@app.route('/redfish/v1/')
-def service_root():
+store = StateStore(stats=record_store)
+store.ensure_systems(SYSTEM_COUNT)
+sensors = SensorArray()
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def jsonify(*args, **kwargs):
+    """flask.jsonify, timing the encoding per route"""
+    start = time.perf_counter()
+    response = flask_jsonify(*args, **kwargs)
+    metrics.observe('redfish_serialize_duration_seconds', time.perf_counter() - start,
+                    route=route_label())
+    return response
+
+# Serialized documents: key -> (version, body, etag)
+documents = {}
+
+def serialize(document):
+    """Encode a document as jsonify does and derive its ETag from the bytes"""
+    body = (json.dumps(document, separators=(',', ':'), sort_keys=True) + '\n').encode()
+    return body, hashlib.blake2b(body, digest_size=8).hexdigest()
+
+def cached_document(key, version, build):
+    """
+    Serialized document for key, calling build() for a fresh document only
+    when version differs from the cached one. ETags come from the content,
+    so every worker hands out the same ETag for the same document.
+    """
+    entry = documents.get(key)
+    if entry is not None and entry[0] == version:
+        metrics.inc('redfish_document_cache_total', result='hit')
+        return entry[1], entry[2]
+    metrics.inc('redfish_document_cache_total', result='miss')
+    document = build()
+    start = time.perf_counter()
+    body, etag = serialize(document)
+    metrics.observe('redfish_serialize_duration_seconds', time.perf_counter() - start,
+                    route=route_label())
+    if len(documents) >= DOCUMENT_CACHE_SIZE:
+        documents.clear()
+    documents[key] = (version, body, etag)
+    return body, etag
+
+def document_response(body, etag):
+    """The document, or 304 Not Modified if the client already holds it"""
+    if request.if_none_match.contains_weak(etag):
+        metrics.inc('redfish_document_cache_total', result='not_modified')
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+@app.before_request
+def start_request():
+    g.start = time.perf_counter()
+    metrics.add('redfish_requests_in_flight', 1, worker=str(os.getpid()))
+
+@app.after_request
+def record_request(response):
+    route = route_label()
+    elapsed = time.perf_counter() - g.start
+    metrics.inc('redfish_requests_total', route=route, method=request.method,
+                status=str(response.status_code))
+    metrics.observe('redfish_request_duration_seconds', elapsed,
+                    route=route, method=request.method)
+    metrics.inc('redfish_worker_requests_total', worker=str(os.getpid()))
+    # Streams (SSE) have no length up front and are not counted
+    if response.content_length is not None:
+        metrics.inc('redfish_response_bytes_total', response.content_length, route=route)
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    if 'start' in g:
+        metrics.add('redfish_requests_in_flight', -1, worker=str(os.getpid()))
+
+def redfish_error(status, message):
     return jsonify({
-        "@odata.type": "#ServiceRoot.v1_0_0.ServiceRoot",
-        "@odata.id": "/redfish/v1/",
-        "Id": "RootService",
-        "Name": "DC Simulator Redfish Service",
-        "RedfishVersion": "1.0.0",
-        "UUID": "12345678-1234-1234-1234-123456789012",
-        "Systems": {
-            "@odata.id": "/redfish/v1/Systems"
+        "error": {
+            "code": "Base.1.0.GeneralError",
+            "message": message
+        }
+    }), status
+
+def query_int(name, default, minimum=0):
+    """Parse an integer query option such as $top or $skip, at least minimum"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.isdigit() or int(value) < minimum:
+        raise ValueError(f"{name} must be an integer of at least {minimum}")
+    return int(value)
+
+def select_fields(document, select):
+    """Apply a $select list (top-level or Parent/Child paths) to a document"""
+    if not select:
+        return document
+    selected = {k: v for k, v in document.items() if k.startswith('@odata.')}
+    for path in select:
+        head, _, rest = path.partition('/')
+        if head not in document:
+            continue
+        if rest and isinstance(document[head], dict):
+            nested = select_fields(document[head], [rest])
+            selected.setdefault(head, {}).update(nested)
+        else:
+            selected[head] = document[head]
+    return selected
+
+def system_document(system_id, state):
+    return {
+        "@odata.type": "#ComputerSystem.v1_0_0.ComputerSystem",
+        "@odata.id": f"/redfish/v1/Systems/{system_id}",
+        "Id": system_id,
+        "Name": f"Server Node {system_id}",
+        "SystemType": "Physical",
+        "PowerState": state.get('power_state', 'Off'),
+        "BootProgress": state.get('boot_progress') or {"LastState": "None"},
+        "Boot": {
+            "BootSourceOverrideEnabled": state.get('boot_override', 'Disabled'),
+            "BootSourceOverrideTarget": state.get('boot_device', 'Hdd'),
+            "BootSourceOverrideTarget@Redfish.AllowableValues": [
+                "None", "Pxe", "Hdd", "Cd", "BiosSetup"
+            ]
+        },
+        "ProcessorSummary": {
+            "Count": 2,
+            "Model": "Intel Xeon E5-2620"
+        },
+        "MemorySummary": {
+            "TotalSystemMemoryGiB": 16
         },
-        "Chassis": {
-            "@odata.id": "/redfish/v1/Chassis"
+        "Links": {
+            "Chassis": [{"@odata.id": f"/redfish/v1/Chassis/{system_id}"}]
         },
-        "Managers": {
-            "@odata.id": "/redfish/v1/Managers"
+        "Oem": {
+            "DCSimulator": {
+                "HostPid": state.get('host_pid')
+            }
+        },
+        "Actions": {
+            "#ComputerSystem.Reset": {
+                "target": f"/redfish/v1/Systems/{system_id}/Actions/ComputerSystem.Reset",
+                "ResetType@Redfish.AllowableValues": [
+                    "On", "ForceOff", "GracefulShutdown", "GracefulRestart", "ForceRestart"
+                ]
+            }
         }
-    })
+    }
+
+def chassis_document(chassis_id, state):
+    return {
+        "@odata.type": "#Chassis.v1_5_0.Chassis",
+        "@odata.id": f"/redfish/v1/Chassis/{chassis_id}",
+        "Id": chassis_id,
+        "Name": f"Chassis {chassis_id}",
+        "ChassisType": "RackMount",
+        "PowerState": state.get('power_state', 'Off'),
+        "Thermal": {"@odata.id": f"/redfish/v1/Chassis/{chassis_id}/Thermal"},
+        "Power": {"@odata.id": f"/redfish/v1/Chassis/{chassis_id}/Power"},
+        "Links": {
+            "ComputerSystems": [{"@odata.id": f"/redfish/v1/Systems/{chassis_id}"}]
+        }
+    }
+
+def sensor_status(readings, powered=True):
+    if readings is None:
+        return {"State": "UnavailableOffline", "Health": None}
+    return {"State": "Enabled" if powered else "StandbyOffline", "Health": "OK"}
+
+def sensor_value(readings, channel, digits=1):
+    if readings is None:
+        return None
+    return round(readings[channel], digits)
+
+def thermal_document(chassis_id, readings, powered):
+    base = f"/redfish/v1/Chassis/{chassis_id}/Thermal"
+    temperatures = [
+        ("CPU Temp", 'cpu_temp', "CPU", 85, 95),
+        ("Inlet Temp", 'inlet_temp', "Intake", 35, 40),
+        ("System Temp", 'system_temp', "Exhaust", 60, 70),
+    ]
+    return {
+        "@odata.type": "#Thermal.v1_4_0.Thermal",
+        "@odata.id": base,
+        "Id": "Thermal",
+        "Name": "Thermal",
+        "Temperatures": [{
+            "@odata.id": f"{base}#/Temperatures/{i}",
+            "MemberId": str(i),
+            "Name": name,
+            "ReadingCelsius": sensor_value(readings, channel),
+            "UpperThresholdCritical": critical,
+            "UpperThresholdFatal": fatal,
+            "PhysicalContext": context,
+            "Status": sensor_status(readings)
+        } for i, (name, channel, context, critical, fatal) in enumerate(temperatures)],
+        "Fans": [{
+            "@odata.id": f"{base}#/Fans/{i}",
+            "MemberId": str(i),
+            "Name": f"Fan{i + 1}",
+            "Reading": sensor_value(readings, f'fan{i + 1}_speed', 0),
+            "ReadingUnits": "RPM",
+            "PhysicalContext": "SystemBoard",
+            "Status": sensor_status(readings, powered)
+        } for i in range(4)]
+    }
+
+def power_document(chassis_id, readings, powered):
+    base = f"/redfish/v1/Chassis/{chassis_id}/Power"
+    return {
+        "@odata.type": "#Power.v1_5_0.Power",
+        "@odata.id": base,
+        "Id": "Power",
+        "Name": "Power",
+        "PowerControl": [{
+            "@odata.id": f"{base}#/PowerControl/0",
+            "MemberId": "0",
+            "Name": "System Power Control",
+            "PowerConsumedWatts": sensor_value(readings, 'power_watts'),
+            "PowerCapacityWatts": 800,
+            "Status": sensor_status(readings)
+        }],
+        "PowerSupplies": [{
+            "@odata.id": f"{base}#/PowerSupplies/{i}",
+            "MemberId": str(i),
+            "Name": f"PSU{i + 1}",
+            "PowerSupplyType": "AC",
+            "PowerCapacityWatts": 400,
+            "LastPowerOutputWatts": sensor_value(readings, f'psu{i + 1}_watts'),
+            "Status": sensor_status(readings, powered)
+        } for i in range(2)]
+    }
+
+def redfish_event(event):
+    """Render a state store event as a Redfish Event record"""
+    origin = f"/redfish/v1/Systems/{event['system_id']}"
+    state = event['state']
+    if 'reset_type' in event:
+        message = f"System {event['system_id']} reset: {event['reset_type']}"
+    else:
+        message = f"System {event['system_id']} changed: {', '.join(event['changed'])}"
+    oem = {
+        "PowerState": state['power_state'],
+        "BootSourceOverrideTarget": state['boot_device'],
+        "BootSourceOverrideEnabled": state['boot_override']
+    }
+    if 'reset_type' in event:
+        oem["ResetType"] = event['reset_type']
+    return {
+        "EventType": "StatusChange" if 'power_state' in event['changed'] or 'reset_type' in event
+                     else "ResourceUpdated",
+        "EventId": str(event['seq']),
+        "EventTimestamp": datetime.fromtimestamp(event['timestamp'], timezone.utc).isoformat(),
+        "MessageId": "ResourceEvent.1.0.ResourceChanged",
+        "Message": message,
+        "OriginOfCondition": {"@odata.id": origin},
+        "Oem": {"DCSimulator": oem}
+    }
+
+def parse_event_filter(expression):
+    """
+    Parse an SSE $filter such as "EventType eq 'StatusChange'" or
+    "OriginResource eq '/redfish/v1/Systems/1' or OriginResource eq ..."
+    into {property: set(values)}. Terms on the same property are OR-ed,
+    different properties are AND-ed.
+    """
+    terms = {}
+    if not expression:
+        return terms
+    for clause in re.split(r'\s+or\s+|\s+and\s+', expression.strip()):
+        match = re.fullmatch(r"\(?\s*(EventType|OriginResource)\s+eq\s+'([^']*)'\s*\)?", clause)
+        if not match:
+            raise ValueError(f"Unsupported $filter term: {clause}")
+        terms.setdefault(match.group(1), set()).add(match.group(2))
+    return terms
+
+def event_matches(record, terms):
+    if 'EventType' in terms and record['EventType'] not in terms['EventType']:
+        return False
+    origin = record['OriginOfCondition']['@odata.id']
+    if 'OriginResource' in terms and origin not in terms['OriginResource']:
+        return False
+    return True
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of every worker's metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Static documents, serialized once per worker
+SERVICE_ROOT = serialize({
+    "@odata.type": "#ServiceRoot.v1_0_0.ServiceRoot",
+    "@odata.id": "/redfish/v1/",
+    "Id": "RootService",
+    "Name": "DC Simulator Redfish Service",
+    "RedfishVersion": "1.0.0",
+    "UUID": "12345678-1234-1234-1234-123456789012",
+    "Systems": {
+        "@odata.id": "/redfish/v1/Systems"
+    },
+    "Chassis": {
+        "@odata.id": "/redfish/v1/Chassis"
+    },
+    "Managers": {
+        "@odata.id": "/redfish/v1/Managers"
+    },
+    "EventService": {
+        "@odata.id": "/redfish/v1/EventService"
+    }
+})
+
+EVENT_SERVICE = serialize({
+    "@odata.type": "#EventService.v1_3_0.EventService",
+    "@odata.id": "/redfish/v1/EventService",
+    "Id": "EventService",
+    "Name": "Event Service",
+    "ServiceEnabled": True,
+    "EventTypesForSubscription": ["StatusChange", "ResourceUpdated"],
+    "ServerSentEventUri": "/redfish/v1/EventService/SSE",
+    "SSEFilterPropertiesSupported": {
+        "EventType": True,
+        "OriginResource": True
+    }
+})
+
+@app.route('/redfish/v1/')
+def service_root():
+    return document_response(*SERVICE_ROOT)
+
+@app.route('/redfish/v1/Chassis')
+def chassis_collection():
+    try:
+        skip = query_int('$skip', 0)
+        top = min(query_int('$top', PAGE_SIZE, minimum=1), PAGE_SIZE)
+    except ValueError as e:
+        return redfish_error(400, str(e))
+    total = store.count()
+    ids = store.list_ids(skip, top)
+    document = {
+        "@odata.type": "#ChassisCollection.ChassisCollection",
+        "@odata.id": "/redfish/v1/Chassis",
+        "Name": "Chassis Collection",
+        "Members@odata.count": total,
+        "Members": [{"@odata.id": f"/redfish/v1/Chassis/{i}"} for i in ids]
+    }
+    if skip + len(ids) < total:
+        document["Members@odata.nextLink"] = \
+            f"/redfish/v1/Chassis?$skip={skip + len(ids)}&$top={top}"
+    return jsonify(document)
+
+@app.route('/redfish/v1/Chassis/<chassis_id>')
+def chassis_resource(chassis_id):
+    version = store.version(chassis_id)
+    if version is None:
+        return redfish_error(404, f"Chassis {chassis_id} not found")
+    return document_response(*cached_document(
+        ('Chassis', chassis_id), version,
+        lambda: chassis_document(chassis_id, store.get(chassis_id))))
+
+@app.route('/redfish/v1/Chassis/<chassis_id>/Thermal')
+def chassis_thermal(chassis_id):
+    state = store.get(chassis_id)
+    if state is None:
+        return redfish_error(404, f"Chassis {chassis_id} not found")
+    return jsonify(thermal_document(chassis_id, sensors.read(chassis_id),
+                                    state.get('power_state') == 'On'))
+
+@app.route('/redfish/v1/Chassis/<chassis_id>/Power')
+def chassis_power(chassis_id):
+    state = store.get(chassis_id)
+    if state is None:
+        return redfish_error(404, f"Chassis {chassis_id} not found")
+    return jsonify(power_document(chassis_id, sensors.read(chassis_id),
+                                  state.get('power_state') == 'On'))
+
+@app.route('/redfish/v1/EventService')
+def event_service():
+    return document_response(*EVENT_SERVICE)
+
+@app.route('/redfish/v1/EventService/SSE')
+def event_stream():
+    """
+    Server-sent event stream of power and boot changes. Each SSE id is the
+    EventId, so a client reconnecting with Last-Event-ID resumes where it
+    left off; new subscribers start from the current event.
+    """
+    try:
+        terms = parse_event_filter(request.args.get('$filter'))
+    except ValueError as e:
+        return redfish_error(400, str(e))
+    last_id = request.headers.get('Last-Event-ID', '')
+    seq = int(last_id) if last_id.isdigit() else store.last_event_seq()
+
+    def generate(seq):
+        yield ": connected\n\n"
+        while True:
+            if not store.wait_for_events(seq, SSE_KEEPALIVE):
+                yield ": keep-alive\n\n"
+                continue
+            for event in store.events_since(seq):
+                seq = event['seq']
+                record = redfish_event(event)
+                if not event_matches(record, terms):
+                    continue
+                payload = {
+                    "@odata.type": "#Event.v1_4_0.Event",
+                    "Id": record['EventId'],
+                    "Name": "DC Simulator Event",
+                    "Events": [record]
+                }
+                yield f"id: {seq}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(generate(seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/redfish/v1/Systems')
 def systems_collection():
-    return jsonify({
-        "@odata.type": "#ComputerSystemCollection.ComputerSystemCollection",
-        "@odata.id": "/redfish/v1/Systems",
-        "Name": "Computer System Collection",
-        "Members@odata.count": 1,
-        "Members": [
-            {"@odata.id": "/redfish/v1/Systems/1"}
-        ]
-    })
-
-@app.route('/redfish/v1/Systems/1', methods=['GET', 'PATCH'])
-def system_1():
-    state = load_state()
+    try:
+        skip = query_int('$skip', 0)
+        top = query_int('$top', PAGE_SIZE, minimum=1)
+    except ValueError as e:
+        return redfish_error(400, str(e))
+    top = min(top, PAGE_SIZE)
+    select = [f for f in request.args.get('$select', '').split(',') if f]
+    expand_option = request.args.get('$expand')
+    expand = expand_option in ('.', '*')
+
+    def build():
+        total = store.count()
+        ids = store.list_ids(skip, top)
+
+        if expand:
+            members = [select_fields(system_document(i, store.get(i)), select)
+                       for i in ids]
+        else:
+            members = [{"@odata.id": f"/redfish/v1/Systems/{i}"} for i in ids]
+
+        document = {
+            "@odata.type": "#ComputerSystemCollection.ComputerSystemCollection",
+            "@odata.id": "/redfish/v1/Systems",
+            "Name": "Computer System Collection",
+            "Members@odata.count": total,
+            "Members": members
+        }
+        if skip + len(ids) < total:
+            next_query = f"$skip={skip + len(ids)}&$top={top}"
+            if expand:
+                next_query += f"&$expand={expand_option}"
+            if select:
+                next_query += f"&$select={','.join(select)}"
+            document["Members@odata.nextLink"] = f"/redfish/v1/Systems?{next_query}"
+        if select and not expand:
+            document = select_fields(document, select)
+        return document
+
+    # Member links only change when systems are added; expanded members
+    # change with any system's state
+    version = store.version() if expand else store.count()
+    key = ('Systems', skip, top, expand_option if expand else None, tuple(select))
+    return document_response(*cached_document(key, version, build))
+
+@app.route('/redfish/v1/Systems/<system_id>', methods=['GET', 'PATCH'])
+def system_resource(system_id):
+    version = store.version(system_id)
+    if version is None:
+        return redfish_error(404, f"System {system_id} not found")
     
     if request.method == 'GET':
-        return jsonify({
-            "@odata.type": "#ComputerSystem.v1_0_0.ComputerSystem",
-            "@odata.id": "/redfish/v1/Systems/1",
-            "Id": "1",
-            "Name": "Server Node 1",
-            "SystemType": "Physical",
-            "PowerState": state.get('power_state', 'Off'),
-            "Boot": {
-                "BootSourceOverrideEnabled": state.get('boot_override', 'Disabled'),
-                "BootSourceOverrideTarget": state.get('boot_device', 'Hdd'),
-                "BootSourceOverrideTarget@Redfish.AllowableValues": [
-                    "None", "Pxe", "Hdd", "Cd", "BiosSetup"
-                ]
-            },
-            "ProcessorSummary": {
-                "Count": 2,
-                "Model": "Intel Xeon E5-2620"
-            },
-            "MemorySummary": {
-                "TotalSystemMemoryGiB": 16
-            },
-            "Actions": {
-                "#ComputerSystem.Reset": {
-                    "target": "/redfish/v1/Systems/1/Actions/ComputerSystem.Reset",
-                    "ResetType@Redfish.AllowableValues": [
-                        "On", "ForceOff", "GracefulShutdown", "GracefulRestart", "ForceRestart"
-                    ]
-                }
-            }
-        })
+        select = [f for f in request.args.get('$select', '').split(',') if f]
+        return document_response(*cached_document(
+            ('System', system_id, tuple(select)), version,
+            lambda: select_fields(system_document(system_id, store.get(system_id)), select)))
     
     elif request.method == 'PATCH':
         data = request.get_json()
+        boot_config = data.get('Boot') or {}
+        # HostPid is set by the bridge so the sensor engine can follow the
+        # VM's load; BootProgress by virtual nodes, which have no firmware
+        # to report it
+        oem = (data.get('Oem') or {}).get('DCSimulator') or {}
         
-        if 'Boot' in data:
-            boot_config = data['Boot']
+        def apply(state):
             if 'BootSourceOverrideTarget' in boot_config:
                 state['boot_device'] = boot_config['BootSourceOverrideTarget']
             if 'BootSourceOverrideEnabled' in boot_config:
                 state['boot_override'] = boot_config['BootSourceOverrideEnabled']
-            save_state(state)
-            logger.info(f"Boot configuration updated: {boot_config}")
+            if 'HostPid' in oem:
+                state['host_pid'] = oem['HostPid']
+            if 'BootProgress' in oem:
+                state['boot_progress'] = oem['BootProgress']
+            return state
+        
+        # One transaction, so subscribers see the whole PATCH in one event
+        if boot_config or 'HostPid' in oem or 'BootProgress' in oem:
+            store.update(system_id, apply)
+        if boot_config:
+            logger.info(f"System {system_id} boot configuration updated: {boot_config}")
         
         return jsonify({'status': 'success'}), 200
 
-@app.route('/redfish/v1/Systems/1/Actions/ComputerSystem.Reset', methods=['POST'])
-def system_reset():
+@app.route('/redfish/v1/Systems/<system_id>/Actions/ComputerSystem.Reset', methods=['POST'])
+def system_reset(system_id):
+    if store.get(system_id) is None:
+        return redfish_error(404, f"System {system_id} not found")
+
     data = request.get_json()
     reset_type = data.get('ResetType', 'On')
     
-    state = load_state()
-    
-    if reset_type == 'On':
-        state['power_state'] = 'On'
-    elif reset_type in ['ForceOff', 'GracefulShutdown']:
-        state['power_state'] = 'Off'
-    elif reset_type in ['GracefulRestart', 'ForceRestart']:
-        state['power_state'] = 'On'  # Simulate restart
+    def apply_reset(state):
+        if reset_type == 'On':
+            state['power_state'] = 'On'
+        elif reset_type in ['ForceOff', 'GracefulShutdown']:
+            state['power_state'] = 'Off'
+        elif reset_type in ['GracefulRestart', 'ForceRestart']:
+            state['power_state'] = 'On'  # Simulate restart
+        return state
     
-    save_state(state)
-    logger.info(f"System reset requested: {reset_type}")
+    store.update(system_id, apply_reset, event={'reset_type': reset_type})
+    logger.info(f"System {system_id} reset requested: {reset_type}")
     
     return jsonify({'status': 'success', 'message': f'Reset {reset_type} executed'}), 200
 
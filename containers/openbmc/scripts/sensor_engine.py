@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+BMC Sensor Engine
+Simulates temperatures, fans and PSU power for every system in NumPy arrays,
+driven by the CPU load of each system's QEMU process, and publishes them in
+a shared memory-mapped file read by the Redfish and IPMI services
+"""
+
+import argparse
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+
+from state_store import StateStore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('sensor-engine')
+
+SENSOR_FILE = os.environ.get('OPENBMC_SENSOR_FILE', '/var/lib/openbmc/sensors.dat')
+
+# One float32 column per channel, one row per system (system N is row N - 1)
+CHANNELS = (
+    'cpu_load',       # 0..1, fraction of the VM's vCPUs in use
+    'cpu_temp',       # degrees C
+    'inlet_temp',
+    'system_temp',    # exhaust
+    'fan1_speed',     # RPM
+    'fan2_speed',
+    'fan3_speed',
+    'fan4_speed',
+    'psu1_watts',
+    'psu2_watts',
+    'power_watts',    # total consumed
+)
+COLUMN = {name: i for i, name in enumerate(CHANNELS)}
+FANS = [COLUMN[f'fan{i}_speed'] for i in range(1, 5)]
+
+# Header: magic, layout version, rows, columns, time of last tick
+HEADER = struct.Struct('<4sIIId')
+HEADER_SIZE = 64
+MAGIC = b'SENS'
+VERSION = 1
+
+# Thermal model
+AMBIENT = 22.0          # C at the coldest inlet
+IDLE_RISE = 15.0        # CPU above inlet when idle
+LOAD_RISE = 40.0        # extra CPU rise at full load
+CPU_TAU = 20.0          # seconds for the CPU to settle
+CHASSIS_TAU = 90.0
+FAN_MIN, FAN_MAX = 2400.0, 9000.0
+FAN_START_TEMP = 40.0   # CPU temp where fans ramp above minimum
+IDLE_WATTS, LOAD_WATTS = 90.0, 210.0
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+class SensorArray:
+    """Read side of the shared sensor file (Redfish and IPMI)"""
+
+    def __init__(self, path=SENSOR_FILE):
+        self.path = path
+        self.header = None
+        self.data = None
+
+    def _open(self):
+        if self.header is None:
+            try:
+                self.header = np.memmap(self.path, dtype=np.uint8, mode='r',
+                                        shape=(HEADER_SIZE,))
+            except (OSError, ValueError):
+                return False
+        magic, version, rows, columns, _ = HEADER.unpack_from(self.header)
+        if magic != MAGIC or version != VERSION or columns != len(CHANNELS):
+            return False
+        if self.data is None or len(self.data) != rows:
+            # The engine grew the file for more systems; remap it
+            self.data = np.memmap(self.path, dtype=np.float32, mode='r',
+                                  offset=HEADER_SIZE, shape=(rows, columns))
+        return True
+
+    def read(self, system_id):
+        """Current readings for one system as {channel: value}, or None"""
+        if not self._open():
+            return None
+        try:
+            row = int(system_id) - 1
+        except ValueError:
+            return None
+        if not 0 <= row < len(self.data):
+            return None
+        return dict(zip(CHANNELS, self.data[row].tolist()))
+
+    def updated_at(self):
+        """Wall-clock time of the engine's last tick, or None"""
+        if not self._open():
+            return None
+        return HEADER.unpack_from(self.header)[4]
+
+
+class SensorEngine:
+    """
+    Advances every system's sensors together in batched time steps.
+
+    Power state and the backing QEMU pid (``host_pid``, set by the bridge)
+    come from the state store's event log, so a tick costs one small query
+    plus one /proc read per running VM, not a store read per system.
+    """
+
+    def __init__(self, path=SENSOR_FILE, interval=1.0, store=None, seed=0):
+        self.path = path
+        self.interval = interval
+        self.store = store or StateStore()
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.data = None
+        self.powered = np.zeros(0, dtype=bool)
+        self.inlet_offset = np.zeros(0, dtype=np.float32)
+        self.pids = {}          # row -> host pid of the VM
+        self.cpu_ticks = {}     # pid -> (utime + stime, monotonic time)
+        self.vcpus = {}         # pid -> vCPU thread count
+        self.event_seq = 0
+
+    def resize(self, rows):
+        """Grow the shared file and per-system arrays to rows systems"""
+        old = self.data[:self.rows].copy() if self.data is not None else None
+        size = HEADER_SIZE + rows * len(CHANNELS) * 4
+        with open(self.path, 'ab') as f:
+            # Never shrink: readers may still map a larger earlier layout
+            if f.tell() < size:
+                f.truncate(size)
+        self.data = np.memmap(self.path, dtype=np.float32, mode='r+',
+                              offset=HEADER_SIZE, shape=(rows, len(CHANNELS)))
+        new = slice(self.rows, rows)
+        if old is not None:
+            self.data[:self.rows] = old
+        # Each system gets a fixed rack position: warmer inlets further up
+        self.inlet_offset = np.concatenate(
+            [self.inlet_offset, self.rng.uniform(0.0, 6.0, rows - self.rows).astype(np.float32)])
+        self.powered = np.concatenate([self.powered, np.zeros(rows - self.rows, dtype=bool)])
+        self.data[new] = 0.0
+        self.data[new, COLUMN['inlet_temp']] = AMBIENT + self.inlet_offset[new]
+        self.data[new, COLUMN['cpu_temp']] = AMBIENT + self.inlet_offset[new]
+        self.data[new, COLUMN['system_temp']] = AMBIENT + self.inlet_offset[new]
+        for system_id in self.store.list_ids(self.rows, rows - self.rows):
+            self.apply_state(system_id, self.store.get(system_id))
+        self.rows = rows
+        # Readers remap when they see the new row count
+        self.write_header()
+
+    def write_header(self):
+        with open(self.path, 'r+b') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.rows, len(CHANNELS), time.time()))
+
+    def apply_state(self, system_id, state):
+        try:
+            row = int(system_id) - 1
+        except ValueError:
+            return
+        if not 0 <= row < len(self.powered) or state is None:
+            return
+        self.powered[row] = state.get('power_state') == 'On'
+        pid = state.get('host_pid')
+        if pid:
+            self.pids[row] = int(pid)
+        else:
+            self.pids.pop(row, None)
+
+    def poll_state(self):
+        """Pick up power and pid changes recorded since the last tick"""
+        while True:
+            events = self.store.events_since(self.event_seq)
+            for event in events:
+                self.event_seq = event['seq']
+                self.apply_state(event['system_id'], self.store.get(event['system_id']))
+            if len(events) < 1000:
+                break
+        count = self.store.count()
+        if count > self.rows:
+            self.resize(count)
+
+    def vcpu_count(self, pid):
+        """Number of vCPU threads ('CPU n/KVM' or 'CPU n/TCG') in a QEMU process"""
+        if pid not in self.vcpus:
+            count = 0
+            try:
+                for tid in os.listdir(f'/proc/{pid}/task'):
+                    with open(f'/proc/{pid}/task/{tid}/comm') as f:
+                        if f.read().startswith('CPU '):
+                            count += 1
+            except OSError:
+                pass
+            self.vcpus[pid] = max(count, 1)
+        return self.vcpus[pid]
+
+    def read_loads(self):
+        """CPU load per system from /proc/<pid>/stat deltas since the last tick"""
+        load = np.zeros(self.rows, dtype=np.float32)
+        now = time.monotonic()
+        live = set()
+        for row, pid in self.pids.items():
+            try:
+                with open(f'/proc/{pid}/stat', 'rb') as f:
+                    fields = f.read().rsplit(b')', 1)[1].split()
+            except OSError:
+                continue
+            live.add(pid)
+            ticks = int(fields[11]) + int(fields[12])   # utime + stime
+            previous = self.cpu_ticks.get(pid)
+            self.cpu_ticks[pid] = (ticks, now)
+            if previous is None or now <= previous[1] or row >= self.rows:
+                continue
+            busy = (ticks - previous[0]) / CLK_TCK / (now - previous[1])
+            load[row] = min(1.0, busy / self.vcpu_count(pid))
+        for pid in set(self.cpu_ticks) - live:
+            self.cpu_ticks.pop(pid, None)
+            self.vcpus.pop(pid, None)
+        return load
+
+    def step(self, dt, load):
+        """Advance all systems by dt seconds"""
+        d = self.data
+        on = self.powered
+        n = self.rows
+        noise = self.rng.normal(0.0, 1.0, (n, 4)).astype(np.float32)
+
+        inlet = AMBIENT + self.inlet_offset + 0.2 * noise[:, 0]
+        load = np.where(on, load, 0.0)
+        cpu_target = inlet + np.where(on, IDLE_RISE + LOAD_RISE * load, 0.0)
+        cpu = d[:, COLUMN['cpu_temp']]
+        cpu += (cpu_target - cpu) * (1.0 - np.exp(-dt / CPU_TAU))
+
+        watts = np.where(on, IDLE_WATTS + LOAD_WATTS * load + 2.0 * noise[:, 1], 0.0)
+        exhaust_target = inlet + 0.04 * watts
+        exhaust = d[:, COLUMN['system_temp']]
+        exhaust += (exhaust_target - exhaust) * (1.0 - np.exp(-dt / CHASSIS_TAU))
+
+        ramp = np.clip((cpu - FAN_START_TEMP) / (85.0 - FAN_START_TEMP), 0.0, 1.0)
+        fans = FAN_MIN + (FAN_MAX - FAN_MIN) * ramp
+        # Fans differ slightly from each other and jitter per tick
+        jitter = self.rng.normal(0.0, 30.0, (n, len(FANS))).astype(np.float32)
+        d[:, FANS] = np.where(on[:, None], fans[:, None] + jitter, 0.0)
+
+        d[:, COLUMN['cpu_load']] = load
+        d[:, COLUMN['inlet_temp']] = inlet
+        d[:, COLUMN['power_watts']] = watts
+        # Two load-sharing supplies, not perfectly balanced
+        share = 0.5 + 0.02 * noise[:, 2]
+        d[:, COLUMN['psu1_watts']] = watts * share
+        d[:, COLUMN['psu2_watts']] = watts * (1.0 - share)
+
+    def run(self):
+        self.resize(self.store.count())
+        self.event_seq = self.store.last_event_seq()
+        logger.info(f"Simulating sensors for {self.rows} systems every {self.interval}s "
+                    f"into {self.path}")
+        last = time.monotonic()
+        while True:
+            time.sleep(max(0.0, last + self.interval - time.monotonic()))
+            now = time.monotonic()
+            self.poll_state()
+            self.step(now - last, self.read_loads())
+            self.write_header()
+            last = now
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BMC sensor simulation engine')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds per time step')
+    parser.add_argument('--file', default=SENSOR_FILE, help='Shared sensor file')
+    args = parser.parse_args()
+
+    try:
+        SensorEngine(args.file, args.interval).run()
+    except KeyboardInterrupt:
+        logger.info("Sensor engine stopped")
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+BMC State Store
+Shared system state for the Redfish and IPMI services, kept hot in memory
+and persisted to SQLite in WAL mode
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('state-store')
+
+STATE_DB = os.environ.get('OPENBMC_STATE_DB', '/var/lib/openbmc/state.db')
+LEGACY_STATE_FILE = '/var/lib/openbmc/state.json'
+
+DEFAULT_SYSTEM_STATE = {
+    'power_state': 'Off',
+    'boot_device': 'Hdd',
+    'boot_override': 'Disabled'
+}
+
+# Fields whose changes are published as events
+EVENT_FIELDS = ('power_state', 'boot_device', 'boot_override', 'host_pid')
+# Events kept for subscribers that reconnect with Last-Event-ID
+EVENT_RETENTION = 10000
+# Old events are pruned once per this many recorded events
+EVENT_PRUNE_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS systems (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS systems_version ON systems(version);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('events', 0);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    system_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    event TEXT NOT NULL
+);
+"""
+
+
+class _Connection:
+    """Per-thread SQLite connection with its own cache of decoded rows"""
+
+    def __init__(self, path):
+        self.pid = os.getpid()
+        self.db = sqlite3.connect(path, timeout=5.0, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # Commits only append to the WAL; fsync happens at checkpoint time,
+        # which the store runs in the background.
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA wal_autocheckpoint=0')
+        self.cache = {}           # system_id -> (version, state)
+        self.ids = None           # system ids in creation order
+        self.data_version = None
+        self.seen_seq = 0
+        self.version = 0          # newest version seen, including our own writes
+
+
+class StateStore:
+    """
+    Per-system BMC state shared by every process that opens the same file.
+
+    Reads are served from an in-memory cache that is revalidated with
+    ``PRAGMA data_version``, which costs no disk I/O. Only rows changed by
+    other connections since the last read are re-decoded. Writes go through
+    ``update()``, an atomic read-modify-write under SQLite's write lock, so
+    concurrent gunicorn workers never lose each other's changes.
+
+    ``stats``, if given, is called as ``stats(operation, seconds, nbytes)``
+    after every 'load' (get) and 'save' (update) with the time taken and
+    the bytes of JSON decoded or written.
+    """
+
+    def __init__(self, path=STATE_DB, checkpoint_interval=1.0, stats=None):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.stats = stats
+        self._local = threading.local()
+        self._checkpointer_pid = None
+        self._checkpointer_lock = threading.Lock()
+        # Writers in the same process queue here rather than in SQLite's
+        # busy handler, which backs off in steps of several milliseconds.
+        self._write_lock = threading.Lock()
+        # Wakes event waiters in this process as soon as we commit; other
+        # processes' commits are noticed through data_version.
+        self._events_changed = threading.Condition()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.db.executescript(SCHEMA)
+        self._import_legacy_state(conn)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork (gunicorn workers, supervisord)
+        if conn is None or conn.pid != os.getpid():
+            conn = _Connection(self.path)
+            self._local.conn = conn
+            self._start_checkpointer()
+        return conn
+
+    def _start_checkpointer(self):
+        with self._checkpointer_lock:
+            if self._checkpointer_pid == os.getpid():
+                return
+            self._checkpointer_pid = os.getpid()
+        thread = threading.Thread(target=self._checkpoint_loop,
+                                  name='state-checkpoint', daemon=True)
+        thread.start()
+
+    def _checkpoint_loop(self):
+        """Flush the WAL into the main database file in the background"""
+        db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        while True:
+            time.sleep(self.checkpoint_interval)
+            try:
+                db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            except sqlite3.Error as e:
+                logger.warning(f"WAL checkpoint failed: {e}")
+
+    def _import_legacy_state(self, conn):
+        """Seed system 1 from the old state.json the first time we start"""
+        if conn.db.execute('SELECT 1 FROM systems LIMIT 1').fetchone():
+            return
+        try:
+            with open(LEGACY_STATE_FILE, 'r') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return
+        state = dict(DEFAULT_SYSTEM_STATE)
+        state.update({k: v for k, v in legacy.items() if k in state})
+        self.put('1', state)
+        logger.info(f"Imported legacy state from {LEGACY_STATE_FILE}")
+
+    def _refresh(self, conn):
+        """Pull rows changed by other connections into the local cache"""
+        data_version = conn.db.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == conn.data_version:
+            return 0
+        conn.data_version = data_version
+        rows = conn.db.execute(
+            'SELECT id, version, state FROM systems WHERE version > ?',
+            (conn.seen_seq,)
+        ).fetchall()
+        nbytes = 0
+        for system_id, version, state in rows:
+            if system_id not in conn.cache:
+                conn.ids = None
+            conn.cache[system_id] = (version, json.loads(state))
+            conn.seen_seq = max(conn.seen_seq, version)
+            nbytes += len(state)
+        conn.version = max(conn.version, conn.seen_seq)
+        return nbytes
+
+    def _load(self):
+        conn = self._conn()
+        if self.stats is None:
+            self._refresh(conn)
+        else:
+            start = time.perf_counter()
+            nbytes = self._refresh(conn)
+            self.stats('load', time.perf_counter() - start, nbytes)
+        return conn
+
+    def get(self, system_id):
+        """Return a copy of a system's state, or None if it does not exist"""
+        entry = self._load().cache.get(system_id)
+        if entry is None:
+            return None
+        return dict(entry[1])
+
+    def version(self, system_id=None):
+        """
+        Version of one system's state (None if the system does not exist),
+        or of the whole store. A version changes whenever the state it
+        covers is written, so it can key caches of documents built from it.
+        """
+        conn = self._load()
+        if system_id is None:
+            return conn.version
+        entry = conn.cache.get(system_id)
+        return entry[0] if entry else None
+
+    def update(self, system_id, fn, event=None):
+        """
+        Atomically apply ``fn(state) -> state`` to one system.
+
+        The callback runs inside a write transaction; it receives a copy of
+        the current state (defaults if the system is new) and returns the
+        state to store. Returns the stored state.
+
+        Changes to EVENT_FIELDS are recorded as an event in the same
+        transaction. ``event`` adds fields to that event (e.g. the reset
+        type) and forces one to be recorded even if no field changed.
+        """
+        conn = self._conn()
+        db = conn.db
+        start = time.perf_counter()
+        with self._write_lock:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute('SELECT state FROM systems WHERE id = ?',
+                                 (system_id,)).fetchone()
+                current = json.loads(row[0]) if row else dict(DEFAULT_SYSTEM_STATE)
+                state = fn(dict(current))
+                seq = db.execute(
+                    "UPDATE meta SET value = value + 1 WHERE key = 'seq' RETURNING value"
+                ).fetchone()[0]
+                encoded = json.dumps(state, separators=(',', ':'))
+                db.execute(
+                    'INSERT INTO systems (id, version, state) VALUES (?, ?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET version = excluded.version, '
+                    'state = excluded.state',
+                    (system_id, seq, encoded)
+                )
+                changed = [f for f in EVENT_FIELDS if current.get(f) != state.get(f)]
+                recorded = bool(changed or event)
+                if recorded:
+                    self._record_event(db, seq, system_id, changed, state, event)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        if self.stats is not None:
+            self.stats('save', time.perf_counter() - start, len(encoded))
+        if recorded:
+            with self._events_changed:
+                self._events_changed.notify_all()
+        # Our own commit does not bump data_version for this connection, so
+        # update the cache directly.
+        if system_id not in conn.cache:
+            conn.ids = None
+        conn.cache[system_id] = (seq, state)
+        conn.version = max(conn.version, seq)
+        return dict(state)
+
+    def _record_event(self, db, seq, system_id, changed, state, extra):
+        event = {'changed': changed, 'state': {f: state.get(f) for f in EVENT_FIELDS}}
+        if extra:
+            event.update(extra)
+        db.execute('INSERT INTO events (seq, system_id, timestamp, event) VALUES (?, ?, ?, ?)',
+                   (seq, system_id, time.time(), json.dumps(event, separators=(',', ':'))))
+        # Count event inserts: seq also advances on writes that record no event
+        recorded = db.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'events' RETURNING value"
+        ).fetchone()[0]
+        if recorded % EVENT_PRUNE_EVERY == 0:
+            db.execute('DELETE FROM events WHERE seq < (SELECT seq FROM events '
+                       'ORDER BY seq DESC LIMIT 1 OFFSET ?)', (EVENT_RETENTION - 1,))
+
+    def last_event_seq(self):
+        """Sequence number of the newest event, 0 if there are none"""
+        row = self._conn().db.execute('SELECT MAX(seq) FROM events').fetchone()
+        return row[0] or 0
+
+    def events_since(self, seq, limit=1000):
+        """
+        Events newer than ``seq`` in order, as dicts with 'seq', 'system_id',
+        'timestamp', 'changed' and 'state' (plus any extra event fields).
+        """
+        rows = self._conn().db.execute(
+            'SELECT seq, system_id, timestamp, event FROM events '
+            'WHERE seq > ? ORDER BY seq LIMIT ?', (seq, limit)
+        ).fetchall()
+        return [dict(json.loads(event), seq=s, system_id=system_id, timestamp=ts)
+                for s, system_id, ts, event in rows]
+
+    def wait_for_events(self, seq, timeout, poll_interval=0.01):
+        """
+        Block until there are events newer than ``seq`` or timeout expires.
+
+        Commits made in this process wake waiters immediately. Commits made
+        by other processes are noticed through ``PRAGMA data_version``,
+        which is checked every poll_interval and costs no disk I/O.
+        """
+        conn = self._conn()
+        deadline = time.monotonic() + timeout
+        data_version = None
+        while True:
+            current = conn.db.execute('PRAGMA data_version').fetchone()[0]
+            if current != data_version:
+                data_version = current
+                if self.last_event_seq() > seq:
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._events_changed:
+                self._events_changed.wait(min(poll_interval, remaining))
+
+    def put(self, system_id, state):
+        """Replace a system's state"""
+        return self.update(system_id, lambda _: dict(state))
+
+    def ensure_systems(self, count):
+        """Create default state for systems 1..count that do not exist yet"""
+        conn = self._conn()
+        db = conn.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            existing = db.execute('SELECT COUNT(*) FROM systems').fetchone()[0]
+            if existing < count:
+                seq = db.execute(
+                    "UPDATE meta SET value = value + 1 WHERE key = 'seq' RETURNING value"
+                ).fetchone()[0]
+                default = json.dumps(DEFAULT_SYSTEM_STATE, separators=(',', ':'))
+                db.executemany(
+                    'INSERT OR IGNORE INTO systems (id, version, state) VALUES (?, ?, ?)',
+                    ((str(i), seq, default) for i in range(1, count + 1))
+                )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        # Force the next read to pick up the rows we just inserted
+        conn.data_version = None
+
+    def _ids(self, conn):
+        self._refresh(conn)
+        if conn.ids is None:
+            conn.ids = [row[0] for row in
+                        conn.db.execute('SELECT id FROM systems ORDER BY rowid')]
+        return conn.ids
+
+    def count(self):
+        """Number of systems"""
+        return len(self._ids(self._conn()))
+
+    def list_ids(self, skip=0, top=None):
+        """System ids in creation order, optionally paged"""
+        ids = self._ids(self._conn())
+        end = None if top is None else skip + top
+        return ids[skip:end]
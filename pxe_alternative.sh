@@ -28,17 +28,9 @@ case $choice in
     1)
         echo ""
         echo "Downloading Ubuntu 20.04 netboot..."
-        mkdir -p images/ubuntu
         
-        url="http://archive.ubuntu.com/ubuntu/dists/focal/main/installer-amd64/current/legacy-images/netboot/netboot.tar.gz"
-        
-        echo "Downloading from: $url"
-        if curl -fSL --progress-bar -o images/ubuntu/netboot.tar.gz "$url"; then
-            cd images/ubuntu
-            echo "Extracting files..."
-            tar -xzf netboot.tar.gz
-            cd "$SCRIPT_DIR"
-            
+        if python3 src/pxe_assets.py fetch ubuntu-focal && \
+           python3 src/pxe_assets.py link ubuntu-focal --into images/ubuntu; then
             echo ""
             echo "✅ Ubuntu 20.04 netboot installed successfully!"
             echo ""
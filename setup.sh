@@ -122,51 +122,17 @@ install_python_deps() {
 download_ubuntu_netboot() {
     echo -e "\n${YELLOW}Downloading Ubuntu netboot files...${NC}"
     
-    UBUNTU_VERSION="20.04"
-    
-    # Ubuntu 22.04+ removed legacy netboot files, using 20.04 LTS instead
-    # Try multiple URLs in case one is down
-    NETBOOT_URLS=(
-        "http://archive.ubuntu.com/ubuntu/dists/focal/main/installer-amd64/current/legacy-images/netboot/netboot.tar.gz"
-        "http://us.archive.ubuntu.com/ubuntu/dists/focal/main/installer-amd64/current/legacy-images/netboot/netboot.tar.gz"
-        "http://mirrors.kernel.org/ubuntu/dists/focal/main/installer-amd64/current/legacy-images/netboot/netboot.tar.gz"
-    )
-    
-    # Check if valid netboot files already exist
-    if [ -f "images/ubuntu/pxelinux.0" ] && [ -s "images/ubuntu/pxelinux.0" ]; then
-        echo -e "${GREEN}✓ Ubuntu netboot files already present${NC}"
-        return 0
-    fi
-    
-    # Try downloading from available mirrors
+    # Ubuntu 22.04+ removed legacy netboot files, using 20.04 LTS instead.
+    # The asset store (images/assets) fetches netboot.tar.gz from several
+    # mirrors in parallel, checks it against the mirror's SHA256SUMS and
+    # keeps it by content, so later runs only relink the files.
     download_success=false
-    for url in "${NETBOOT_URLS[@]}"; do
-        echo "Trying to download from: $url"
-        if wget -q --timeout=30 --tries=2 --show-progress -O images/ubuntu/netboot.tar.gz "$url" 2>&1; then
-            # Check if download was successful (file size > 0)
-            if [ -s "images/ubuntu/netboot.tar.gz" ]; then
-                echo "Download successful!"
-                download_success=true
-                break
-            else
-                echo "Download failed (0 bytes), trying next mirror..."
-                rm -f images/ubuntu/netboot.tar.gz
-            fi
-        else
-            echo "Download failed, trying next mirror..."
-            rm -f images/ubuntu/netboot.tar.gz
-        fi
-    done
+    if python3 src/pxe_assets.py fetch ubuntu-focal && \
+       python3 src/pxe_assets.py link ubuntu-focal --into images/ubuntu; then
+        download_success=true
+    fi
     
     if [ "$download_success" = true ]; then
-        echo "Extracting netboot files..."
-        cd images/ubuntu
-        tar -xzf netboot.tar.gz 2>/dev/null || {
-            echo -e "${RED}Failed to extract netboot files${NC}"
-            cd "$SCRIPT_DIR"
-            return 1
-        }
-        cd "$SCRIPT_DIR"
         echo -e "${GREEN}✓ Ubuntu 20.04 LTS netboot files downloaded and extracted${NC}"
     else
         echo -e "${YELLOW}⚠ Could not download Ubuntu netboot files automatically${NC}"
@@ -246,8 +212,8 @@ create_configs() {
 BRIDGE_NAME=br0
 BRIDGE_IP=192.168.100.1
 BRIDGE_SUBNET=192.168.100.0/24
-DHCP_RANGE_START=192.168.100.100
-DHCP_RANGE_END=192.168.100.200
+DHCP_RANGE_START=192.168.100.220
+DHCP_RANGE_END=192.168.100.254
 BMC_IP=192.168.100.10
 PXE_SERVER_IP=192.168.100.1
 EOF
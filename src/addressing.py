@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Address Allocation
+Deterministic MAC/IP addresses for VMs and the dnsmasq dhcp-hostsfile that
+gives each of them a static DHCP answer
+"""
+
+import bisect
+import ipaddress
+import os
+import re
+import shlex
+import shutil
+import subprocess
+from pathlib import Path
+
+# Outside dnsmasq's dynamic range (192.168.100.220-254, for unknown clients)
+DEFAULT_RANGES = ['192.168.100.20-192.168.100.219']
+# Gateway/PXE server and BMC
+DEFAULT_RESERVED = ['192.168.100.1', '192.168.100.10']
+DEFAULT_MAC_PREFIX = '52:54:00'
+# pxe-data/dhcp is mounted at /etc/dnsmasq.d/hosts in the PXE container
+DEFAULT_HOSTSFILE = 'pxe-data/dhcp/hosts'
+PXE_CONTAINER = 'bmc-pxe'
+
+HOSTNAME = re.compile(r'^[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?$')
+
+
+def parse_range(text):
+    """'a.b.c.d-e.f.g.h' or a CIDR (host addresses only) -> (first, last) as ints"""
+    text = str(text).strip()
+    if '-' in text:
+        first, last = (int(ipaddress.IPv4Address(part.strip())) for part in text.split('-', 1))
+    else:
+        network = ipaddress.IPv4Network(text, strict=False)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        if network.num_addresses > 2:
+            first, last = first + 1, last - 1
+    if last < first:
+        raise ValueError(f"Empty address range '{text}'")
+    return first, last
+
+
+class AddressPlan:
+    """
+    Maps an address index to a (MAC, IP) pair.
+
+    The inventory hands out indexes the way it hands out ports, and the
+    pair for an index never changes, so a VM keeps its addresses for life
+    and a reused index gets the same pair back. MACs are mac_prefix plus
+    the index; IPs walk the ranges in order, skipping reserved addresses.
+    """
+
+    def __init__(self, ranges=None, reserved=None, mac_prefix=DEFAULT_MAC_PREFIX):
+        if len(mac_prefix.split(':')) != 3:
+            raise ValueError(f"mac_prefix '{mac_prefix}' must be three octets")
+        self.mac_prefix = mac_prefix.lower()
+        skip = sorted({int(ipaddress.IPv4Address(a))
+                       for a in (DEFAULT_RESERVED if reserved is None else reserved)})
+
+        ranges = [parse_range(r) for r in ranges or DEFAULT_RANGES]
+        ordered = sorted(ranges)
+        for (_, last), (first, _) in zip(ordered, ordered[1:]):
+            if first <= last:
+                raise ValueError(f"Address ranges overlap at {ipaddress.IPv4Address(first)}")
+
+        pieces = []
+        for first, last in ranges:
+            for address in skip:
+                if first <= address <= last:
+                    if address > first:
+                        pieces.append((first, address - 1))
+                    first = address + 1
+            if first <= last:
+                pieces.append((first, last))
+
+        # (first index, first IP) per contiguous block
+        self.blocks = []
+        index = 0
+        for first, last in pieces:
+            self.blocks.append((index, first))
+            index += last - first + 1
+        self.starts = [start for start, _ in self.blocks]
+        self.capacity = min(index, 1 << 24)
+
+    @classmethod
+    def from_config(cls, settings):
+        """From the addressing: section of vms.yaml"""
+        return cls(settings.get('ranges'), settings.get('reserved'),
+                   settings.get('mac_prefix', DEFAULT_MAC_PREFIX))
+
+    def address(self, index):
+        """(mac, ip) for an index"""
+        if not 0 <= index < self.capacity:
+            raise ValueError(f"Address pool exhausted ({self.capacity} addresses); "
+                             f"add ranges under addressing in vms.yaml")
+        start, first = self.blocks[bisect.bisect_right(self.starts, index) - 1]
+        mac = f"{self.mac_prefix}:{index >> 16 & 0xff:02x}:{index >> 8 & 0xff:02x}:{index & 0xff:02x}"
+        return mac, str(ipaddress.IPv4Address(first + index - start))
+
+
+def host_line(vm):
+    """dhcp-hostsfile line for a VM: MAC, IP, hostname, lease"""
+    fields = [vm['mac'], vm['ip']]
+    if HOSTNAME.match(vm['name']):
+        fields.append(vm['name'])
+    return ','.join(fields + ['infinite'])
+
+
+def write_hostsfile(vms, path=DEFAULT_HOSTSFILE):
+    """
+    Write reservations for every VM with an IP in one go. The file is
+    replaced atomically so dnsmasq never reads half of it. Returns False
+    if it already had this content.
+    """
+    path = Path(path)
+    content = ''.join(host_line(vm) + '\n' for vm in vms if vm.get('ip') and vm.get('mac'))
+    try:
+        if path.read_text() == content:
+            return False
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(content)
+    os.replace(tmp, path)
+    return True
+
+
+def reload_dnsmasq(command=None):
+    """
+    Make dnsmasq reread its hostsfile. SIGHUP reloads reservations without
+    dropping leases or restarting TFTP transfers. command overrides the
+    default of signalling dnsmasq in the PXE container.
+    """
+    if command:
+        cmd = shlex.split(command)
+    else:
+        engine = shutil.which('docker') or shutil.which('podman')
+        if engine is None:
+            print("dnsmasq not reloaded: neither docker nor podman found")
+            return False
+        cmd = [engine, 'exec', PXE_CONTAINER, 'pkill', '-HUP', '-x', 'dnsmasq']
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"dnsmasq not reloaded: {getattr(e, 'stderr', None) or e}".rstrip())
+        return False
+    return True
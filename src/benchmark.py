@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite
+Load tests for the Redfish API and IPMI endpoint (run locally, no Docker or
+network needed), microbenchmarks for VMManager inventory operations and a
+qemu-img write benchmark per disk I/O profile.
+Results are written as JSON so runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BMC_SCRIPTS = REPO_ROOT / 'containers' / 'openbmc' / 'scripts'
+
+# Relative change in a metric that 'compare' reports as a regression
+DEFAULT_THRESHOLD = 0.10
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (ms) for one operation"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if count else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if count else None,
+        'p999_ms': round(percentile(latencies, 99.9) * 1000, 3) if count else None,
+        'max_ms': round(latencies[-1] * 1000, 3) if count else None,
+    }
+
+
+def parse_mix(spec):
+    """Parse 'get=80,patch=10,reset=10' into normalized weights"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('get', 'patch', 'reset'):
+            raise ValueError(f"Unknown operation '{name}' (use get, patch, reset)")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    return {name: weight / total for name, weight in mix.items()}
+
+
+class BMCProcess:
+    """A Redfish (gunicorn) or IPMI simulator process on a private state database"""
+
+    def __init__(self, command, env, ready, workdir):
+        self.command = command
+        self.env = dict(os.environ, **env, PYTHONPATH=str(BMC_SCRIPTS))
+        self.ready = ready
+        self.workdir = workdir
+        self.process = None
+
+    def __enter__(self):
+        log = open(Path(self.workdir) / 'server.log', 'w')
+        self.process = subprocess.Popen(self.command, cwd=BMC_SCRIPTS, env=self.env,
+                                        stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + 30
+        while not self.ready():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.__exit__()
+                raise RuntimeError(f"Server did not start; see {log.name}")
+            time.sleep(0.1)
+        return self
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def redfish_client(base_url, system_count, mix, threads, duration, seed):
+    """
+    One load-generating process: threads each loop over weighted random
+    operations until duration expires. Returns raw latencies per operation.
+    """
+    operations = list(mix)
+    weights = [mix[o] for o in operations]
+    latencies = {o: [] for o in operations}
+    errors = {o: 0 for o in operations}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        local = {o: [] for o in operations}
+        local_errors = {o: 0 for o in operations}
+        while time.perf_counter() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            system_url = f"{base_url}/redfish/v1/Systems/{rng.randint(1, system_count)}"
+            start = time.perf_counter()
+            try:
+                if operation == 'get':
+                    response = session.get(system_url)
+                elif operation == 'patch':
+                    response = session.patch(system_url, json={'Boot': {
+                        'BootSourceOverrideTarget': rng.choice(['Pxe', 'Hdd']),
+                        'BootSourceOverrideEnabled': 'Once'}})
+                else:
+                    response = session.post(
+                        f"{system_url}/Actions/ComputerSystem.Reset",
+                        json={'ResetType': rng.choice(['On', 'ForceOff'])})
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                local[operation].append(elapsed)
+            else:
+                local_errors[operation] += 1
+        with lock:
+            for o in operations:
+                latencies[o].extend(local[o])
+                errors[o] += local_errors[o]
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    return latencies, errors
+
+
+def bench_redfish(systems=1000, workers=2, threads=8, concurrency=32, clients=4,
+                  duration=10.0, mix='get=80,patch=10,reset=10'):
+    """Run redfish_api under gunicorn and drive a mixed GET/PATCH/Reset load"""
+    mix = parse_mix(mix)
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    clients = max(1, min(clients, concurrency))
+
+    def ready():
+        try:
+            return requests.get(f"{base_url}/redfish/v1/", timeout=1).ok
+        except requests.RequestException:
+            return False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {
+            'OPENBMC_STATE_DB': str(Path(workdir) / 'state.db'),
+            'OPENBMC_SENSOR_FILE': str(Path(workdir) / 'sensors.dat'),
+            'REDFISH_SYSTEM_COUNT': str(systems),
+        }
+        command = ['gunicorn', '-w', str(workers), '-k', 'gthread', '--threads', str(threads),
+                   '-b', f"127.0.0.1:{port}", '--log-level', 'warning', 'redfish_api:app']
+        print(f"Redfish: {systems} systems, gunicorn {workers}x{threads}, "
+              f"{concurrency} concurrent clients for {duration}s")
+        with BMCProcess(command, env, ready, workdir):
+            # Load generators run in separate processes so the client side
+            # is not limited to one core by the GIL.
+            per_client = [concurrency // clients + (1 if i < concurrency % clients else 0)
+                          for i in range(clients)]
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=clients) as executor:
+                futures = [executor.submit(redfish_client, base_url, systems, mix, n,
+                                           duration, i) for i, n in enumerate(per_client)]
+                results = [f.result() for f in futures]
+            elapsed = time.perf_counter() - start
+
+    report = {'config': {'systems': systems, 'workers': workers, 'threads': threads,
+                         'concurrency': concurrency, 'duration': duration, 'mix': mix}}
+    every = []
+    for operation in mix:
+        latencies = [t for r in results for t in r[0][operation]]
+        errors = sum(r[1][operation] for r in results)
+        every.extend(latencies)
+        report[operation] = summarize(latencies, elapsed, errors)
+    report['all'] = summarize(every, elapsed, sum(r['errors'] for k, r in report.items()
+                                                  if k in mix))
+    return report
+
+
+def ipmi15_request(netfn, command, data, seq):
+    """Session-less IPMI v1.5 LAN request to the BMC"""
+    header = bytes([0x20, netfn << 2])
+    body = bytes([0x81, seq << 2, command]) + bytes(data)
+    message = header + bytes([(-sum(header)) & 0xff]) + body + bytes([(-sum(body)) & 0xff])
+    return b'\x06\x00\xff\x07' + b'\x00' + b'\x00' * 8 + bytes([len(message)]) + message
+
+
+def bench_ipmi(requests_total=20000, concurrency=16, session_requests=500):
+    """
+    Drive the IPMI simulator over UDP: session-less Get Channel
+    Authentication Capabilities at the given concurrency, then (with
+    pyghmi) RMCP+ session setup and authenticated sensor reads.
+    """
+    port = free_port(socket.SOCK_DGRAM)
+    probe = ipmi15_request(0x06, 0x38, [0x0e, 0x04], 1)
+
+    def ready():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(0.2)
+            try:
+                s.sendto(probe, ('127.0.0.1', port))
+                return bool(s.recv(512))
+            except OSError:
+                return False
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {'OPENBMC_STATE_DB': str(Path(workdir) / 'state.db'),
+               'OPENBMC_SENSOR_FILE': str(Path(workdir) / 'sensors.dat')}
+        command = [sys.executable, 'ipmi_simulator.py', '--host', '127.0.0.1',
+                   '--port', str(port)]
+        print(f"IPMI: {requests_total} session-less requests, {concurrency} concurrent")
+        with BMCProcess(command, env, ready, workdir):
+            per_worker = requests_total // concurrency
+
+            def worker(_):
+                latencies, errors = [], 0
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    s.settimeout(1.0)
+                    s.connect(('127.0.0.1', port))
+                    for _ in range(per_worker):
+                        start = time.perf_counter()
+                        s.send(probe)
+                        try:
+                            s.recv(512)
+                            latencies.append(time.perf_counter() - start)
+                        except socket.timeout:
+                            errors += 1
+                return latencies, errors
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(worker, range(concurrency)))
+            elapsed = time.perf_counter() - start
+            report = {'config': {'requests': requests_total, 'concurrency': concurrency},
+                      'sessionless': summarize([t for r in results for t in r[0]], elapsed,
+                                               sum(r[1] for r in results))}
+            report.update(bench_ipmi_session(port, session_requests))
+    return report
+
+
+def bench_ipmi_session(port, count):
+    """RMCP+ session setup and sensor reads through pyghmi, if it is installed"""
+    try:
+        from pyghmi.ipmi import command as ipmi_command
+    except ImportError:
+        print("  pyghmi not installed; skipping RMCP+ session benchmarks")
+        return {}
+
+    start = time.perf_counter()
+    ipmi = ipmi_command.Command('127.0.0.1', 'admin', 'admin', port=port)
+    setup = time.perf_counter() - start
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t = time.perf_counter()
+        ipmi.raw_command(netfn=0x04, command=0x2d, data=[0x01])
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    ipmi.ipmi_session.logout()
+    return {'session_setup_ms': round(setup * 1000, 3),
+            'sensor_reading': summarize(latencies, elapsed)}
+
+
+def timed(fn, repeat=1):
+    """Latencies of repeat calls to fn"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_vm_config(vms=10000, lookups=2000):
+    """VMManager/Inventory operations against a synthetic inventory of vms entries"""
+    src = str(Path(__file__).resolve().parent)
+    if src not in sys.path:
+        sys.path.insert(0, src)
+    from vm_manager import VMManager
+
+    cwd = os.getcwd()
+    report = {'config': {'vms': vms, 'lookups': lookups}}
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            # An address pool big enough for the synthetic fleet
+            Path('vms.yaml').write_text("addressing:\n  ranges: ['10.0.0.0/8']\n")
+            manager = VMManager(config_path='vms.yaml', inventory_path='inventory.db')
+            print(f"VM config: {vms} synthetic VMs, {lookups} lookups")
+
+            # add_many allocates ports, MACs and IPs
+            configs = [manager.new_vm_config(f"bench-{i:06d}", 2048, 2,
+                                             f"images/vms/bench-{i:06d}.qcow2", None)
+                       for i in range(vms)]
+            latencies = timed(lambda: manager.inventory.add_many(configs))
+            report['add_many'] = summarize(latencies, sum(latencies))
+            report['add_many']['vms_per_s'] = round(vms / sum(latencies), 1)
+
+            names = [rng.choice(configs)['name'] for _ in range(lookups)]
+            for operation, fn in (
+                ('get', lambda n: manager.inventory.get(n)),
+                ('find_by_mac', lambda n: manager.inventory.find_by_mac(
+                    configs[int(n[-6:])]['mac'])),
+                ('find_by_ip', lambda n: manager.inventory.find_by_ip(
+                    configs[int(n[-6:])]['ip'])),
+                ('update', lambda n: manager.inventory.update(n, state='running')),
+            ):
+                latencies = []
+                for name in names:
+                    start = time.perf_counter()
+                    fn(name)
+                    latencies.append(time.perf_counter() - start)
+                report[operation] = summarize(latencies, sum(latencies))
+
+            for operation, fn, repeat in (
+                ('names', manager.inventory.names, 20),
+                ('all', manager.inventory.all, 5),
+                ('export_config', lambda: manager.export_config('export.yaml'), 1),
+            ):
+                latencies = timed(fn, repeat)
+                report[operation] = summarize(latencies, sum(latencies))
+
+            removed = [c['name'] for c in configs[:vms // 2]]
+            latencies = timed(lambda: manager.inventory.remove_many(removed))
+            report['remove_many'] = summarize(latencies, sum(latencies))
+            # Re-adding reuses the freed ports and addresses from the free list
+            for c in configs[:vms // 2]:
+                c['vnc_port'] = c['serial_port'] = c['mac'] = c['ip'] = c['address'] = None
+            latencies = timed(lambda: manager.inventory.add_many(configs[:vms // 2]))
+            report['readd_many'] = summarize(latencies, sum(latencies))
+        finally:
+            os.chdir(cwd)
+    return report
+
+
+def bench_disk(profiles=None, total_mb=1024, disk_gb=20, directory='images/vms'):
+    """
+    The standard install write workload (disk_profiles.bench_args) against a
+    fresh image per I/O profile, created with that profile's options in
+    directory, which should be on the storage VM disks use
+    """
+    src = str(Path(__file__).resolve().parent)
+    if src not in sys.path:
+        sys.path.insert(0, src)
+    from disk_profiles import DISK_PROFILES, bench_args, create_options, get_profile
+
+    custom = {}
+    config_path = REPO_ROOT / 'config' / 'vms.yaml'
+    if config_path.exists():
+        import yaml
+        custom = (yaml.safe_load(config_path.read_text()) or {}).get('disk_profiles') or {}
+    names = profiles or list(dict(DISK_PROFILES, **custom))
+
+    report = {'config': {'total_mb': total_mb, 'disk_gb': disk_gb, 'directory': directory}}
+    os.makedirs(directory, exist_ok=True)
+    print(f"Disk: {total_mb} MB install workload per profile in {directory}")
+    for name in names:
+        profile = get_profile(name, custom)
+        with tempfile.TemporaryDirectory(dir=directory) as workdir:
+            image = os.path.join(workdir, 'bench.qcow2')
+            try:
+                start = time.perf_counter()
+                subprocess.run(['qemu-img', 'create', '-f', 'qcow2', *create_options(profile),
+                                image, f"{disk_gb}G"], check=True, capture_output=True, text=True)
+                created = time.perf_counter() - start
+                start = time.perf_counter()
+                subprocess.run(bench_args(profile, image, disk_gb, total_mb), check=True,
+                               capture_output=True, text=True)
+                elapsed = time.perf_counter() - start
+            except subprocess.CalledProcessError as e:
+                print(f"  {name}: failed: {e.stderr.strip()}")
+                report[name] = {'error': e.stderr.strip()}
+                continue
+        report[name] = {
+            'create_ms': round(created * 1000, 1),
+            'write_ms': round(elapsed * 1000, 1),
+            'throughput': round(total_mb / elapsed, 1),
+            'safe': profile.get('safe', True),
+        }
+        print(f"  {name:<15} {report[name]['throughput']:>8} MB/s"
+              f"{'' if report[name]['safe'] else '  (unsafe: ignores flushes)'}")
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """{'redfish': {'get': {'p99_ms': 1}}} -> {'redfish.get.p99_ms': 1}"""
+    flat = {}
+    for key, value in results.items():
+        if key == 'config':
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline_path, current_path, threshold=DEFAULT_THRESHOLD):
+    """
+    Print metric changes between two result files. Latencies that grow or
+    throughputs that drop by more than threshold count as regressions.
+    Returns the number of regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f)['results'])
+    with open(current_path) as f:
+        current = flatten(json.load(f)['results'])
+
+    regressions = 0
+    print(f"{'Metric':<40} {'Baseline':>12} {'Current':>12} {'Change':>9}")
+    for name in sorted(set(baseline) & set(current)):
+        metric = name.rsplit('.', 1)[-1]
+        if metric not in ('throughput', 'vms_per_s') and not metric.endswith('_ms'):
+            continue
+        old, new = baseline[name], current[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        higher_is_better = metric in ('throughput', 'vms_per_s')
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{name:<40} {old:>12} {new:>12} {change:>+8.1%}{flag}")
+    print(f"{regressions} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DC Simulator benchmark suite')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    subparsers = parser.add_subparsers(dest='command', help='Benchmarks')
+
+    def add_redfish_args(p):
+        p.add_argument('--systems', type=int, default=1000, help='Simulated systems')
+        p.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+        p.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+        p.add_argument('--concurrency', type=int, default=32, help='Concurrent clients')
+        p.add_argument('--clients', type=int, default=4, help='Client processes')
+        p.add_argument('--duration', type=float, default=10.0, help='Seconds of load')
+        p.add_argument('--mix', default='get=80,patch=10,reset=10',
+                       help='Operation weights, e.g. get=80,patch=10,reset=10')
+
+    def add_ipmi_args(p):
+        p.add_argument('--ipmi-requests', type=int, default=20000,
+                       help='Session-less IPMI requests')
+        p.add_argument('--ipmi-concurrency', type=int, default=16,
+                       help='Concurrent IPMI clients')
+
+    def add_vm_args(p):
+        p.add_argument('--vms', type=int, default=10000, help='Synthetic inventory size')
+        p.add_argument('--lookups', type=int, default=2000, help='Lookups per operation')
+
+    def add_disk_args(p):
+        p.add_argument('--disk-profiles', nargs='+', metavar='PROFILE',
+                       help='Disk I/O profiles to compare (default: all)')
+        p.add_argument('--disk-mb', type=int, default=1024, help='MB written per profile')
+        p.add_argument('--disk-dir', default='images/vms',
+                       help='Where to create the test images (same storage as VM disks)')
+
+    add_redfish_args(subparsers.add_parser('redfish', help='Redfish API load test'))
+    add_ipmi_args(subparsers.add_parser('ipmi', help='IPMI endpoint load test'))
+    add_vm_args(subparsers.add_parser('vm-config', help='VMManager inventory microbenchmarks'))
+    add_disk_args(subparsers.add_parser('disk', help='qemu-img write workload per I/O profile'))
+    all_parser = subparsers.add_parser('all', help='Run every benchmark')
+    add_redfish_args(all_parser)
+    add_ipmi_args(all_parser)
+    add_vm_args(all_parser)
+    add_disk_args(all_parser)
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('baseline', help='Earlier results JSON')
+    compare_parser.add_argument('current', help='Newer results JSON')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='Relative change counted as a regression')
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(1 if compare(args.baseline, args.current, args.threshold) else 0)
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+
+    results = {}
+    if args.command in ('redfish', 'all'):
+        results['redfish'] = bench_redfish(args.systems, args.workers, args.threads,
+                                           args.concurrency, args.clients, args.duration,
+                                           args.mix)
+    if args.command in ('ipmi', 'all'):
+        results['ipmi'] = bench_ipmi(args.ipmi_requests, args.ipmi_concurrency)
+    if args.command in ('vm-config', 'all'):
+        results['vm_config'] = bench_vm_config(args.vms, args.lookups)
+    if args.command in ('disk', 'all'):
+        results['disk'] = bench_disk(args.disk_profiles, args.disk_mb, directory=args.disk_dir)
+
+    document = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'host': platform.node(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    for name, value in sorted(flatten(results).items()):
+        if name.endswith(('throughput', 'p50_ms', 'p99_ms', 'p999_ms', 'vms_per_s')):
+            print(f"  {name:<40} {value}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,109 +4,641 @@ BMC Bridge
 Bridges BMC commands to QEMU VM lifecycle operations
 """
 
+import argparse
+import collections
+import os
 import requests
 import json
-import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+
+from vm_daemon import DEFAULT_SOCKET, DaemonError, VMDaemonClient
+
+
+def parse_system_ids(spec):
+    """
+    Expand a system list such as '1-500,600,700-702' into ids. Raises
+    ValueError for anything but numbers and ranges, such as a VM name.
+    """
+    ids = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        if not first.isdigit() or not (last or first).isdigit():
+            raise ValueError(f"'{part}' is not a system id or range of ids (e.g. '1' or '1-500')")
+        ids.extend(str(i) for i in range(int(first), int(last or first) + 1))
+    return ids
+
+
+def parse_system_map(spec):
+    """Parse '1=vm1,2=vm2' into {'1': 'vm1', '2': 'vm2'}"""
+    mapping = {}
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        system_id, sep, vm_name = part.partition('=')
+        if not sep or not system_id or not vm_name:
+            raise ValueError(f"Expected SYSTEM=VM, got '{part}'")
+        mapping[system_id.strip()] = vm_name.strip()
+    return mapping
+
+
+def boot_mode_for(target, enabled):
+    """VMManager boot mode for a Redfish boot override"""
+    if target == 'Pxe' and enabled in ('Once', 'Continuous'):
+        return 'pxe'
+    return 'disk'
+
+
+# Seconds; the same buckets as the BMC's /metrics
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class BridgeMetrics:
+    """Client-side request counters, in-flight gauge and latency histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}     # (operation, status) -> count
+        self.bytes = {}        # operation -> response bytes
+        self.latency = {}      # operation -> [bucket counts..., sum, count]
+        self.in_flight = 0
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def finish(self, operation, start, status, nbytes=0):
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.in_flight -= 1
+            key = (operation, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes[operation] = self.bytes.get(operation, 0) + nbytes
+            histogram = self.latency.setdefault(operation, [0] * (len(LATENCY_BUCKETS) + 2))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += elapsed
+            histogram[-1] += 1
+
+    def render(self):
+        """Prometheus text format"""
+        with self.lock:
+            lines = ['# HELP bmc_bridge_requests_total Bridge calls by operation and status '
+                     '(Redfish HTTP status, or "error" when no response arrived)',
+                     '# TYPE bmc_bridge_requests_total counter']
+            for (operation, status), count in sorted(self.requests.items()):
+                lines.append(f'bmc_bridge_requests_total{{operation="{operation}",'
+                             f'status="{status}"}} {count}')
+            lines += ['# HELP bmc_bridge_response_bytes_total Response bytes received',
+                      '# TYPE bmc_bridge_response_bytes_total counter']
+            for operation, nbytes in sorted(self.bytes.items()):
+                lines.append(f'bmc_bridge_response_bytes_total{{operation="{operation}"}} {nbytes}')
+            lines += ['# HELP bmc_bridge_requests_in_flight Calls waiting for a response',
+                      '# TYPE bmc_bridge_requests_in_flight gauge',
+                      f'bmc_bridge_requests_in_flight {self.in_flight}',
+                      '# HELP bmc_bridge_request_duration_seconds Bridge call latency',
+                      '# TYPE bmc_bridge_request_duration_seconds histogram']
+            for operation, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    cumulative += count
+                    lines.append(f'bmc_bridge_request_duration_seconds_bucket{{'
+                                 f'operation="{operation}",le="{bound}"}} {cumulative}')
+                lines.append(f'bmc_bridge_request_duration_seconds_bucket{{'
+                             f'operation="{operation}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'bmc_bridge_request_duration_seconds_sum{{'
+                             f'operation="{operation}"}} {histogram[-2]}')
+                lines.append(f'bmc_bridge_request_duration_seconds_count{{'
+                             f'operation="{operation}"}} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Atomically write render() to a file (node_exporter textfile collector)"""
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
 
 class BMCBridge:
-    def __init__(self, bmc_url='http://192.168.100.10'):
+    def __init__(self, bmc_url='http://192.168.100.10', max_workers=32, timeout=5,
+                 vm_socket=DEFAULT_SOCKET):
         self.bmc_url = bmc_url
-        self.vm_manager = None  # Import VMManager if needed
-    
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.vm_manager = None  # In-process VMManager when no daemon is running
+        self.vm_manager_lock = threading.Lock()  # VMManager is not thread-safe
+        self.vm_socket = vm_socket
+        self._local = threading.local()
+        self.metrics = BridgeMetrics()
+
+        # One keep-alive connection per worker thread
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def vm_client(self):
+        """Daemon connection for the calling thread (a connection carries one call at a time)"""
+        client = getattr(self._local, 'vm_client', None)
+        if client is None:
+            client = self._local.vm_client = VMDaemonClient(self.vm_socket)
+        return client
+
+    def _system_url(self, system_id):
+        return f"{self.bmc_url}/redfish/v1/Systems/{system_id}"
+
+    def _request(self, operation, method, url, **kwargs):
+        """Send one Redfish request, counting it under operation"""
+        start = self.metrics.start()
+        try:
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            self.metrics.finish(operation, start, 'error')
+            raise
+        self.metrics.finish(operation, start, response.status_code, len(response.content))
+        response.raise_for_status()
+        return response
+
+    def _fetch_state(self, system_id):
+        return self._request('get_state', 'GET', self._system_url(system_id)).json()
+
+    def _patch_boot(self, system_id, boot_device, enabled):
+        data = {
+            'Boot': {
+                'BootSourceOverrideTarget': boot_device,
+                'BootSourceOverrideEnabled': enabled
+            }
+        }
+        self._request('set_boot', 'PATCH', self._system_url(system_id), json=data)
+        return True
+
+    def set_host_pid(self, system_id, pid):
+        """Report the QEMU process backing a system, or None once it stops"""
+        data = {'Oem': {'DCSimulator': {'HostPid': pid}}}
+        self._request('set_host_pid', 'PATCH', self._system_url(system_id), json=data)
+        return True
+
+    def set_boot_progress(self, system_id, last_state, oem_state=None):
+        """Report how far a (virtual) node has booted: Redfish BootProgress"""
+        data = {'Oem': {'DCSimulator': {'BootProgress': {
+            'LastState': last_state, 'OemLastState': oem_state}}}}
+        self._request('set_boot_progress', 'PATCH', self._system_url(system_id), json=data)
+        return True
+
+    def _reset(self, system_id, reset_type):
+        url = f"{self._system_url(system_id)}/Actions/ComputerSystem.Reset"
+        self._request('reset', 'POST', url, json={'ResetType': reset_type})
+        return True
+
     def get_bmc_state(self, system_id='1'):
         """Get BMC system state via Redfish API"""
         try:
-            url = f"{self.bmc_url}/redfish/v1/Systems/{system_id}"
-            response = requests.get(url, verify=False, timeout=5)
-            return response.json()
+            return self._fetch_state(system_id)
         except Exception as e:
             print(f"Error getting BMC state: {e}")
             return None
-    
+
     def set_boot_device(self, system_id, boot_device='Pxe', enabled='Once'):
         """Set boot device via BMC"""
         try:
-            url = f"{self.bmc_url}/redfish/v1/Systems/{system_id}"
-            data = {
-                'Boot': {
-                    'BootSourceOverrideTarget': boot_device,
-                    'BootSourceOverrideEnabled': enabled
-                }
-            }
-            response = requests.patch(url, json=data, verify=False, timeout=5)
-            return response.status_code == 200
+            return self._patch_boot(system_id, boot_device, enabled)
         except Exception as e:
             print(f"Error setting boot device: {e}")
             return False
-    
+
     def power_on(self, system_id):
         """Power on system via BMC"""
         try:
-            url = f"{self.bmc_url}/redfish/v1/Systems/{system_id}/Actions/ComputerSystem.Reset"
-            data = {'ResetType': 'On'}
-            response = requests.post(url, json=data, verify=False, timeout=5)
-            return response.status_code == 200
+            return self._reset(system_id, 'On')
         except Exception as e:
             print(f"Error powering on: {e}")
             return False
-    
+
     def power_off(self, system_id):
         """Power off system via BMC"""
         try:
-            url = f"{self.bmc_url}/redfish/v1/Systems/{system_id}/Actions/ComputerSystem.Reset"
-            data = {'ResetType': 'ForceOff'}
-            response = requests.post(url, json=data, verify=False, timeout=5)
-            return response.status_code == 200
+            return self._reset(system_id, 'ForceOff')
         except Exception as e:
             print(f"Error powering off: {e}")
             return False
-    
+
+    def run_batch(self, operation, system_ids, *args):
+        """
+        Run operation(system_id, *args) for every system concurrently.
+
+        Returns one result per system, in input order, with the operation's
+        return value or error and the wall time it took.
+        """
+        def run_one(system_id):
+            start = time.perf_counter()
+            try:
+                result, error = operation(system_id, *args), None
+            except Exception as e:
+                result, error = None, str(e)
+            return {
+                'system_id': system_id,
+                'ok': error is None,
+                'result': result,
+                'error': error,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+            }
+
+        workers = max(1, min(self.max_workers, len(system_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run_one, system_ids))
+
+    def batch_get_state(self, system_ids):
+        """Get Redfish state for many systems"""
+        return self.run_batch(self._fetch_state, system_ids)
+
+    def batch_set_boot_device(self, system_ids, boot_device='Pxe', enabled='Once'):
+        """Set boot device for many systems"""
+        return self.run_batch(self._patch_boot, system_ids, boot_device, enabled)
+
+    def batch_power_on(self, system_ids):
+        """Power on many systems"""
+        return self.run_batch(self._reset, system_ids, 'On')
+
+    def batch_power_off(self, system_ids):
+        """Power off many systems"""
+        return self.run_batch(self._reset, system_ids, 'ForceOff')
+
+    def vm_call(self, method, **params):
+        """Run a VMManager operation in the vm-manager daemon, or in-process"""
+        start = self.metrics.start()
+        status = 'error'
+        try:
+            if self.vm_manager is None and self.vm_client.available():
+                result = self.vm_client.call(method, **params)
+            elif self.vm_socket != DEFAULT_SOCKET:
+                # Another VM backend (e.g. virtual nodes); never fall back to QEMU
+                raise DaemonError(f"Nothing is serving VMs on {self.vm_socket}")
+            else:
+                with self.vm_manager_lock:
+                    if self.vm_manager is None:
+                        from vm_manager import VMManager
+                        self.vm_manager = VMManager()
+                    result = getattr(self.vm_manager, method)(**params)
+            status = 'ok'
+            return result
+        finally:
+            self.metrics.finish(f"vm.{method}", start, status)
+
     def pxe_boot_vm(self, vm_name):
         """Orchestrate PXE boot via BMC and start VM"""
         print(f"Initiating PXE boot for VM: {vm_name}")
-        
+
         # 1. Set BMC boot device to PXE
         print("Setting boot device to PXE...")
         if not self.set_boot_device('1', 'Pxe', 'Once'):
             print("Failed to set boot device")
             return False
-        
+
         # 2. Start VM with PXE boot
         print("Starting VM with PXE boot...")
-        cmd = ['python3', 'src/vm_manager.py', 'start', '--name', vm_name, '--boot', 'pxe']
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
+        try:
+            started = self.vm_call('start_vm', name=vm_name, boot_mode='pxe')
+        except DaemonError as e:
+            print(f"Failed to start VM: {e}")
+            return False
+
+        if started:
             print("VM started successfully with PXE boot")
             return True
         else:
-            print(f"Failed to start VM: {result.stderr}")
+            print("Failed to start VM")
             return False
 
 
-if __name__ == '__main__':
-    import sys
-    
-    if len(sys.argv) < 3:
-        print("Usage: python3 bmc_bridge.py <command> <vm_name>")
-        print("Commands: pxe-boot, power-on, power-off, status")
+class KeyedWorkers:
+    """
+    Runs jobs on a thread pool, one at a time and in submission order per
+    key, and concurrently across keys
+    """
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.queues = {}  # key -> jobs not yet run; present while the key has a worker
+
+    def submit(self, key, fn, *args):
+        with self.lock:
+            queue = self.queues.get(key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self.queues[key] = collections.deque([(fn, args)])
+        self.executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self.lock:
+                queue = self.queues[key]
+                if not queue:
+                    del self.queues[key]
+                    return
+                fn, args = queue.popleft()
+            fn(*args)
+
+
+class Reconciler:
+    """
+    Keeps VMs in line with their Redfish systems.
+
+    Subscribes to the BMC's EventService SSE stream and starts, stops or
+    restarts the mapped VM as each power event arrives, booting from PXE or
+    disk according to BootSourceOverrideTarget. The stream is resumed with
+    Last-Event-ID after a disconnect, so no events are missed and the API
+    is never polled.
+
+    Events are applied by per-system workers: each system's events run in
+    order, and a slow one (a graceful shutdown waiting on its guest) does
+    not hold up the others.
+    """
+
+    def __init__(self, bridge, system_map, reconnect_delay=1.0, read_timeout=60,
+                 metrics_file=None, workers=None, shutdown_timeout=30, poll_interval=0.5):
+        self.bridge = bridge
+        self.system_map = system_map
+        self.workers = KeyedWorkers(workers or bridge.max_workers)
+        self.shutdown_timeout = shutdown_timeout
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.read_timeout = read_timeout  # > the server's keep-alive interval
+        self.metrics_file = metrics_file  # rewritten after every event
+        self.last_event_id = None
+        self.host_pids = {}  # system id -> QEMU pid last reported to the BMC
+
+    def is_running(self, vm_name):
+        return self.bridge.vm_call('vm_status', name=vm_name)['state'] != 'stopped'
+
+    def report_pid(self, system_id, vm_name):
+        """Tell the BMC which host process backs a system (feeds its sensors)"""
+        pid = self.bridge.vm_call('vm_status', name=vm_name)['pid']
+        if self.host_pids.get(system_id, 0) != pid:
+            self.bridge.set_host_pid(system_id, pid)
+            self.host_pids[system_id] = pid
+
+    def shutdown(self, vm_name):
+        """
+        ACPI power-down, then SIGKILL after shutdown_timeout. The wait for
+        the guest happens here, not in the VM manager, which would be tied
+        up for all of it.
+        """
+        if self.bridge.vm_call('powerdown_vm', name=vm_name):
+            deadline = time.monotonic() + self.shutdown_timeout
+            while time.monotonic() < deadline and self.is_running(vm_name):
+                time.sleep(self.poll_interval)
+        # Cleans up after a guest that powered off, kills one that did not
+        self.bridge.vm_call('stop_vm', name=vm_name, force=True)
+
+    def apply(self, system_id, power_state, boot_target, boot_enabled, reset_type=None):
+        """Bring one VM to the given Redfish state"""
+        vm_name = self.system_map.get(system_id)
+        if vm_name is None:
+            return
+        try:
+            self.apply_power(system_id, vm_name, power_state, boot_target,
+                             boot_enabled, reset_type)
+        finally:
+            self.report_pid(system_id, vm_name)
+
+    def apply_power(self, system_id, vm_name, power_state, boot_target, boot_enabled,
+                    reset_type):
+        running = self.is_running(vm_name)
+        boot_mode = boot_mode_for(boot_target, boot_enabled)
+
+        if power_state == 'Off':
+            if running:
+                print(f"System {system_id}: stopping {vm_name}")
+                if reset_type == 'GracefulShutdown':
+                    self.shutdown(vm_name)
+                else:
+                    self.bridge.vm_call('stop_vm', name=vm_name, force=True)
+            return
+
+        if running and reset_type == 'ForceRestart':
+            print(f"System {system_id}: resetting {vm_name}")
+            self.bridge.vm_call('reset_vm', name=vm_name)
+            return
+        if running and reset_type == 'GracefulRestart':
+            print(f"System {system_id}: restarting {vm_name}")
+            self.shutdown(vm_name)
+            running = False
+        if running:
+            return
+
+        print(f"System {system_id}: starting {vm_name} ({boot_mode} boot)")
+        if self.bridge.vm_call('start_vm', name=vm_name, boot_mode=boot_mode) \
+                and boot_enabled == 'Once':
+            # A one-time override is consumed by the boot it applied to
+            self.bridge.set_boot_device(system_id, boot_target, 'Disabled')
+
+    def run_apply(self, system_id, *state):
+        """apply() on a worker; a failure is logged and only affects this event"""
+        try:
+            self.apply(system_id, *state)
+        except Exception as e:
+            print(f"System {system_id}: {type(e).__name__}: {e}")
+
+    def submit(self, system_id, *state):
+        self.workers.submit(system_id, self.run_apply, system_id, *state)
+
+    def handle_event(self, record):
+        system_id = record['OriginOfCondition']['@odata.id'].rsplit('/', 1)[-1]
+        oem = record.get('Oem', {}).get('DCSimulator', {})
+        self.submit(system_id, oem.get('PowerState'), oem.get('BootSourceOverrideTarget'),
+                    oem.get('BootSourceOverrideEnabled'), oem.get('ResetType'))
+
+    def sync_all(self):
+        """Apply the current state of every mapped system"""
+        system_ids = list(self.system_map)
+        for result in self.bridge.batch_get_state(system_ids):
+            if not result['ok']:
+                print(f"System {result['system_id']}: {result['error']}")
+                continue
+            state = result['result']
+            boot = state.get('Boot', {})
+            oem = state.get('Oem', {}).get('DCSimulator', {})
+            self.host_pids[result['system_id']] = oem.get('HostPid')
+            self.submit(result['system_id'], state.get('PowerState'),
+                        boot.get('BootSourceOverrideTarget'), boot.get('BootSourceOverrideEnabled'))
+
+    def open_stream(self):
+        url = f"{self.bridge.bmc_url}/redfish/v1/EventService/SSE"
+        headers = {'Accept': 'text/event-stream'}
+        if self.last_event_id:
+            headers['Last-Event-ID'] = self.last_event_id
+        response = self.bridge.session.get(
+            url, headers=headers, stream=True,
+            params={'$filter': "EventType eq 'StatusChange'"},
+            timeout=(self.bridge.timeout, self.read_timeout))
+        response.raise_for_status()
+        return response
+
+    def read_events(self, response):
+        """Yield (event id, payload) pairs from an SSE response"""
+        event_id, data = None, []
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if line.startswith(':'):
+                continue
+            if line:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'id':
+                    event_id = value
+                elif field == 'data':
+                    data.append(value)
+                continue
+            if data:
+                yield event_id, json.loads('\n'.join(data))
+            event_id, data = None, []
+
+    def write_metrics(self):
+        if self.metrics_file:
+            self.bridge.metrics.write(self.metrics_file)
+
+    def run(self):
+        """Reconcile until interrupted"""
+        print(f"Reconciling {len(self.system_map)} systems against {self.bridge.bmc_url}")
+        synced = False
+        while True:
+            try:
+                with self.open_stream() as response:
+                    # Subscribe before the initial sync so changes made while
+                    # it runs are delivered as events rather than lost.
+                    if not synced:
+                        self.sync_all()
+                        synced = True
+                        self.write_metrics()
+                    for event_id, payload in self.read_events(response):
+                        for record in payload.get('Events', []):
+                            try:
+                                self.handle_event(record)
+                            except Exception as e:
+                                print(f"Skipping malformed event record {record!r}: {e}")
+                        self.last_event_id = event_id
+                        self.write_metrics()
+            except (requests.RequestException, ValueError) as e:
+                print(f"Event stream lost: {e}; reconnecting")
+            time.sleep(self.reconnect_delay)
+
+
+def print_batch_summary(results, elapsed):
+    """Print totals, latency spread and failures for a batch run"""
+    ok = sum(1 for r in results if r['ok'])
+    times = sorted(r['elapsed_ms'] for r in results)
+    print(f"{ok}/{len(results)} succeeded in {elapsed:.2f}s")
+    if times:
+        print(f"  per-system: min {times[0]}ms, "
+              f"p50 {times[len(times) // 2]}ms, max {times[-1]}ms")
+    for r in results:
+        if not r['ok']:
+            print(f"  system {r['system_id']}: {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BMC Bridge for DC Simulator')
+    parser.add_argument('--bmc-url', default='http://192.168.100.10', help='Redfish base URL')
+    parser.add_argument('--workers', type=int, default=32, help='Concurrent requests')
+    parser.add_argument('--json', action='store_true', help='Print per-system results as JSON')
+    parser.add_argument('--metrics-file',
+                        help='Write request counters and latencies here in Prometheus text '
+                             'format (after a batch, or after every event when reconciling)')
+    parser.add_argument('--vm-socket', default=DEFAULT_SOCKET,
+                        help='Daemon serving VM operations (virtual_nodes.py serve for '
+                             'simulated nodes)')
+    subparsers = parser.add_subparsers(dest='command', help='Commands')
+
+    pxe_parser = subparsers.add_parser('pxe-boot', help='Set PXE boot and start a VM')
+    pxe_parser.add_argument('vm_name', help='VM name')
+
+    for command in ('power-on', 'power-off', 'status'):
+        cmd_parser = subparsers.add_parser(command, help=f'{command} for systems')
+        cmd_parser.add_argument('systems', nargs='?', default='1',
+                                help="System ids, e.g. '1', '1-500' or '1,4,10-20'")
+
+    boot_parser = subparsers.add_parser('set-boot', help='Set boot device for systems')
+    boot_parser.add_argument('systems', help="System ids, e.g. '1-500'")
+    boot_parser.add_argument('--device', default='Pxe',
+                             choices=['None', 'Pxe', 'Hdd', 'Cd', 'BiosSetup'])
+    boot_parser.add_argument('--enabled', default='Once',
+                             choices=['Disabled', 'Once', 'Continuous'])
+
+    reconcile_parser = subparsers.add_parser(
+        'reconcile', help='Drive VMs from Redfish power events')
+    reconcile_parser.add_argument(
+        '--map', help="System-to-VM mapping, e.g. '1=vm1,2=vm2' "
+                      "(default: systems 1..N to VMs in creation order)")
+
+    args = parser.parse_args()
+
+    bridge = BMCBridge(args.bmc_url, max_workers=args.workers, vm_socket=args.vm_socket)
+
+    if args.command == 'pxe-boot':
+        sys.exit(0 if bridge.pxe_boot_vm(args.vm_name) else 1)
+    elif args.command == 'reconcile':
+        if args.map:
+            system_map = parse_system_map(args.map)
+        else:
+            system_map = {str(i): name for i, name in
+                          enumerate(bridge.vm_call('vm_names'), start=1)}
+        try:
+            Reconciler(bridge, system_map, metrics_file=args.metrics_file,
+                       workers=args.workers).run()
+        except KeyboardInterrupt:
+            pass
+        return
+    elif args.command is None:
+        parser.print_help()
         sys.exit(1)
-    
-    command = sys.argv[1]
-    vm_name = sys.argv[2]
-    
-    bridge = BMCBridge()
-    
-    if command == 'pxe-boot':
-        bridge.pxe_boot_vm(vm_name)
-    elif command == 'power-on':
-        bridge.power_on('1')
-    elif command == 'power-off':
-        bridge.power_off('1')
-    elif command == 'status':
-        state = bridge.get_bmc_state('1')
+
+    try:
+        system_ids = parse_system_ids(args.systems)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.command == 'status' and len(system_ids) == 1 and not args.json:
+        state = bridge.get_bmc_state(system_ids[0])
         if state:
             print(json.dumps(state, indent=2))
+        if args.metrics_file:
+            bridge.metrics.write(args.metrics_file)
+        sys.exit(0 if state else 1)
+
+    start = time.perf_counter()
+    if args.command == 'power-on':
+        results = bridge.batch_power_on(system_ids)
+    elif args.command == 'power-off':
+        results = bridge.batch_power_off(system_ids)
+    elif args.command == 'set-boot':
+        results = bridge.batch_set_boot_device(system_ids, args.device, args.enabled)
+    else:
+        results = bridge.batch_get_state(system_ids)
+    elapsed = time.perf_counter() - start
+    if args.metrics_file:
+        bridge.metrics.write(args.metrics_file)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
     else:
-        print(f"Unknown command: {command}")
+        print_batch_summary(results, elapsed)
+    sys.exit(0 if all(r['ok'] for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
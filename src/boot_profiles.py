@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Boot Profiles
+Machine types and boot paths for VMs: the full PC booting through firmware,
+direct kernel boot of the netboot files, or a minimal microvm
+"""
+
+import re
+import socket
+import time
+from pathlib import Path
+
+from console_aggregator import TELNET_COMMAND
+
+DEFAULT_BOOT_PROFILE = 'pc'
+
+# The kernel and initrd PXE clients download (setup.sh extracts them)
+NETBOOT_KERNEL = 'images/ubuntu/ubuntu-installer/amd64/linux'
+NETBOOT_INITRD = 'images/ubuntu/ubuntu-installer/amd64/initrd.gz'
+
+# No option ROMs, legacy PIT/PIC or PCI; just the serial port and RTC
+MICROVM_MACHINE = 'microvm,x-option-roms=off,pit=off,pic=off,isa-serial=on,rtc=on'
+
+BOOT_PROFILES = {
+    'pc': {
+        'description': 'PC machine booting through firmware (disk or NIC option ROM)',
+    },
+    'direct-kernel': {
+        'description': 'PC machine loading the netboot kernel/initrd directly, no PXE',
+        'kernel': NETBOOT_KERNEL,
+        'initrd': NETBOOT_INITRD,
+        'append': 'console=ttyS0',
+    },
+    'microvm': {
+        'description': 'microvm: direct kernel boot, virtio-mmio devices, no firmware or VGA',
+        'machine': 'microvm',
+        'kernel': NETBOOT_KERNEL,
+        'initrd': NETBOOT_INITRD,
+        'append': 'console=ttyS0',
+    },
+}
+
+
+def get_boot_profile(name, custom=None):
+    """A built-in or config-defined (boot_profiles: in vms.yaml) profile"""
+    profiles = dict(BOOT_PROFILES, **(custom or {}))
+    if name not in profiles:
+        raise ValueError(f"Unknown boot profile '{name}' (have: {', '.join(sorted(profiles))})")
+    profile = profiles[name]
+    if profile.get('machine') == 'microvm' and not profile.get('kernel'):
+        raise ValueError(f"Boot profile '{name}': microvm has no firmware and needs a kernel")
+    return profile
+
+
+def kernel_args(profile):
+    """-kernel/-initrd/-append for a direct-boot profile, [] otherwise"""
+    if not profile.get('kernel'):
+        return []
+    for key in ('kernel', 'initrd'):
+        if profile.get(key) and not Path(profile[key]).exists():
+            raise FileNotFoundError(f"{profile[key]} not found (run ./setup.sh for netboot files)")
+    args = ['-kernel', profile['kernel']]
+    if profile.get('initrd'):
+        args.extend(['-initrd', profile['initrd']])
+    if profile.get('append'):
+        args.extend(['-append', profile['append']])
+    return args
+
+
+def connect_serial(address, timeout=5.0):
+    """Connect to a serial chardev: a Unix socket path or a (host, port) pair"""
+    deadline = time.monotonic() + timeout
+    while True:
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(address if isinstance(address, tuple) else str(address))
+            return sock
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def wait_for_output(sock, start, timeout=60.0, pattern=None):
+    """
+    Seconds from start until the first serial byte, and until pattern
+    (bytes regex) appears if given; None for whatever did not show up
+    within timeout. Telnet negotiation is not guest output.
+    """
+    first = matched = None
+    buffer = b''
+    deadline = start + timeout
+    while time.monotonic() < deadline:
+        sock.settimeout(max(0.01, deadline - time.monotonic()))
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            break
+        if not data:
+            break
+        data = TELNET_COMMAND.sub(b'', data)
+        if data and first is None:
+            first = time.monotonic() - start
+        if pattern is None:
+            if first is not None:
+                break
+            continue
+        buffer = (buffer + data)[-4096:]
+        if re.search(pattern, buffer):
+            matched = time.monotonic() - start
+            break
+    return first, matched
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Boot Timeline
+Follows the PXE server's dnsmasq and nginx logs and every VM's serial
+console during PXE installs, matches what it sees to VMs by MAC address,
+and reports per-VM phase durations plus fleet-wide aggregates
+"""
+
+import argparse
+import calendar
+import json
+import re
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+
+from console_aggregator import (DEFAULT_SOCKET as CONSOLE_SOCKET, TELNET_COMMAND, ConsoleClient,
+                                console_socket)
+from inventory import Inventory
+
+# Written by the bmc-pxe container (see start.sh)
+DNSMASQ_LOG = 'logs/pxe/dnsmasq.log'
+NGINX_LOG = 'logs/pxe/nginx-access.log'
+EVENTS_FILE = 'logs/boot-events.ndjson'
+
+# "Oct 17 04:38:47 dnsmasq-dhcp[7]: 3528213 DHCPACK(br0) 192.168.100.150 52:54:00:.."
+DNSMASQ_LINE = re.compile(r'^(\w{3}\s+\d+ \d\d:\d\d:\d\d) dnsmasq(?:-\w+)?\[\d+\]: (.*)$')
+DHCP_MESSAGE = re.compile(
+    r'(DHCP[A-Z]+)\([^)]*\)\s+(?:(\d+\.\d+\.\d+\.\d+)\s+)?([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5})')
+TFTP_SENT = re.compile(r'sent (\S+) to (\d+\.\d+\.\d+\.\d+)')
+# log_format pxe in containers/pxe-server/config/nginx.conf
+NGINX_LINE = re.compile(r'^(\d+\.\d+) (\S+) "(\S+) (\S+)[^"]*" (\d{3}) (\d+)')
+
+# Serial console lines that mark milestones. Anything after the boot loader
+# only shows up when the kernel command line has console=ttyS0.
+SERIAL_MARKERS = (
+    ('kernel_start', 'Linux version'),
+    ('userspace', 'Run /init as init process'),
+    ('reboot', 'reboot: Restarting system'),
+    ('login', ' login:'),
+)
+
+# Milestone -> (event kind, whether its first or last occurrence counts)
+MILESTONES = {
+    'dhcp_discover': ('dhcp_discover', 'first'),
+    'dhcp_ack': ('dhcp_ack', 'first'),
+    'tftp_done': ('tftp_sent', 'last'),
+    'kernel_start': ('kernel_start', 'first'),
+    'userspace': ('userspace', 'first'),
+    'http_first': ('http_get', 'first'),
+    'http_last': ('http_get', 'last'),
+    'reboot': ('reboot', 'first'),
+    'login': ('login', 'first'),
+}
+
+# Phase -> (start milestone, end milestone)
+PHASES = (
+    ('dhcp', 'dhcp_discover', 'dhcp_ack'),    # PXE ROM DISCOVER until its lease
+    ('tftp', 'dhcp_ack', 'tftp_done'),        # boot loader, kernel and initrd
+    ('kernel', 'tftp_done', 'userspace'),
+    ('installer', 'userspace', 'reboot'),
+    ('http', 'http_first', 'http_last'),      # installer fetches (inside 'installer')
+    ('total', 'dhcp_discover', 'end'),
+)
+
+
+def dnsmasq_time(stamp, now=None):
+    """
+    Epoch time of a dnsmasq log timestamp. dnsmasq logs without a year, in
+    the container's time zone (UTC).
+    """
+    now = now or time.time()
+    stamp = ' '.join(stamp.split())
+    year = time.gmtime(now).tm_year
+    parsed = calendar.timegm(time.strptime(f"{year} {stamp}", '%Y %b %d %H:%M:%S'))
+    if parsed > now + 86400:
+        # A December line read in January
+        parsed = calendar.timegm(time.strptime(f"{year - 1} {stamp}", '%Y %b %d %H:%M:%S'))
+    return float(parsed)
+
+
+def load_vms(inventory_path='config/inventory.db', vms_file=None):
+    """VM configs from the inventory, or from a vms.yaml-format file"""
+    if vms_file:
+        with open(vms_file, 'r') as f:
+            vms = (yaml.safe_load(f) or {}).get('vms') or {}
+        return [dict(config, name=config.get('name', name)) for name, config in vms.items()]
+    return Inventory(inventory_path).all()
+
+
+class BootCollector:
+    """
+    Turns log lines and console output into boot events for known VMs.
+
+    DHCP lines carry the MAC; TFTP and HTTP lines only the client address,
+    which is resolved through the leases seen in DHCPACKs. Events are kept
+    in memory and appended to events_path as they arrive.
+    """
+
+    def __init__(self, vms, events_path=EVENTS_FILE, dnsmasq_log=DNSMASQ_LOG,
+                 nginx_log=NGINX_LOG, poll_interval=0.2, console_socket=CONSOLE_SOCKET,
+                 vm_dir='images/vms'):
+        self.vms = {vm['name']: vm for vm in vms}
+        self.by_mac = {vm['mac'].lower(): vm['name'] for vm in vms if vm.get('mac')}
+        self.by_ip = {}
+        self.dnsmasq_log = dnsmasq_log
+        self.nginx_log = nginx_log
+        self.poll_interval = poll_interval
+        self.consoles = ConsoleClient(console_socket)
+        self.vm_dir = Path(vm_dir)
+        self.events = []
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        Path(events_path).parent.mkdir(parents=True, exist_ok=True)
+        self.out = open(events_path, 'a')
+
+    def record(self, vm, source, kind, at, detail=None):
+        event = {'time': at, 'vm': vm, 'source': source, 'kind': kind, 'detail': detail}
+        with self.lock:
+            self.events.append(event)
+            self.out.write(json.dumps(event) + '\n')
+            self.out.flush()
+
+    def parse_dnsmasq(self, line, now=None):
+        match = DNSMASQ_LINE.match(line)
+        if not match:
+            return
+        at = dnsmasq_time(match.group(1), now)
+        message = match.group(2)
+        dhcp = DHCP_MESSAGE.search(message)
+        if dhcp:
+            kind, ip, mac = dhcp.group(1), dhcp.group(2), dhcp.group(3).lower()
+            vm = self.by_mac.get(mac)
+            if vm is None:
+                return
+            if kind == 'DHCPACK' and ip:
+                self.by_ip[ip] = vm
+            self.record(vm, 'dhcp', f"dhcp_{kind[4:].lower()}", at, ip)
+            return
+        tftp = TFTP_SENT.search(message)
+        if tftp and tftp.group(2) in self.by_ip:
+            self.record(self.by_ip[tftp.group(2)], 'tftp', 'tftp_sent', at, tftp.group(1))
+
+    def parse_nginx(self, line):
+        match = NGINX_LINE.match(line)
+        if not match or match.group(2) not in self.by_ip:
+            return
+        self.record(self.by_ip[match.group(2)], 'http', 'http_get', float(match.group(1)),
+                    f"{match.group(4)} {match.group(5)} {match.group(6)}")
+
+    def follow(self, path, handle, from_start):
+        """Feed lines appended to path to handle(), surviving rotation"""
+        f, inode = None, None
+        while not self.stop.is_set():
+            if f is None:
+                try:
+                    f = open(path, 'rb')
+                except OSError:
+                    self.stop.wait(1.0)
+                    continue
+                inode = Path(path).stat().st_ino
+                if not from_start:
+                    f.seek(0, 2)
+                from_start = True  # a rotated-in file is read from its start
+            line = f.readline()
+            if line.endswith(b'\n'):
+                handle(line.rstrip(b'\r\n').decode(errors='replace'))
+                continue
+            if line:
+                # Half-written line; read it again once it is complete
+                f.seek(-len(line), 1)
+            try:
+                stat = Path(path).stat()
+                if stat.st_ino != inode or stat.st_size < f.tell():
+                    f.close()
+                    f = None
+                    continue
+            except OSError:
+                pass
+            self.stop.wait(self.poll_interval)
+        if f:
+            f.close()
+
+    def connect_console(self, vm):
+        """(socket, telnet) for a VM's serial console: its unix socket, else telnet"""
+        path = console_socket(self.vm_dir, vm['name'])
+        if path.exists():
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.settimeout(1.0)
+                conn.connect(str(path))
+            except OSError:
+                conn.close()
+                raise
+            return conn, False
+        if not vm.get('serial_port'):
+            raise OSError('no serial console')
+        return socket.create_connection(('127.0.0.1', vm['serial_port']), timeout=1.0), True
+
+    def watch_console(self, vm):
+        """Match milestone markers on a VM's serial console (unix socket or QEMU telnet server)"""
+        while not self.stop.is_set():
+            try:
+                conn, telnet = self.connect_console(vm)
+            except OSError:
+                self.stop.wait(2.0)   # VM not running yet
+                continue
+            buffer = b''
+            with conn:
+                conn.settimeout(1.0)
+                while not self.stop.is_set():
+                    try:
+                        data = conn.recv(65536)
+                    except socket.timeout:
+                        continue
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    buffer += TELNET_COMMAND.sub(b'', data) if telnet else data
+                    *lines, buffer = buffer.split(b'\n')
+                    now = time.time()
+                    for line in lines:
+                        self.match_markers(vm['name'], line.decode(errors='replace'), now)
+
+    def watch_aggregator(self):
+        """Match markers in console output relayed by a running console aggregator"""
+        try:
+            for entry in self.consoles.tail(list(self.vms), lines=0):
+                at = datetime.fromisoformat(entry['time'].replace('Z', '+00:00')).timestamp()
+                self.match_markers(entry['vm'], entry['line'], at)
+        except OSError as e:
+            print(f"Console aggregator connection lost: {e}", file=sys.stderr)
+
+    def match_markers(self, vm, text, at):
+        for kind, marker in SERIAL_MARKERS:
+            if marker in text:
+                self.record(vm, 'serial', kind, at, text.strip()[:200])
+
+    def run(self, duration=None, from_start=False):
+        """Collect until duration seconds pass or Ctrl-C"""
+        threads = [
+            threading.Thread(target=self.follow, daemon=True,
+                             args=(self.dnsmasq_log, self.parse_dnsmasq, from_start)),
+            threading.Thread(target=self.follow, daemon=True,
+                             args=(self.nginx_log, self.parse_nginx, from_start)),
+        ]
+        if self.consoles.available():
+            # A telnet console takes one client, so share the aggregator's
+            consoles = 'consoles via the console aggregator'
+            threads.append(threading.Thread(target=self.watch_aggregator, daemon=True))
+        else:
+            # Any VM may have a unix socket console (serial_console: unix) once it starts
+            consoles = f"{len(self.vms)} consoles"
+            threads += [threading.Thread(target=self.watch_console, args=(vm,), daemon=True)
+                        for vm in self.vms.values()]
+        for thread in threads:
+            thread.start()
+        print(f"Collecting boot events for {len(self.vms)} VMs ({consoles}); "
+              f"Ctrl-C to stop", file=sys.stderr)
+        try:
+            if duration:
+                self.stop.wait(duration)
+            else:
+                while not self.stop.is_set():
+                    self.stop.wait(1.0)
+        except KeyboardInterrupt:
+            pass
+        self.stop.set()
+        for thread in threads:
+            thread.join(timeout=2.0)
+        self.out.close()
+        return self.events
+
+
+def load_events(path=EVENTS_FILE):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def split_boots(vm_events):
+    """
+    One VM's events, in time order, split into boots. A DHCPDISCOVER once
+    the current boot has reached reboot or login starts the next boot (the
+    installer's own DHCP request, before its reboot, does not), so the
+    post-install PXE boot and later runs appended to the event log are
+    not mixed into an earlier boot.
+    """
+    boots = [[]]
+    finished = False
+    for event in vm_events:
+        if event['kind'] == 'dhcp_discover' and finished:
+            boots.append([])
+            finished = False
+        boots[-1].append(event)
+        if event['kind'] in ('reboot', 'login'):
+            finished = True
+    return boots
+
+
+def boot_timeline(boot_events):
+    """Milestones (epoch seconds) and phase durations (seconds) of one boot"""
+    milestones = {}
+    for name, (kind, which) in MILESTONES.items():
+        times = [e['time'] for e in boot_events if e['kind'] == kind]
+        if times:
+            milestones[name] = times[0] if which == 'first' else times[-1]
+    end = milestones.get('login', milestones.get('reboot'))
+    if end is not None:
+        milestones['end'] = end
+    phases = {}
+    for phase, start, finish in PHASES:
+        if start in milestones and finish in milestones:
+            phases[phase] = round(max(0.0, milestones[finish] - milestones[start]), 3)
+    return {'milestones': milestones, 'phases': phases, 'events': len(boot_events)}
+
+
+def timelines(events):
+    """
+    Per-VM timeline of its latest install (the last boot that reached the
+    installer's reboot), or of its latest boot if none did, with the number
+    of boots seen
+    """
+    by_vm = {}
+    for event in sorted(events, key=lambda e: e['time']):
+        by_vm.setdefault(event['vm'], []).append(event)
+    result = {}
+    for vm, vm_events in by_vm.items():
+        boots = [boot_timeline(boot) for boot in split_boots(vm_events)]
+        installs = [boot for boot in boots if 'reboot' in boot['milestones']]
+        result[vm] = dict((installs or boots)[-1], boots=len(boots))
+    return result
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def fleet_summary(vm_timelines):
+    """Per-phase count, mean, p50, p95 and max across VMs, plus the storm's wall time"""
+    summary = {'vms': len(vm_timelines), 'phases': {}}
+    for phase, _, _ in PHASES:
+        values = sorted(t['phases'][phase] for t in vm_timelines.values() if phase in t['phases'])
+        if not values:
+            continue
+        summary['phases'][phase] = {
+            'count': len(values),
+            'mean': round(sum(values) / len(values), 3),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'max': values[-1],
+        }
+    starts = [t['milestones']['dhcp_discover'] for t in vm_timelines.values()
+              if 'dhcp_discover' in t['milestones']]
+    ends = [t['milestones']['end'] for t in vm_timelines.values() if 'end' in t['milestones']]
+    if starts and ends:
+        summary['wall_time'] = round(max(ends) - min(starts), 3)
+    return summary
+
+
+def print_report(vm_timelines, summary):
+    phases = [phase for phase, _, _ in PHASES]
+    print(f"{'VM':<15}" + ''.join(f"{p:>11}" for p in phases))
+    print("-" * (15 + 11 * len(phases)))
+    for vm in sorted(vm_timelines, key=str):
+        durations = vm_timelines[vm]['phases']
+        print(f"{vm:<15}" + ''.join(
+            f"{durations[p]:>10.1f}s" if p in durations else f"{'-':>11}" for p in phases))
+    print()
+    print(f"Fleet ({summary['vms']} VMs)" +
+          (f", first DHCP to last finish: {summary['wall_time']:.1f}s"
+           if 'wall_time' in summary else ''))
+    print(f"{'phase':<12}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+    for phase, stats in summary['phases'].items():
+        print(f"{phase:<12}{stats['count']:>7}" + ''.join(
+            f"{stats[k]:>8.1f}s" for k in ('mean', 'p50', 'p95', 'max')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PXE install boot timeline')
+    parser.add_argument('--inventory', default='config/inventory.db', help='VM inventory')
+    parser.add_argument('--vms', help='Read VMs from a vms.yaml-format file instead')
+    parser.add_argument('--events', default=EVENTS_FILE, help='Event log (NDJSON)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    subparsers = parser.add_subparsers(dest='command', help='Commands')
+
+    collect_parser = subparsers.add_parser(
+        'collect', help='Follow PXE logs and serial consoles, then report')
+    collect_parser.add_argument('--duration', type=float, help='Stop after this many seconds')
+    collect_parser.add_argument('--from-start', action='store_true',
+                                help='Read the PXE logs from the beginning, not just new lines')
+    collect_parser.add_argument('--dnsmasq-log', default=DNSMASQ_LOG)
+    collect_parser.add_argument('--nginx-log', default=NGINX_LOG)
+    collect_parser.add_argument('--console-socket', default=CONSOLE_SOCKET,
+                                help='Console aggregator socket, used when it is running')
+
+    subparsers.add_parser('report', help='Report on previously collected events')
+
+    args = parser.parse_args()
+
+    if args.command == 'collect':
+        vms = load_vms(args.inventory, args.vms)
+        collector = BootCollector(vms, args.events, args.dnsmasq_log, args.nginx_log,
+                                  console_socket=args.console_socket)
+        events = collector.run(args.duration, args.from_start)
+    elif args.command == 'report':
+        try:
+            events = load_events(args.events)
+        except FileNotFoundError:
+            print(f"No events in {args.events}; run 'collect' first")
+            sys.exit(1)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    vm_timelines = timelines(events)
+    summary = fleet_summary(vm_timelines)
+    if args.json:
+        print(json.dumps({'vms': vm_timelines, 'fleet': summary}, indent=2))
+    else:
+        print_report(vm_timelines, summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Console Aggregator
+Captures every VM's serial console on one asyncio event loop into per-VM
+rotating logs with a sparse time index, and serves live tails and
+fleet-wide search over a local Unix socket (newline-delimited JSON)
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import re
+import resource
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+from inventory import Inventory
+
+DEFAULT_SOCKET = 'images/vms/console-aggregator.sock'
+LOG_DIR = 'logs/consoles'
+MAX_BYTES = 10 * 1024 * 1024    # per log file before it is rotated
+BACKUPS = 5                     # rotated files kept per VM
+INDEX_EVERY = 64 * 1024         # bytes of log between index marks
+BACKLOG_LINES = 200             # recent lines per VM kept in memory for tail
+MAX_LINE = 64 * 1024            # longer output without a newline is split
+PARTIAL_LINE_WAIT = 0.5         # seconds before a line without newline (a prompt) is logged
+TAIL_QUEUE = 10000              # lines buffered per tail client before it is dropped
+
+# Telnet negotiation QEMU sends on connect (IAC command [option])
+TELNET_COMMAND = re.compile(rb'\xff[\xfb-\xfe].|\xff[\xf0-\xfa]', re.DOTALL)
+
+# Log lines start with a fixed-width UTC timestamp, so time ranges are
+# plain string comparisons
+STAMP_WIDTH = len('2026-01-01T00:00:00.000Z')
+
+
+def format_time(at):
+    return datetime.fromtimestamp(at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_time(value):
+    """Epoch seconds, or an ISO 8601 time (naive times are local), as a log stamp"""
+    try:
+        return format_time(float(value))
+    except ValueError:
+        return format_time(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+
+def console_socket(vm_dir, name):
+    """Unix socket chardev of a VM started with serial_console: unix"""
+    return Path(vm_dir) / f"{name}.console"
+
+
+class ConsoleLog:
+    """
+    Timestamped console output of one VM in name.log, rotated to
+    name.log.1..N once it reaches max_bytes. Every INDEX_EVERY bytes the
+    time and offset of the next line go to a name.log.idx sidecar, which
+    rotates with its log and lets searches skip and seek by time.
+    """
+
+    def __init__(self, directory, name, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = Path(directory) / f"{name}.log"
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        self.since_mark = INDEX_EVERY
+
+    def write(self, at, text):
+        stamp = format_time(at)
+        line = f"{stamp} {text}\n".encode(errors='replace')
+        if self.since_mark >= INDEX_EVERY:
+            with open(f"{self.path}.idx", 'a') as idx:
+                idx.write(f"{stamp} {self.size}\n")
+            self.since_mark = 0
+        self.file.write(line)
+        self.size += len(line)
+        self.since_mark += len(line)
+        if self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups, 0, -1):
+            source = self.path if i == 1 else Path(f"{self.path}.{i - 1}")
+            for suffix in ('', '.idx'):
+                src = Path(f"{source}{suffix}")
+                if src.exists():
+                    os.replace(src, f"{self.path}.{i}{suffix}")
+        self.file = open(self.path, 'ab')
+        self.size = 0
+        self.since_mark = INDEX_EVERY
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def log_files(log_dir, name):
+    """A VM's log files, oldest first"""
+    base = Path(log_dir) / f"{name}.log"
+    rotated = [p for p in base.parent.glob(f"{name}.log.*") if p.suffix[1:].isdigit()]
+    files = sorted(rotated, key=lambda p: int(p.suffix[1:]), reverse=True)
+    if base.exists():
+        files.append(base)
+    return files
+
+
+def read_index(path):
+    try:
+        with open(f"{path}.idx", 'r') as f:
+            return [(stamp, int(offset)) for stamp, offset in
+                    (line.split() for line in f if line.strip())]
+    except (OSError, ValueError):
+        return []
+
+
+def search_vm(log_dir, name, regex, since=None, until=None):
+    """(stamp, name, text) of one VM's lines matching regex within [since, until]"""
+    files = log_files(log_dir, name)
+    for i, path in enumerate(files):
+        marks = read_index(path)
+        if until and marks and marks[0][0] > until:
+            break   # this and every later file start after the range
+        if since and i + 1 < len(files):
+            following = read_index(files[i + 1])
+            if following and following[0][0] < since:
+                continue    # the next file starts before since, so this one ends before it
+        offset = 0
+        if since:
+            offset = max([o for stamp, o in marks if stamp <= since], default=0)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for raw in f:
+                line = raw.decode(errors='replace').rstrip('\n')
+                stamp = line[:STAMP_WIDTH]
+                if since and stamp < since:
+                    continue
+                if until and stamp > until:
+                    return
+                text = line[STAMP_WIDTH + 1:]
+                if regex.search(text):
+                    yield stamp, name, text
+
+
+def search_logs(log_dir, pattern, names=None, since=None, until=None, limit=1000,
+                ignore_case=False):
+    """Matching lines across VMs in time order, as {'vm', 'time', 'line'} dicts"""
+    regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    if names is None:
+        names = sorted(p.name[:-len('.log')] for p in Path(log_dir).glob('*.log'))
+    matches = heapq.merge(*(search_vm(log_dir, name, regex, since, until) for name in names))
+    results = []
+    for stamp, name, text in matches:
+        results.append({'vm': name, 'time': stamp, 'line': text})
+        if len(results) >= limit:
+            break
+    return results
+
+
+class Console:
+    """Capture state of one VM's serial console"""
+
+    def __init__(self, vm, log):
+        self.name = vm['name']
+        self.serial_port = vm.get('serial_port')
+        self.log = log
+        self.backlog = deque(maxlen=BACKLOG_LINES)
+        self.task = None
+        self.connected = False
+        self.lines = 0
+        self.bytes = 0
+        self.last_at = None
+
+
+class ConsoleAggregator:
+    """
+    Connects to every VM in the inventory and keeps reconnecting, so output
+    from VMs that start later or reboot is captured too. The inventory is
+    re-read every rescan_interval to pick up created and deleted VMs.
+    """
+
+    def __init__(self, inventory_path='config/inventory.db', vm_dir='images/vms',
+                 log_dir=LOG_DIR, socket_path=DEFAULT_SOCKET, max_bytes=MAX_BYTES,
+                 backups=BACKUPS, rescan_interval=5.0):
+        self.inventory_path = inventory_path
+        self.vm_dir = Path(vm_dir)
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.socket_path = socket_path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.rescan_interval = rescan_interval
+        self.consoles = {}
+        self.subscribers = []   # (names or None, queue)
+
+    async def connect(self, console):
+        path = console_socket(self.vm_dir, console.name)
+        if path.exists():
+            reader, writer = await asyncio.open_unix_connection(str(path))
+            return reader, writer, False
+        if console.serial_port is None:
+            raise OSError('no serial console')
+        reader, writer = await asyncio.open_connection('127.0.0.1', console.serial_port)
+        return reader, writer, True
+
+    async def capture(self, console):
+        delay = 1.0
+        while True:
+            try:
+                reader, writer, telnet = await self.connect(console)
+            except OSError:
+                await asyncio.sleep(delay)   # VM not running (yet)
+                delay = min(delay * 2, 10.0)
+                continue
+            delay = 1.0
+            console.connected = True
+            buffer = b''
+            try:
+                while True:
+                    try:
+                        data = await asyncio.wait_for(
+                            reader.read(65536), PARTIAL_LINE_WAIT if buffer else None)
+                    except asyncio.TimeoutError:
+                        # Output stopped mid-line, e.g. at a login prompt
+                        self.emit(console, time.time(),
+                                  buffer.rstrip(b'\r').decode(errors='replace'))
+                        buffer = b''
+                        continue
+                    if not data:
+                        break
+                    if telnet:
+                        data = TELNET_COMMAND.sub(b'', data)
+                    console.bytes += len(data)
+                    buffer += data
+                    *lines, buffer = buffer.split(b'\n')
+                    if len(buffer) > MAX_LINE:
+                        lines.append(buffer)
+                        buffer = b''
+                    now = time.time()
+                    for line in lines:
+                        self.emit(console, now, line.rstrip(b'\r').decode(errors='replace'))
+            except OSError:
+                pass
+            finally:
+                console.connected = False
+                writer.close()
+
+    def emit(self, console, at, text):
+        console.log.write(at, text)
+        entry = {'vm': console.name, 'time': format_time(at), 'line': text}
+        console.backlog.append(entry)
+        console.lines += 1
+        console.last_at = at
+        for names, queue in list(self.subscribers):
+            if names is not None and console.name not in names:
+                continue
+            try:
+                queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Too slow to keep up; end its tail rather than buffer without bound
+                self.subscribers.remove((names, queue))
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def rescan(self):
+        while True:
+            try:
+                vms = await asyncio.to_thread(lambda: Inventory(self.inventory_path).all())
+            except Exception as e:
+                print(f"Inventory read failed: {e}", file=sys.stderr)
+                vms = None
+            if vms is not None:
+                current = {vm['name']: vm for vm in vms}
+                for name in set(self.consoles) - set(current):
+                    console = self.consoles.pop(name)
+                    console.task.cancel()
+                    console.log.close()
+                for name in set(current) - set(self.consoles):
+                    console = Console(current[name], ConsoleLog(
+                        self.log_dir, name, self.max_bytes, self.backups))
+                    console.task = asyncio.create_task(self.capture(console))
+                    self.consoles[name] = console
+            await asyncio.sleep(self.rescan_interval)
+
+    async def flush(self):
+        while True:
+            await asyncio.sleep(1.0)
+            for console in self.consoles.values():
+                console.log.flush()
+
+    def status(self):
+        return [{
+            'name': c.name,
+            'connected': c.connected,
+            'lines': c.lines,
+            'bytes': c.bytes,
+            'last_line': format_time(c.last_at) if c.last_at else None,
+        } for c in self.consoles.values()]
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await self.reply(writer, {'ok': False, 'error': 'invalid JSON'})
+                    continue
+                method = request.get('method')
+                params = request.get('params') or {}
+                if method == 'tail':
+                    await self.stream_tail(writer, params.get('names'), params.get('lines', 20))
+                    break
+                try:
+                    if method == 'list':
+                        result = self.status()
+                    elif method == 'search':
+                        for console in self.consoles.values():
+                            console.log.flush()
+                        result = await asyncio.to_thread(search_logs, self.log_dir, **params)
+                    else:
+                        raise ValueError(f"Unknown method: {method}")
+                    response = {'ok': True, 'result': result}
+                except Exception as e:
+                    response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                response['id'] = request.get('id')
+                await self.reply(writer, response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def reply(self, writer, message):
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+
+    async def stream_tail(self, writer, names, lines):
+        """Send each VM's last lines, then every new line until the client leaves"""
+        names = set(names) if names else None
+        backlog = [entry for console in self.consoles.values()
+                   if names is None or console.name in names
+                   for entry in list(console.backlog)[-lines:]] if lines else []
+        for entry in sorted(backlog, key=lambda e: e['time']):
+            writer.write(json.dumps(entry).encode() + b'\n')
+        queue = asyncio.Queue(TAIL_QUEUE)
+        subscriber = (names, queue)
+        self.subscribers.append(subscriber)
+        try:
+            await writer.drain()
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    break
+                writer.write(json.dumps(entry).encode() + b'\n')
+                if queue.empty():
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            if ConsoleClient(self.socket_path).available():
+                raise RuntimeError(f"An aggregator is already listening on {self.socket_path}")
+            os.unlink(self.socket_path)
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel)
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        print(f"Console aggregator listening on {self.socket_path}, logging to {self.log_dir}")
+        try:
+            async with server:
+                await asyncio.gather(self.rescan(), self.flush(), server.serve_forever())
+        finally:
+            for console in self.consoles.values():
+                console.log.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def run(self):
+        # Two descriptors per console (socket and log); the default soft
+        # limit of 1024 would cap the fleet at a few hundred VMs
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("Console aggregator stopped")
+
+
+class ConsoleClient:
+    """Blocking client for the aggregator socket"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _open(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def available(self):
+        try:
+            self._open().close()
+            return True
+        except OSError:
+            return False
+
+    def call(self, method, **params):
+        with self._open() as sock, sock.makefile('rwb') as f:
+            f.write(json.dumps({'id': 1, 'method': method, 'params': params}).encode() + b'\n')
+            f.flush()
+            response = json.loads(f.readline() or b'{}')
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error', 'call failed'))
+        return response['result']
+
+    def tail(self, names=None, lines=20):
+        """Yield {'vm', 'time', 'line'} entries as they are captured"""
+        with self._open() as sock, sock.makefile('rwb') as f:
+            request = {'method': 'tail', 'params': {'names': names, 'lines': lines}}
+            f.write(json.dumps(request).encode() + b'\n')
+            f.flush()
+            for line in f:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial console aggregator')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Aggregator socket path')
+    parser.add_argument('--log-dir', default=LOG_DIR, help='Console log directory')
+    subparsers = parser.add_subparsers(dest='command', help='Commands')
+
+    serve_parser = subparsers.add_parser('serve', help='Capture all consoles')
+    serve_parser.add_argument('--inventory', default='config/inventory.db', help='VM inventory')
+    serve_parser.add_argument('--max-mb', type=float, default=MAX_BYTES / 1024**2,
+                              help='Size at which a console log is rotated')
+    serve_parser.add_argument('--backups', type=int, default=BACKUPS,
+                              help='Rotated logs kept per VM')
+
+    subparsers.add_parser('list', help='Console connection status')
+
+    tail_parser = subparsers.add_parser('tail', help='Follow console output')
+    tail_parser.add_argument('names', nargs='*', help='VMs (default: all)')
+    tail_parser.add_argument('-n', '--lines', type=int, default=20,
+                             help='Recent lines to show first, per VM')
+
+    search_parser = subparsers.add_parser('search', help='Search console logs')
+    search_parser.add_argument('pattern', help='Regular expression')
+    search_parser.add_argument('--vm', action='append', dest='names', help='Limit to a VM')
+    search_parser.add_argument('--since', help='Epoch seconds or ISO time')
+    search_parser.add_argument('--until', help='Epoch seconds or ISO time')
+    search_parser.add_argument('--limit', type=int, default=1000)
+    search_parser.add_argument('-i', '--ignore-case', action='store_true')
+
+    args = parser.parse_args()
+    client = ConsoleClient(args.socket)
+
+    if args.command == 'serve':
+        ConsoleAggregator(args.inventory, log_dir=args.log_dir, socket_path=args.socket,
+                          max_bytes=int(args.max_mb * 1024**2), backups=args.backups).run()
+    elif args.command == 'list':
+        try:
+            consoles = client.call('list')
+        except OSError:
+            print(f"No aggregator running on {args.socket}")
+            sys.exit(1)
+        print(f"{'NAME':<15} {'CONNECTED':<10} {'LINES':>9} {'BYTES':>12}  LAST LINE")
+        print("-" * 75)
+        for c in sorted(consoles, key=lambda c: c['name']):
+            print(f"{c['name']:<15} {'yes' if c['connected'] else 'no':<10} "
+                  f"{c['lines']:>9} {c['bytes']:>12}  {c['last_line'] or '-'}")
+    elif args.command == 'tail':
+        try:
+            for entry in client.tail(args.names or None, args.lines):
+                print(f"{entry['time']} {entry['vm']}: {entry['line']}", flush=True)
+        except OSError:
+            print(f"No aggregator running on {args.socket}")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'search':
+        # Logs are plain files, so searching works without the aggregator
+        results = search_logs(args.log_dir, args.pattern, args.names,
+                              parse_time(args.since) if args.since else None,
+                              parse_time(args.until) if args.until else None,
+                              args.limit, args.ignore_case)
+        for entry in results:
+            print(f"{entry['time']} {entry['vm']}: {entry['line']}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Memory Density
+Host memory and KSM accounting and the balloon sizing used to run more
+VMs than the host has RAM for
+"""
+
+import os
+from pathlib import Path
+
+KSM_DIR = Path('/sys/kernel/mm/ksm')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+MB = 1024 * 1024
+
+
+def meminfo(path='/proc/meminfo'):
+    """/proc/meminfo in MB"""
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            fields = rest.split()
+            if fields:
+                values[key] = int(fields[0]) // 1024 if fields[-1] == 'kB' else int(fields[0])
+    return values
+
+
+def process_rss_mb(pid):
+    """Resident memory of a process in MB, 0 if it is gone"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+
+def ksm_stats():
+    """KSM state and the memory it currently saves, None without KSM"""
+    if not KSM_DIR.exists():
+        return None
+    values = {}
+    for name in ('run', 'pages_shared', 'pages_sharing', 'pages_unshared',
+                 'pages_to_scan', 'sleep_millisecs', 'full_scans'):
+        try:
+            values[name] = int((KSM_DIR / name).read_text())
+        except (OSError, ValueError):
+            values[name] = 0
+    values['saved_mb'] = values['pages_sharing'] * PAGE_SIZE // MB
+    return values
+
+
+def enable_ksm(pages_to_scan=1000, sleep_ms=50):
+    """Start KSM merging (needs root). Returns False if not permitted."""
+    try:
+        (KSM_DIR / 'pages_to_scan').write_text(str(pages_to_scan))
+        (KSM_DIR / 'sleep_millisecs').write_text(str(sleep_ms))
+        (KSM_DIR / 'run').write_text('1')
+    except OSError:
+        return False
+    return True
+
+
+def guest_memory(stats):
+    """
+    Guest memory use in MB from the balloon's guest-stats, or None before
+    the guest driver has reported. Page cache counts as available.
+    """
+    values = stats.get('stats', {})
+    total = values.get('stat-total-memory', -1)
+    available = values.get('stat-available-memory', -1)
+    if not stats.get('last-update') or total < 0 or available < 0:
+        return None
+    return {'total_mb': total // MB, 'available_mb': available // MB,
+            'used_mb': (total - available) // MB}
+
+
+def balloon_target(memory_mb, actual_mb, used_mb, settings, host_pressure):
+    """
+    New balloon size in MB for a guest using used_mb out of actual_mb, or
+    None to leave it alone.
+
+    The guest keeps headroom_mb free on top of what it uses (half that
+    when the host is short of memory), never drops below min_guest_mb and
+    never exceeds its configured memory. It shrinks at most step_mb per
+    pass so reclaim is gradual, but grows straight to the target.
+    """
+    headroom = settings.get('headroom_mb', 256)
+    if host_pressure:
+        headroom //= 2
+    target = min(memory_mb, max(settings.get('min_guest_mb', 512), used_mb + headroom))
+    if target < actual_mb:
+        target = max(target, actual_mb - settings.get('step_mb', 512))
+    if abs(target - actual_mb) < settings.get('hysteresis_mb', 64):
+        return None
+    return target
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Image Cache
+Golden disk images (and optionally saved RAM state) captured from installed
+VMs, keyed by install profile, so new VMs can skip the PXE install
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+# What an install depends on: a change to the netboot files (kernel, initrd,
+# boot menu) makes existing captures stale. start.sh links these into
+# pxe-data/tftp on every start, so the originals are fingerprinted.
+DEFAULT_PROFILE_SOURCES = ['images/ubuntu']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    profile TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    disk TEXT NOT NULL,
+    state TEXT,
+    memory INTEGER NOT NULL,
+    cpus INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    source_vm TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS retired (
+    path TEXT PRIMARY KEY
+);
+"""
+
+
+def profile_digest(sources):
+    """Content fingerprint of the files an install profile is built from"""
+    digest = hashlib.sha256()
+    for source in sources:
+        source = Path(source)
+        if not source.exists():
+            continue
+        paths = [source] if source.is_file() else sorted(p for p in source.rglob('*') if p.is_file())
+        for path in paths:
+            digest.update(f"{path.relative_to(source.parent)}\0".encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class ImageCache:
+    """
+    Captured images under root, at most max_bytes in total.
+
+    Each profile has one current entry. Recapturing or invalidating a
+    profile retires the old files; retired files and least recently used
+    entries are deleted by evict(), except for disks that VM overlays still
+    use as their backing file.
+    """
+
+    def __init__(self, root='images/cache', max_bytes=50 * 1024**3, sources=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.sources = sources or DEFAULT_PROFILE_SOURCES
+        self.db = sqlite3.connect(str(self.root / 'index.db'), timeout=30.0,
+                                  isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def paths(self, profile, digest):
+        """Disk and RAM state file names for a new capture"""
+        stem = self.root / f"{profile}-{digest}-{int(time.time())}"
+        return Path(f"{stem}.qcow2"), Path(f"{stem}.state")
+
+    def _row(self, row):
+        if row is None:
+            return None
+        keys = ('profile', 'digest', 'disk', 'state', 'memory', 'cpus', 'size',
+                'source_vm', 'created', 'last_used')
+        return dict(zip(keys, row))
+
+    def get(self, profile):
+        """Current entry for a profile, whether or not it is stale"""
+        return self._row(self.db.execute(
+            'SELECT * FROM images WHERE profile = ?', (profile,)).fetchone())
+
+    def lookup(self, profile):
+        """
+        Usable entry for a profile, or None if there is none or the profile's
+        sources changed since it was captured. Marks the entry as used.
+        """
+        entry = self.get(profile)
+        if entry is None:
+            return None
+        if entry['digest'] != profile_digest(self.sources):
+            print(f"Cached image for '{profile}' is stale (install sources changed)")
+            self.invalidate(profile)
+            return None
+        if not Path(entry['disk']).exists():
+            self.invalidate(profile)
+            return None
+        self.db.execute('UPDATE images SET last_used = ? WHERE profile = ?',
+                        (time.time(), profile))
+        return entry
+
+    def add(self, profile, digest, disk, state, memory, cpus, source_vm):
+        """Record a finished capture, retiring the profile's previous one"""
+        size = sum(Path(p).stat().st_size for p in (disk, state) if p)
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self._retire(profile)
+            self.db.execute(
+                'INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (profile, digest, str(disk), str(state) if state else None,
+                 memory, cpus, size, source_vm, now, now))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return self.get(profile)
+
+    def _retire(self, profile):
+        entry = self.get(profile)
+        if entry is None:
+            return
+        self.db.executemany('INSERT OR IGNORE INTO retired (path) VALUES (?)',
+                            [(p,) for p in (entry['disk'], entry['state']) if p])
+        self.db.execute('DELETE FROM images WHERE profile = ?', (profile,))
+
+    def invalidate(self, profile=None):
+        """Stop handing out one profile's image (or all); files go at the next evict()"""
+        profiles = [profile] if profile else [e['profile'] for e in self.entries()]
+        for p in profiles:
+            self._retire(p)
+        return len(profiles)
+
+    def entries(self):
+        """All current entries, most recently used first"""
+        return [self._row(row) for row in
+                self.db.execute('SELECT * FROM images ORDER BY last_used DESC')]
+
+    def total_bytes(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM images').fetchone()[0]
+
+    def evict(self, in_use=(), max_bytes=None):
+        """
+        Delete retired files, then least recently used entries until the
+        cache fits in max_bytes. Disks in in_use (backing files of existing
+        VMs) are kept. Returns the deleted paths.
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        in_use = {str(Path(p).resolve()) for p in in_use}
+        deleted = []
+
+        for (path,) in self.db.execute('SELECT path FROM retired').fetchall():
+            if str(Path(path).resolve()) in in_use:
+                continue
+            Path(path).unlink(missing_ok=True)
+            self.db.execute('DELETE FROM retired WHERE path = ?', (path,))
+            deleted.append(path)
+
+        total = self.total_bytes()
+        for entry in reversed(self.entries()):
+            if total <= limit:
+                break
+            if str(Path(entry['disk']).resolve()) in in_use:
+                continue
+            for path in (entry['disk'], entry['state']):
+                if path:
+                    Path(path).unlink(missing_ok=True)
+                    deleted.append(path)
+            self.db.execute('DELETE FROM images WHERE profile = ?', (entry['profile'],))
+            total -= entry['size']
+        return deleted
+
+    def remove_partial(self, *paths):
+        """Clean up after a failed capture"""
+        for path in paths:
+            if path and os.path.exists(path):
+                os.unlink(path)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+VM Inventory
+Transactional VM inventory for VMManager, stored in SQLite
+"""
+
+import json
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+# First port handed out when nothing has been allocated yet
+PORT_BASES = {
+    'vnc_port': 1,
+    'serial_port': 5001,
+}
+
+# Every allocated kind: ports, plus the index into the address plan that
+# fixes a VM's MAC and IP (see addressing.AddressPlan)
+BASES = dict(PORT_BASES, address=0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vms (
+    name TEXT PRIMARY KEY,
+    mac TEXT UNIQUE,
+    vnc_port INTEGER UNIQUE,
+    serial_port INTEGER UNIQUE,
+    config TEXT NOT NULL,
+    ip TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS free_ports (
+    kind TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    PRIMARY KEY (kind, port)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    kind TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+
+class Inventory:
+    """
+    VM definitions keyed by name.
+
+    Every change is a single-row write inside a SQLite transaction, so
+    concurrent vm_manager.py invocations serialize on the database lock
+    instead of overwriting each other's copy of vms.yaml. Names and MACs
+    are indexed; released ports go on a free list and are reused before
+    new ones are handed out.
+
+    With an address plan, VMs without an IP also get an address index and
+    the MAC (unless they bring their own) and IP it maps to. Indexes whose
+    MAC or IP another VM already holds are skipped, so the unique MAC and
+    IP indexes are the only conflict check needed.
+    """
+
+    def __init__(self, path='config/inventory.db', addresses=None):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # Callers serialize access themselves (the daemon handles one request
+        # at a time), so the connection may be used from any thread.
+        self.db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        if 'ip' not in [row[1] for row in self.db.execute('PRAGMA table_info(vms)')]:
+            # Inventories from before static DHCP reservations
+            self.db.execute('ALTER TABLE vms ADD COLUMN ip TEXT')
+            self.db.execute('CREATE UNIQUE INDEX vms_ip ON vms (ip)')
+        self.addresses = addresses
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """Hold the write lock for a group of changes"""
+        if self._depth:
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+            return
+        self.db.execute('BEGIN IMMEDIATE')
+        self._depth = 1
+        try:
+            yield self
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        finally:
+            self._depth = 0
+
+    def _decode(self, row):
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, name):
+        return self.db.execute('SELECT 1 FROM vms WHERE name = ?', (name,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM vms').fetchone()[0]
+
+    def get(self, name):
+        """VM config by name, or None"""
+        return self._decode(self.db.execute(
+            'SELECT config FROM vms WHERE name = ?', (name,)).fetchone())
+
+    def find_by_mac(self, mac):
+        """VM config owning a MAC address, or None"""
+        return self._decode(self.db.execute(
+            'SELECT config FROM vms WHERE mac = ?', (mac.lower(),)).fetchone())
+
+    def find_by_ip(self, ip):
+        """VM config holding an IP address, or None"""
+        return self._decode(self.db.execute(
+            'SELECT config FROM vms WHERE ip = ?', (ip,)).fetchone())
+
+    def version(self):
+        """Changes whenever the inventory does, through any connection"""
+        return self.db.execute('PRAGMA data_version').fetchone()[0], self.db.total_changes
+
+    def names(self):
+        return [row[0] for row in self.db.execute('SELECT name FROM vms ORDER BY rowid')]
+
+    def all(self):
+        """All VM configs in creation order"""
+        return [json.loads(row[0]) for row in
+                self.db.execute('SELECT config FROM vms ORDER BY rowid')]
+
+    def _allocate(self, kind, count):
+        rows = self.db.execute(
+            'SELECT port FROM free_ports WHERE kind = ? ORDER BY port LIMIT ?',
+            (kind, count)
+        ).fetchall()
+        ports = [row[0] for row in rows]
+        if ports:
+            self.db.executemany('DELETE FROM free_ports WHERE kind = ? AND port = ?',
+                                [(kind, p) for p in ports])
+        missing = count - len(ports)
+        if missing:
+            row = self.db.execute('SELECT next FROM counters WHERE kind = ?', (kind,)).fetchone()
+            first = row[0] if row else BASES[kind]
+            ports.extend(range(first, first + missing))
+            self.db.execute(
+                'INSERT INTO counters (kind, next) VALUES (?, ?) '
+                'ON CONFLICT(kind) DO UPDATE SET next = excluded.next',
+                (kind, first + missing)
+            )
+        return ports
+
+    def _release(self, kind, port):
+        if port is not None:
+            self.db.execute('INSERT OR IGNORE INTO free_ports (kind, port) VALUES (?, ?)',
+                            (kind, port))
+
+    def _assign_addresses(self, vm_configs):
+        """Give VMs an address index and its IP, and its MAC if they have none"""
+        taken = {c['mac'] for c in vm_configs if c.get('mac')}
+        pending = list(vm_configs)
+        while pending:
+            retry = []
+            for vm_config, index in zip(pending, self._allocate('address', len(pending))):
+                mac, ip = self.addresses.address(index)
+                own_mac = vm_config.get('mac')
+                if ((own_mac is None and (mac in taken or self.find_by_mac(mac)))
+                        or self.find_by_ip(ip)):
+                    # Held by a VM from before the allocator; never hand it out
+                    retry.append(vm_config)
+                    continue
+                vm_config.update(address=index, ip=ip, mac=own_mac or mac)
+                taken.add(vm_config['mac'])
+            pending = retry
+
+    def _write(self, vm_config, insert):
+        values = (vm_config.get('mac'), vm_config.get('vnc_port'),
+                  vm_config.get('serial_port'), vm_config.get('ip'),
+                  json.dumps(vm_config), vm_config['name'])
+        if insert:
+            self.db.execute(
+                'INSERT INTO vms (mac, vnc_port, serial_port, ip, config, name) '
+                'VALUES (?, ?, ?, ?, ?, ?)', values)
+        else:
+            self.db.execute(
+                'UPDATE vms SET mac = ?, vnc_port = ?, serial_port = ?, ip = ?, config = ? '
+                'WHERE name = ?', values)
+
+    def add_many(self, vm_configs):
+        """
+        Insert VMs in one transaction, filling in vnc_port/serial_port (and
+        addresses, with an address plan) for configs that do not set them.
+        Returns the stored configs. Raises ValueError, adding nothing, if
+        the address pool runs out or a name is already taken.
+        """
+        with self.transaction():
+            for kind in PORT_BASES:
+                pending = [c for c in vm_configs if c.get(kind) is None]
+                for vm_config, port in zip(pending, self._allocate(kind, len(pending))):
+                    vm_config[kind] = port
+            if self.addresses is not None:
+                self._assign_addresses([c for c in vm_configs if c.get('ip') is None])
+            for vm_config in vm_configs:
+                try:
+                    self._write(vm_config, insert=True)
+                except sqlite3.IntegrityError:
+                    if vm_config['name'] in self:
+                        raise ValueError(f"VM '{vm_config['name']}' already exists")
+                    raise
+        return vm_configs
+
+    def add(self, vm_config):
+        return self.add_many([vm_config])[0]
+
+    def update(self, name, **fields):
+        """Change fields of one VM. Returns the new config, or None if missing."""
+        with self.transaction():
+            vm_config = self.get(name)
+            if vm_config is None:
+                return None
+            vm_config.update(fields)
+            self._write(vm_config, insert=False)
+        return vm_config
+
+    def addresses_left(self):
+        """Unallocated indexes in the address plan (None without one)"""
+        if self.addresses is None:
+            return None
+        row = self.db.execute("SELECT next FROM counters WHERE kind = 'address'").fetchone()
+        free = self.db.execute(
+            "SELECT COUNT(*) FROM free_ports WHERE kind = 'address'").fetchone()[0]
+        return self.addresses.capacity - (row[0] if row else BASES['address']) + free
+
+    def assign_addresses(self):
+        """Give addresses to VMs added before the address plan. Returns their names."""
+        if self.addresses is None:
+            return []
+        with self.transaction():
+            vm_configs = [c for c in self.all() if c.get('ip') is None]
+            self._assign_addresses(vm_configs)
+            for vm_config in vm_configs:
+                self._write(vm_config, insert=False)
+        return [c['name'] for c in vm_configs]
+
+    def remove_many(self, names):
+        """Delete VMs and return their ports and addresses to the free list"""
+        with self.transaction():
+            for name in names:
+                vm_config = self.get(name)
+                if vm_config is None:
+                    continue
+                for kind in BASES:
+                    self._release(kind, vm_config.get(kind))
+                self.db.execute('DELETE FROM vms WHERE name = ?', (name,))
+
+    def remove(self, name):
+        self.remove_many([name])
+
+    def import_vms(self, vms):
+        """Load a vms.yaml 'vms' mapping, keeping the ports it assigned"""
+        with self.transaction():
+            configs = [dict(vm, name=vm.get('name', name)) for name, vm in vms.items()
+                       if vm.get('name', name) not in self]
+            for kind, base in BASES.items():
+                used = [c[kind] for c in configs if c.get(kind) is not None]
+                row = self.db.execute('SELECT next FROM counters WHERE kind = ?', (kind,)).fetchone()
+                next_port = max([row[0] if row else base] + [p + 1 for p in used])
+                self.db.execute(
+                    'INSERT INTO counters (kind, next) VALUES (?, ?) '
+                    'ON CONFLICT(kind) DO UPDATE SET next = excluded.next',
+                    (kind, next_port)
+                )
+                self.db.executemany('DELETE FROM free_ports WHERE kind = ? AND port = ?',
+                                    [(kind, p) for p in used])
+            self.add_many(configs)
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('yaml_imported', '1')")
+        return len(configs)
+
+    def export_vms(self):
+        """Inventory as a vms.yaml-style 'vms' mapping"""
+        return {vm['name']: vm for vm in self.all()}
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+VM Placement
+Host CPU/NUMA topology from sysfs and a planner that gives each VM pinned
+host CPUs and memory on one NUMA node, optionally hugepage-backed, without
+overcommitting the host
+"""
+
+import os
+from pathlib import Path
+
+HUGEPAGE_KB = 2048
+
+
+class PlacementError(Exception):
+    """A VM does not fit on the host right now"""
+
+
+def parse_cpulist(text):
+    """Expand a sysfs CPU list such as '0-3,8-11' into [0, 1, 2, 3, 8, ...]"""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """Inverse of parse_cpulist, for QEMU and taskset style lists"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def _read(path, default=None):
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return default
+
+
+class HostTopology:
+    """
+    NUMA nodes of the host: their CPUs grouped into physical cores (SMT
+    siblings together), memory and 2 MB hugepages.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes  # node id -> {'cores': [[cpu, ...]], 'memory_mb', 'hugepages'}
+
+    @classmethod
+    def from_sysfs(cls, root='/sys', proc='/proc'):
+        root = Path(root)
+        online = set(parse_cpulist(_read(root / 'devices/system/cpu/online', '0')))
+        node_dirs = sorted(root.glob('devices/system/node/node[0-9]*'),
+                           key=lambda p: int(p.name[4:]))
+        nodes = {}
+        for node_dir in node_dirs:
+            cpus = [c for c in parse_cpulist(_read(node_dir / 'cpulist', '')) if c in online]
+            if not cpus:
+                continue    # memory-only node
+            memory_kb = 0
+            for line in (_read(node_dir / 'meminfo', '') or '').splitlines():
+                if 'MemTotal:' in line:
+                    memory_kb = int(line.split()[-2])
+            hugepages = int(_read(
+                node_dir / f'hugepages/hugepages-{HUGEPAGE_KB}kB/nr_hugepages', '0') or 0)
+            nodes[int(node_dir.name[4:])] = {
+                'cores': cls._cores(root, cpus),
+                'memory_mb': memory_kb // 1024,
+                'hugepages': hugepages,
+            }
+        if not nodes:
+            # No NUMA information (containers, WSL): one node with everything
+            meminfo = dict(line.split(':', 1) for line in
+                           (_read(Path(proc) / 'meminfo', '') or '').splitlines() if ':' in line)
+            memory_kb = int(meminfo.get('MemTotal', '0 kB').split()[0])
+            cpus = sorted(online) or list(range(os.cpu_count() or 1))
+            nodes[0] = {
+                'cores': cls._cores(root, cpus),
+                'memory_mb': memory_kb // 1024,
+                'hugepages': int(meminfo.get('HugePages_Total', '0').split()[0]),
+            }
+        return cls(nodes)
+
+    @staticmethod
+    def _cores(root, cpus):
+        """Group CPUs into physical cores by their thread siblings"""
+        cores, seen = [], set()
+        for cpu in cpus:
+            if cpu in seen:
+                continue
+            siblings = _read(root / f'devices/system/cpu/cpu{cpu}/topology/thread_siblings_list')
+            core = [c for c in (parse_cpulist(siblings) if siblings else [cpu]) if c in cpus]
+            core = core if cpu in core else [cpu]
+            seen.update(core)
+            cores.append(core)
+        return cores
+
+    def cpus(self, node):
+        return [cpu for core in self.nodes[node]['cores'] for cpu in core]
+
+    def describe(self):
+        return {node: {
+            'cpus': format_cpulist(self.cpus(node)),
+            'cores': len(info['cores']),
+            'memory_mb': info['memory_mb'],
+            'hugepages': info['hugepages'],
+        } for node, info in self.nodes.items()}
+
+
+class PlacementPlanner:
+    """
+    Places each VM on a single NUMA node: one host CPU per vCPU and all of
+    its memory bound to that node.
+
+    vCPUs take whole physical cores where they can, so SMT siblings are
+    shared within a VM rather than with a neighbour. Each host CPU takes at
+    most cpu_overcommit vCPUs in total (1.0 means dedicated CPUs), and a
+    node's memory is never promised beyond memory_overcommit times its size
+    minus its share of memory_reserve_mb. Hugepage-backed VMs draw only on the node's reserved
+    hugepages, which are unavailable to everything else. Reserved CPUs are
+    left to the host.
+    """
+
+    def __init__(self, topology, reserved_cpus=(), cpu_overcommit=1.0, memory_reserve_mb=2048,
+                 memory_overcommit=1.0):
+        self.topology = topology
+        self.reserved = set(reserved_cpus)
+        self.cpu_overcommit = cpu_overcommit
+        self.memory_reserve_mb = memory_reserve_mb
+        self.memory_overcommit = memory_overcommit
+
+    def usage(self, placements):
+        """vCPUs per host CPU, and ordinary memory and hugepages in use per node"""
+        cpu_load = {}
+        memory = {node: 0 for node in self.topology.nodes}
+        hugepages = {node: 0 for node in self.topology.nodes}
+        for placement in placements:
+            for cpu in placement['cpus']:
+                cpu_load[cpu] = cpu_load.get(cpu, 0) + 1
+            node = placement['node']
+            if node in memory:
+                if placement.get('hugepages'):
+                    hugepages[node] += -(-placement['memory_mb'] * 1024 // HUGEPAGE_KB)
+                else:
+                    memory[node] += placement['memory_mb']
+        return cpu_load, memory, hugepages
+
+    def plan(self, vcpus, memory_mb, hugepages=False, placements=()):
+        """
+        Placement for a new VM given the placements of running VMs:
+        {'node', 'cpus' (host CPU per vCPU), 'memory_mb', 'hugepages'}.
+        Raises PlacementError when no node can take it.
+        """
+        cpu_load, memory, pages = self.usage(placements)
+        capacity = max(1, int(self.cpu_overcommit))
+        reserve = self.memory_reserve_mb / len(self.topology.nodes)
+        needed_pages = -(-memory_mb * 1024 // HUGEPAGE_KB)
+        reasons = []
+        candidates = []
+        for node, info in self.topology.nodes.items():
+            free_memory = ((info['memory_mb'] - info['hugepages'] * HUGEPAGE_KB // 1024
+                            - reserve) * self.memory_overcommit - memory[node])
+            free_pages = info['hugepages'] - pages[node]
+            if hugepages and free_pages < needed_pages:
+                reasons.append(f"node {node}: {free_pages} hugepages free")
+                continue
+            if not hugepages and free_memory < memory_mb:
+                reasons.append(f"node {node}: {int(free_memory)} MB free")
+                continue
+            cpus = self._pick_cpus(info['cores'], cpu_load, capacity, vcpus)
+            if cpus is None:
+                reasons.append(f"node {node}: not enough free CPUs")
+                continue
+            # Least-loaded node first, then the one with most memory left
+            load = sum(cpu_load.get(c, 0) for c in self.topology.cpus(node))
+            candidates.append((load, -(free_pages if hugepages else free_memory), node, cpus))
+        if not candidates:
+            raise PlacementError(f"No NUMA node fits {vcpus} vCPUs / {memory_mb} MB"
+                                 f"{' in hugepages' if hugepages else ''} ({'; '.join(reasons)})")
+        _, _, node, cpus = min(candidates)
+        return {'node': node, 'cpus': cpus, 'memory_mb': memory_mb, 'hugepages': bool(hugepages)}
+
+    def _pick_cpus(self, cores, cpu_load, capacity, vcpus):
+        """Host CPUs for vcpus vCPUs: emptiest whole cores first"""
+        usable = [[c for c in core if c not in self.reserved and cpu_load.get(c, 0) < capacity]
+                  for core in cores]
+        # Cores nobody uses yet, fully free ones first, then the least loaded
+        usable.sort(key=lambda core: (sum(cpu_load.get(c, 0) for c in core), -len(core)))
+        picked = []
+        for level in range(capacity):
+            for core in usable:
+                for cpu in core:
+                    if cpu_load.get(cpu, 0) == level and cpu not in picked:
+                        picked.append(cpu)
+                        if len(picked) == vcpus:
+                            return picked
+        return None
+
+
+def qemu_memory_args(placement):
+    """
+    Memory backend bound to the placement's node. The backend is named
+    pc.ram so it stays migration-compatible with a plain -m VM (RAM state
+    captured for the image cache restores either way).
+    """
+    size = f"{placement['memory_mb']}M"
+    node = placement['node']
+    if placement.get('hugepages'):
+        backend = (f"memory-backend-memfd,id=pc.ram,size={size},hugetlb=on,"
+                   f"hugetlbsize={HUGEPAGE_KB}K,prealloc=on")
+    else:
+        backend = f"memory-backend-ram,id=pc.ram,size={size}"
+    return ['-object', f"{backend},host-nodes={node},policy=bind",
+            '-machine', 'memory-backend=pc.ram']
+
+
+def pin_threads(vcpu_threads, placement):
+    """Pin each vCPU thread (from query-cpus-fast) to its host CPU"""
+    for cpu_index, thread_id in vcpu_threads:
+        os.sched_setaffinity(thread_id, {placement['cpus'][cpu_index]})
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Process Status
+Liveness, CPU time and resident memory of VM processes from pidfiles and
+/proc, checked against each process's command line
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+DEFAULT_TTL = 1.0  # seconds
+
+
+def read_process(pid):
+    """
+    Command line, CPU seconds, start time (seconds after boot) and RSS of a
+    process from /proc/<pid>/{cmdline,stat,statm}; None if it is gone or a
+    zombie.
+    """
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            cmdline = f.read().split(b'\0')
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            statm = f.read().split()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces and parentheses; fields after it are fixed
+    fields = stat[stat.rindex(b')') + 2:].split()
+    if fields[0] == b'Z':
+        return None
+    return {
+        'cmdline': [arg.decode(errors='replace') for arg in cmdline if arg],
+        'cpu_seconds': (int(fields[11]) + int(fields[12])) / CLK_TCK,
+        'started': int(fields[19]) / CLK_TCK,
+        'rss_mb': int(statm[1]) * PAGE_SIZE // (1024 * 1024),
+    }
+
+
+def is_vm_process(process, name):
+    """Whether a process is the QEMU started for VM name (its -name argument)"""
+    args = process['cmdline']
+    return any(flag == '-name' and value.split(',')[0] == name
+               for flag, value in zip(args, args[1:]))
+
+
+def system_uptime():
+    with open('/proc/uptime') as f:
+        return float(f.read().split()[0])
+
+
+class ProcessScan:
+    """
+    Live VM processes by VM name, from one pass over the pidfiles in vm_dir
+    and /proc for the PIDs they name. A pidfile whose PID is gone or now
+    belongs to another program is stale and its VM counts as stopped.
+
+    Results are kept for ttl seconds so frequent pollers share a scan;
+    invalidate() after starting or stopping VMs. cpu_percent is over the
+    time since the previous scan, or the process lifetime on the first.
+    """
+
+    def __init__(self, vm_dir, ttl=DEFAULT_TTL):
+        self.vm_dir = Path(vm_dir)
+        self.ttl = ttl
+        self.stale = set()
+        self._lock = threading.Lock()
+        self._processes = {}
+        self._scanned = None
+        self._samples = {}  # pid -> (cpu_seconds, monotonic time)
+
+    def invalidate(self):
+        with self._lock:
+            self._scanned = None
+
+    def scan(self, max_age=None):
+        """{name: {'pid', 'cpu_seconds', 'cpu_percent', 'rss_mb', 'uptime_s'}}"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            now = time.monotonic()
+            if self._scanned is not None and now - self._scanned <= max_age:
+                return self._processes
+
+            pidfiles = {}
+            try:
+                with os.scandir(self.vm_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.pid'):
+                            pidfiles[entry.name[:-4]] = entry.path
+            except OSError:
+                pass
+
+            uptime = system_uptime()
+            processes, stale, samples = {}, set(), {}
+            for name, path in pidfiles.items():
+                try:
+                    with open(path) as f:
+                        pid = int(f.read().strip())
+                except (OSError, ValueError):
+                    continue
+                process = read_process(pid)
+                if process is None or not is_vm_process(process, name):
+                    stale.add(name)
+                    continue
+                cpu = process['cpu_seconds']
+                samples[pid] = (cpu, now)
+                lifetime = max(uptime - process['started'], 0.0)
+                previous = self._samples.get(pid)
+                if previous and now > previous[1]:
+                    percent = (cpu - previous[0]) / (now - previous[1]) * 100
+                else:
+                    percent = cpu / lifetime * 100 if lifetime else 0.0
+                processes[name] = {
+                    'pid': pid,
+                    'cpu_seconds': round(cpu, 2),
+                    'cpu_percent': round(percent, 1),
+                    'rss_mb': process['rss_mb'],
+                    'uptime_s': round(lifetime, 1),
+                }
+
+            self._processes, self.stale, self._samples = processes, stale, samples
+            self._scanned = now
+            return processes
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+PXE Assets
+Content-addressed store for netboot files. Archives are fetched in
+parallel byte ranges from a mirror list, verified against the mirror's
+SHA256SUMS, unpacked once, and hardlinked into the TFTP/HTTP trees
+"""
+
+import argparse
+import filecmp
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+import yaml
+
+DEFAULT_STORE = 'images/assets'
+DEFAULT_PROFILE = 'ubuntu-focal'
+CHUNK_SIZE = 8 * 1024 * 1024
+# Smaller files (boot menus, preseeds, configs) are copied out of the store
+# rather than hardlinked, so editing them in place cannot alter a shared object
+LINK_MIN_SIZE = 64 * 1024
+# Local netboot files laid over the first served profile's TFTP tree
+DEFAULT_OVERLAY = 'images/ubuntu'
+
+UBUNTU_MIRRORS = ['archive.ubuntu.com', 'us.archive.ubuntu.com', 'mirrors.kernel.org']
+FOCAL = 'http://{}/ubuntu/dists/focal/main/installer-amd64/current/legacy-images'
+BOOKWORM = 'http://deb.debian.org/debian/dists/bookworm/main/installer-amd64/current/images'
+
+# urls are mirrors of one archive; checksums are SHA256SUMS files listing
+# it as checksum_name. A pinned sha256 skips the checksum lookup.
+ASSET_PROFILES = {
+    'ubuntu-focal': {
+        'description': 'Ubuntu 20.04 debian-installer netboot',
+        'urls': [f"{FOCAL.format(m)}/netboot/netboot.tar.gz" for m in UBUNTU_MIRRORS],
+        'checksums': [f"{FOCAL.format(m)}/SHA256SUMS" for m in UBUNTU_MIRRORS],
+        'checksum_name': './netboot/netboot.tar.gz',
+    },
+    'debian-bookworm': {
+        'description': 'Debian 12 debian-installer netboot',
+        'urls': [f"{BOOKWORM}/netboot/netboot.tar.gz"],
+        'checksums': [f"{BOOKWORM}/SHA256SUMS"],
+        'checksum_name': './netboot/netboot.tar.gz',
+    },
+}
+
+
+class AssetError(Exception):
+    """A download, checksum or unpack step failed"""
+
+
+def load_profiles(config_path='config/vms.yaml'):
+    """Built-in profiles plus pxe_assets.profiles from vms.yaml"""
+    settings = {}
+    try:
+        with open(config_path) as f:
+            settings = (yaml.safe_load(f) or {}).get('pxe_assets') or {}
+    except FileNotFoundError:
+        pass
+    return dict(ASSET_PROFILES, **(settings.get('profiles') or {})), settings
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def replace_file(source, dest):
+    """
+    Copy source to dest through a temporary file and a rename, so an
+    existing dest (possibly a hardlink into the store) is replaced rather
+    than written through
+    """
+    dest = Path(dest)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.")
+    try:
+        with os.fdopen(fd, 'wb') as out, open(source, 'rb') as src:
+            shutil.copyfileobj(src, out)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def overlay_tree(source, target):
+    """
+    Copy files under source (following symlinks, like 'cp -rL') over
+    target wherever they differ, replacing rather than writing through
+    target's files. Returns the number of files copied.
+    """
+    source, target = Path(source), Path(target)
+    copied = 0
+    for root, _, names in os.walk(source, followlinks=True):
+        relative = Path(root).relative_to(source)
+        for name in names:
+            src, dest = Path(root) / name, target / relative / name
+            if not src.is_file():
+                continue    # dangling symlink
+            if dest.is_file() and (os.path.samefile(src, dest) or
+                                   filecmp.cmp(src, dest, shallow=False)):
+                continue
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            replace_file(src, dest)
+            copied += 1
+    return copied
+
+
+def lookup_checksum(urls, name, session):
+    """sha256 of name from the first readable SHA256SUMS, or None"""
+    wanted = name.lstrip('./')
+    for url in urls:
+        try:
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException:
+            continue
+        for line in response.text.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[1].lstrip('*').lstrip('./') == wanted:
+                return fields[0].lower()
+    return None
+
+
+class Downloader:
+    """
+    Fetches one file from a list of mirrors.
+
+    When the server honours Range requests the file is split into
+    chunk_size pieces fetched by workers threads, each piece starting at a
+    different mirror. Finished pieces are recorded next to the partial
+    file, so an interrupted download resumes where it stopped.
+    """
+
+    def __init__(self, workers=4, chunk_size=CHUNK_SIZE, timeout=30):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests sessions are not thread-safe: one (and its pool) per worker
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def probe(self, urls):
+        """(mirrors that answered, size, ranged) using a one-byte range request"""
+        alive, size, ranged = [], None, True
+        for url in urls:
+            try:
+                with self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                                      timeout=self.timeout) as response:
+                    if response.status_code == 206:
+                        length = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+                    elif response.status_code == 200:
+                        length = int(response.headers.get('Content-Length', -1))
+                        ranged = False
+                    else:
+                        continue
+            except (requests.RequestException, KeyError, ValueError):
+                continue
+            if size is None:
+                size = length
+            if length == size:
+                alive.append(url)
+        if not alive:
+            raise AssetError(f"No mirror reachable: {', '.join(urls)}")
+        return alive, size, ranged and size > 0
+
+    def fetch(self, urls, dest):
+        """Download to dest (resuming a previous partial download)"""
+        dest = Path(dest)
+        state_path = dest.with_name(dest.name + '.state')
+        urls, size, ranged = self.probe(urls)
+        if not ranged or size <= self.chunk_size:
+            self._fetch_whole(urls, dest)
+            state_path.unlink(missing_ok=True)
+            return
+
+        chunks = [(start, min(start + self.chunk_size, size) - 1)
+                  for start in range(0, size, self.chunk_size)]
+        done = set()
+        try:
+            state = json.loads(state_path.read_text())
+            if state['size'] == size and state['chunk_size'] == self.chunk_size and dest.exists():
+                done = set(state['done'])
+        except (OSError, ValueError, KeyError):
+            pass
+        if done:
+            print(f"Resuming {dest.name}: {len(done)}/{len(chunks)} chunks already fetched")
+        lock = threading.Lock()
+
+        fd = os.open(dest, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+
+            def fetch_chunk(index):
+                start, end = chunks[index]
+                errors = []
+                for attempt in range(len(urls)):
+                    url = urls[(index + attempt) % len(urls)]
+                    try:
+                        response = self.session.get(url, headers={'Range': f"bytes={start}-{end}"},
+                                                    timeout=self.timeout)
+                        if response.status_code != 206 or len(response.content) != end - start + 1:
+                            raise AssetError(f"{url}: bad range response {response.status_code}")
+                    except (requests.RequestException, AssetError) as e:
+                        errors.append(str(e))
+                        continue
+                    os.pwrite(fd, response.content, start)
+                    with lock:
+                        done.add(index)
+                        state_path.write_text(json.dumps({'size': size, 'chunk_size': self.chunk_size,
+                                                          'done': sorted(done)}))
+                    return
+                raise AssetError(f"Chunk {start}-{end} failed on every mirror: {'; '.join(errors)}")
+
+            pending = [i for i in range(len(chunks)) if i not in done]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(fetch_chunk, i) for i in pending]:
+                    future.result()
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        state_path.unlink(missing_ok=True)
+
+    def _fetch_whole(self, urls, dest):
+        errors = []
+        for url in urls:
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    with open(dest, 'wb') as f:
+                        for block in response.iter_content(1024 * 1024):
+                            f.write(block)
+                return
+            except requests.RequestException as e:
+                errors.append(str(e))
+        raise AssetError(f"Download failed on every mirror: {'; '.join(errors)}")
+
+
+class AssetStore:
+    """
+    Files under root/objects named by their sha256, plus a manifest per
+    profile (profiles/<name>.json) mapping paths in the unpacked archive to
+    objects. A file shared by several profiles or fetched twice is stored
+    once. Objects are read-only because trees built from the store
+    hardlink them.
+    """
+
+    def __init__(self, root=DEFAULT_STORE):
+        self.root = Path(root)
+        for sub in ('objects', 'profiles', 'downloads'):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, digest):
+        return self.root / 'objects' / digest[:2] / digest
+
+    def manifest_path(self, name):
+        return self.root / 'profiles' / f"{name}.json"
+
+    def manifest(self, name):
+        """The profile's manifest if it and all its objects are present, else None"""
+        try:
+            manifest = json.loads(self.manifest_path(name).read_text())
+        except (OSError, ValueError):
+            return None
+        if not all(self.object_path(d).exists() for d in set(manifest['files'].values())):
+            return None
+        return manifest
+
+    def add_stream(self, stream):
+        """Store a file-like object's content. Returns its sha256."""
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.root / 'downloads', delete=False) as tmp:
+            for block in iter(lambda: stream.read(1024 * 1024), b''):
+                digest.update(block)
+                tmp.write(block)
+        digest = digest.hexdigest()
+        path = self.object_path(digest)
+        if path.exists():
+            os.unlink(tmp.name)
+        else:
+            path.parent.mkdir(exist_ok=True)
+            os.chmod(tmp.name, 0o444)
+            os.replace(tmp.name, path)
+        return digest
+
+    def fetch(self, name, profile, workers=4, chunk_size=CHUNK_SIZE, verify=True):
+        """Download, verify and unpack a profile unless it is already stored"""
+        manifest = self.manifest(name)
+        if manifest is not None:
+            print(f"{name}: cached ({len(manifest['files'])} files)")
+            return manifest
+
+        downloader = Downloader(workers, chunk_size)
+        expected = profile.get('sha256')
+        if expected is None and profile.get('checksums'):
+            expected = lookup_checksum(profile['checksums'],
+                                       profile.get('checksum_name', Path(profile['urls'][0]).name),
+                                       downloader.session)
+        if expected is None and verify:
+            raise AssetError(f"{name}: no checksum published or pinned (sha256); "
+                             f"use --no-verify to trust the download")
+
+        archive = self.root / 'downloads' / f"{expected or name}.part"
+        start = time.monotonic()
+        print(f"{name}: downloading with {workers} workers...")
+        downloader.fetch(profile['urls'], archive)
+        actual = sha256_file(archive)
+        if expected and actual != expected:
+            archive.unlink()
+            raise AssetError(f"{name}: checksum mismatch (expected {expected}, got {actual})")
+        size = archive.stat().st_size
+        print(f"{name}: {size / 1024**2:.1f} MB in {time.monotonic() - start:.1f}s, sha256 {actual[:16]}")
+
+        manifest = {'profile': name, 'archive_sha256': actual, 'verified': bool(expected),
+                    'fetched': time.time(), 'files': {}, 'links': {}, 'dirs': []}
+        try:
+            self._unpack(archive, manifest)
+        finally:
+            archive.unlink(missing_ok=True)
+        tmp = self.manifest_path(name).with_suffix('.tmp')
+        tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+        os.replace(tmp, self.manifest_path(name))
+        return manifest
+
+    def _unpack(self, archive, manifest):
+        try:
+            with tarfile.open(archive) as tar:
+                for member in tar:
+                    path = posixpath.normpath(member.name.lstrip('/'))
+                    if path == '.' or path.startswith('..'):
+                        continue
+                    if member.isdir():
+                        manifest['dirs'].append(path)
+                    elif member.issym():
+                        manifest['links'][path] = member.linkname
+                    elif member.islnk():
+                        target = posixpath.normpath(member.linkname)
+                        manifest['files'][path] = manifest['files'][target]
+                    elif member.isfile():
+                        manifest['files'][path] = self.add_stream(tar.extractfile(member))
+        except (tarfile.TarError, KeyError) as e:
+            raise AssetError(f"Cannot unpack {archive}: {e}")
+
+    def _resolve(self, manifest, path, depth=0):
+        """Follow archive symlinks to a stored file path or directory"""
+        if path in manifest['links']:
+            if depth > 16:
+                raise AssetError(f"Symlink loop at {path}")
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(path),
+                                                       manifest['links'][path]))
+            return self._resolve(manifest, target, depth + 1)
+        return path
+
+    def link(self, name, target, clean=True):
+        """
+        Build profile name's tree at target out of hardlinks to the store.
+        Files under LINK_MIN_SIZE, and every file if target is on another
+        filesystem, are copies instead. Symlinks are resolved the way
+        'cp -rL' would, so the tree works from inside containers.
+        """
+        manifest = self.manifest(name)
+        if manifest is None:
+            raise AssetError(f"{name}: not fetched")
+        target = Path(target)
+        if clean and target.exists():
+            for entry in target.iterdir():
+                if entry.is_dir() and not entry.is_symlink():
+                    shutil.rmtree(entry)
+                else:
+                    entry.unlink()
+        target.mkdir(parents=True, exist_ok=True)
+
+        files = dict(manifest['files'])
+        for path in manifest['links']:
+            resolved = self._resolve(manifest, path)
+            if resolved in files:
+                files[path] = files[resolved]
+            else:
+                # A directory symlink: its files appear under the link's path
+                prefix = resolved + '/'
+                files.update({path + '/' + f[len(prefix):]: d
+                              for f, d in manifest['files'].items() if f.startswith(prefix)})
+
+        copied = 0
+        for directory in manifest['dirs']:
+            (target / directory).mkdir(parents=True, exist_ok=True)
+        for path, digest in files.items():
+            dest = target / path
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            source = self.object_path(digest)
+            if source.stat().st_size >= LINK_MIN_SIZE:
+                # Never write through an existing link into the store
+                dest.unlink(missing_ok=True)
+                try:
+                    os.link(source, dest)
+                    continue
+                except OSError:
+                    pass
+            replace_file(source, dest)
+            copied += 1
+        return {'files': len(files), 'copied': copied}
+
+    def usage(self):
+        """Objects on disk versus the bytes the stored profiles reference"""
+        objects = [p for p in (self.root / 'objects').rglob('*') if p.is_file()]
+        referenced = 0
+        profiles = {}
+        for path in sorted((self.root / 'profiles').glob('*.json')):
+            manifest = json.loads(path.read_text())
+            size = sum(self.object_path(d).stat().st_size
+                       for d in manifest['files'].values() if self.object_path(d).exists())
+            profiles[path.stem] = {'files': len(manifest['files']), 'bytes': size,
+                                   'verified': manifest.get('verified', False)}
+            referenced += size
+        return {'objects': len(objects), 'stored_bytes': sum(p.stat().st_size for p in objects),
+                'referenced_bytes': referenced, 'profiles': profiles}
+
+    def gc(self):
+        """Delete objects no manifest refers to. Returns the bytes freed."""
+        live = set()
+        for path in (self.root / 'profiles').glob('*.json'):
+            live.update(json.loads(path.read_text())['files'].values())
+        freed = 0
+        for path in (self.root / 'objects').rglob('*'):
+            if path.is_file() and path.name not in live:
+                freed += path.stat().st_size
+                path.unlink()
+        return freed
+
+
+def serve(store, names, profiles, tftp='pxe-data/tftp', http='pxe-data/http',
+          overlay=DEFAULT_OVERLAY):
+    """
+    Link profiles into the PXE server volumes: the first at the TFTP root
+    (where the boot menu expects it), the others under <profile>/, and
+    each also under the HTTP root when its 'serve' list includes http.
+
+    Files in overlay that are not the first profile's stored ones (files
+    added by hand or by pxe_alternative.sh, an edited boot menu) are
+    copied over the TFTP root, so they are served as before.
+    """
+    for i, name in enumerate(names):
+        directory = Path(tftp) if i == 0 else Path(tftp) / name
+        result = store.link(name, directory)
+        print(f"{name}: {result['files']} files linked into {directory}"
+              + (f" ({result['copied']} copied)" if result['copied'] else ''))
+        if i == 0 and overlay and Path(overlay).is_dir():
+            count = overlay_tree(overlay, directory)
+            if count:
+                print(f"{overlay}: {count} local files copied over {directory}")
+        if 'http' in profiles.get(name, {}).get('serve', ['tftp']):
+            store.link(name, Path(http) / name)
+            print(f"{name}: linked into {Path(http) / name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed PXE boot asset cache')
+    parser.add_argument('--store', default=DEFAULT_STORE, help='Asset store directory')
+    subparsers = parser.add_subparsers(dest='command')
+
+    fetch_parser = subparsers.add_parser('fetch', help='Download and verify profiles')
+    fetch_parser.add_argument('profiles', nargs='*', help=f'Profiles (default: {DEFAULT_PROFILE})')
+    fetch_parser.add_argument('--workers', type=int, default=4, help='Parallel range requests')
+    fetch_parser.add_argument('--chunk-mb', type=int, default=CHUNK_SIZE // 1024**2,
+                              help='Range request size in MB')
+    fetch_parser.add_argument('--no-verify', action='store_true',
+                              help='Accept downloads without a published checksum')
+
+    link_parser = subparsers.add_parser('link', help="Hardlink a profile's files into a directory")
+    link_parser.add_argument('profile', help='Profile name')
+    link_parser.add_argument('--into', required=True, help='Target directory (emptied first)')
+
+    serve_parser = subparsers.add_parser('serve', help='Link profiles into the PXE server volumes')
+    serve_parser.add_argument('profiles', nargs='*',
+                              help='Profiles, first at the TFTP root (default: pxe_assets.serve)')
+    serve_parser.add_argument('--tftp', default='pxe-data/tftp', help='TFTP root')
+    serve_parser.add_argument('--http', default='pxe-data/http', help='HTTP root')
+    serve_parser.add_argument('--overlay', default=DEFAULT_OVERLAY,
+                              help="Local files copied over the TFTP root ('' for none)")
+
+    subparsers.add_parser('list', help='List profiles and what is stored')
+    subparsers.add_parser('gc', help='Delete objects no profile uses')
+
+    args = parser.parse_args()
+    store = AssetStore(args.store)
+    profiles, settings = load_profiles()
+
+    try:
+        if args.command == 'fetch':
+            for name in args.profiles or [DEFAULT_PROFILE]:
+                if name not in profiles:
+                    raise AssetError(f"Unknown profile '{name}' (have: {', '.join(sorted(profiles))})")
+                store.fetch(name, profiles[name], args.workers, args.chunk_mb * 1024**2,
+                            verify=not args.no_verify)
+        elif args.command == 'link':
+            result = store.link(args.profile, args.into)
+            print(f"{args.profile}: {result['files']} files linked into {args.into}"
+                  + (f" ({result['copied']} copied)" if result['copied'] else ''))
+        elif args.command == 'serve':
+            serve(store, args.profiles or settings.get('serve') or [DEFAULT_PROFILE], profiles,
+                  args.tftp, args.http, args.overlay)
+        elif args.command == 'list':
+            usage = store.usage()
+            for name, profile in profiles.items():
+                stored = usage['profiles'].get(name)
+                status = (f"{stored['files']} files, {stored['bytes'] / 1024**2:.1f} MB"
+                          + ('' if stored['verified'] else ', unverified')) if stored else '-'
+                print(f"{name:<18} {status:<28} {profile.get('description', '')}")
+            print(f"\nStore: {usage['objects']} objects, {usage['stored_bytes'] / 1024**2:.1f} MB "
+                  f"on disk for {usage['referenced_bytes'] / 1024**2:.1f} MB of profile files")
+        elif args.command == 'gc':
+            print(f"Freed {store.gc() / 1024**2:.1f} MB")
+        else:
+            parser.print_help()
+    except AssetError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+QMP Client
+Asyncio client for the QEMU Machine Protocol, with a pool that keeps one
+connection open per VM
+"""
+
+import asyncio
+import atexit
+import collections
+import json
+import threading
+
+
+class QMPError(Exception):
+    """QMP command failed or the monitor is unreachable"""
+
+
+class QMPClient:
+    """One QMP connection; commands may be issued concurrently"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.reader = None
+        self.writer = None
+        self.events = collections.deque(maxlen=256)
+        self.closed = None
+        self._pending = {}
+        self._next_id = 0
+        self._reader_task = None
+
+    async def connect(self, timeout=5.0):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.path), timeout)
+            greeting = json.loads(await asyncio.wait_for(self.reader.readline(), timeout))
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            raise QMPError(f"Cannot connect to QMP at {self.path}: {e}") from e
+        if 'QMP' not in greeting:
+            raise QMPError(f"Unexpected QMP greeting: {greeting}")
+        self.closed = asyncio.get_running_loop().create_future()
+        self._reader_task = asyncio.create_task(self._read_loop())
+        await self.execute('qmp_capabilities', timeout=timeout)
+        return self
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if 'event' in message:
+                    self.events.append(message)
+                    continue
+                future = self._pending.pop(message.get('id'), None)
+                if future and not future.done():
+                    future.set_result(message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            # QEMU closes the monitor when it exits
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(QMPError('QMP connection closed'))
+            self._pending.clear()
+            if not self.closed.done():
+                self.closed.set_result(True)
+
+    @property
+    def is_open(self):
+        return self.closed is not None and not self.closed.done()
+
+    async def execute(self, command, arguments=None, timeout=5.0):
+        """Run a QMP command and return its 'return' value"""
+        if self.closed is not None and self.closed.done():
+            raise QMPError('QMP connection closed')
+        self._next_id += 1
+        request = {'execute': command, 'id': self._next_id}
+        if arguments:
+            request['arguments'] = arguments
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        try:
+            await self.writer.drain()
+            response = await asyncio.wait_for(future, timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self._pending.pop(request['id'], None)
+            raise QMPError(f"{command} failed: {e or 'timeout'}") from e
+        if 'error' in response:
+            error = response['error']
+            raise QMPError(f"{command}: {error.get('class')}: {error.get('desc')}")
+        return response.get('return')
+
+    async def wait_closed(self, timeout):
+        """Wait for QEMU to close the connection (i.e. exit)"""
+        try:
+            await asyncio.wait_for(asyncio.shield(self.closed), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+        if self._reader_task:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+class QMPPool:
+    """
+    Open QMP connections keyed by socket path, served from an event loop on a
+    background thread so synchronous callers (VMManager, the daemon) can
+    reuse them across calls.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.clients = {}
+        self._connect_locks = collections.defaultdict(asyncio.Lock)
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        name='qmp-pool', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the pool's loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def client(self, path):
+        path = str(path)
+        # Concurrent requests for one VM share a single connection
+        async with self._connect_locks[path]:
+            client = self.clients.get(path)
+            if client is None or not client.is_open:
+                client = await QMPClient(path).connect()
+                self.clients[path] = client
+        return client
+
+    async def _execute(self, path, command, arguments=None, timeout=5.0):
+        client = await self.client(path)
+        return await client.execute(command, arguments, timeout)
+
+    def execute(self, path, command, arguments=None, timeout=5.0):
+        return self.run(self._execute(path, command, arguments, timeout))
+
+    def execute_many(self, requests, timeout=5.0):
+        """
+        Run (path, command, arguments) requests concurrently. Returns a list
+        of results in order; failures are returned as QMPError instances.
+        """
+        async def gather():
+            return await asyncio.gather(
+                *(self._execute(path, command, arguments, timeout)
+                  for path, command, arguments in requests),
+                return_exceptions=True)
+        return self.run(gather())
+
+    def wait_closed(self, path, timeout):
+        """Wait until QEMU behind path closes its monitor"""
+        client = self.clients.get(str(path))
+        if client is None:
+            return True
+        return self.run(client.wait_closed(timeout))
+
+    def drop(self, path):
+        client = self.clients.pop(str(path), None)
+        if client:
+            self.run(client.close())
+
+    def close(self):
+        """Close every connection and stop the loop"""
+        if self.loop.is_closed() or not self.loop.is_running():
+            return
+        clients, self.clients = list(self.clients.values()), {}
+
+        async def close_all():
+            await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+        self.run(close_all(), timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+"""
+Virtual Nodes
+QEMU-less simulated servers for control-plane scale tests. A discrete-event
+engine plays each node's power-on, POST, PXE (DHCP/TFTP), installer and OS
+boot with configurable durations and failures, faster than real time.
+Served like the vm-manager daemon, so the bridge drives them from Redfish.
+"""
+
+import argparse
+import collections
+import heapq
+import json
+import math
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import yaml
+
+from boot_timeline import fleet_summary, timelines
+from inventory import Inventory
+from vm_daemon import DaemonError, VMDaemon, VMDaemonClient
+
+DEFAULT_SOCKET = 'images/vms/virtual-nodes.sock'
+DEFAULT_INVENTORY = 'config/virtual-nodes.db'
+
+# Seconds of simulated time; a number is a fixed duration
+DEFAULT_PHASES = {
+    'post': {'dist': 'normal', 'mean': 25, 'stddev': 5},
+    'dhcp': {'dist': 'uniform', 'low': 0.5, 'high': 3},
+    'tftp': {'dist': 'lognormal', 'median': 4, 'sigma': 0.3},
+    'kernel': {'dist': 'normal', 'mean': 8, 'stddev': 1.5},
+    'installer': {'dist': 'lognormal', 'median': 480, 'sigma': 0.25},
+    'os_boot': {'dist': 'normal', 'mean': 20, 'stddev': 4},
+}
+
+# What a node's BMC would report as Redfish BootProgress.LastState
+BOOT_PROGRESS = {
+    'off': 'None',
+    'post': 'PrimaryProcessorInitializationStarted',
+    'dhcp': 'SystemHardwareInitializationComplete',
+    'tftp': 'SystemHardwareInitializationComplete',
+    'kernel': 'OSBootStarted',
+    'installer': 'OSBootStarted',
+    'os_boot': 'OSBootStarted',
+    'running': 'OSRunning',
+    'failed': 'OEM',
+}
+
+# boot_timeline event kinds emitted when a phase starts and when it ends
+PHASE_EVENTS = {
+    'dhcp': (('dhcp_discover',), ('dhcp_ack',)),
+    'tftp': ((), ('tftp_sent',)),
+    'kernel': (('kernel_start',), ('userspace',)),
+    'installer': (('http_get',), ('http_get', 'reboot')),   # first and last fetch
+    'os_boot': ((), ('login',)),
+}
+
+
+def sample(spec, rng):
+    """
+    Draw a duration from a distribution spec: a number, or a dict with
+    dist fixed (value), uniform (low, high), normal (mean, stddev),
+    lognormal (median, sigma) or exponential (mean)
+    """
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    dist = spec.get('dist', 'fixed')
+    if dist == 'fixed':
+        return float(spec['value'])
+    if dist == 'uniform':
+        return rng.uniform(spec['low'], spec['high'])
+    if dist == 'normal':
+        return max(0.0, rng.gauss(spec['mean'], spec['stddev']))
+    if dist == 'lognormal':
+        return rng.lognormvariate(math.log(spec['median']), spec['sigma'])
+    if dist == 'exponential':
+        return rng.expovariate(1 / spec['mean'])
+    raise ValueError(f"Unknown distribution: {dist}")
+
+
+class EventLoop:
+    """
+    Simulated clock and event queue.
+
+    With speedup 0 events run back to back and the clock jumps to each
+    one (offline runs). Otherwise the clock follows the wall clock scaled
+    by speedup, so outside callers (the bridge, an orchestrator) see nodes
+    progress at that multiple of real time. Callers outside the loop
+    thread must hold ``lock``.
+    """
+
+    def __init__(self, speedup=0):
+        self.speedup = speedup
+        self.lock = threading.Condition()
+        self._queue = []
+        self._seq = 0
+        self._now = 0.0
+        self._wall_start = time.monotonic()
+        self.epoch = time.time()    # wall time of simulated t=0
+
+    def now(self):
+        if self.speedup:
+            return (time.monotonic() - self._wall_start) * self.speedup
+        return self._now
+
+    def schedule(self, delay, fn, *args):
+        self._seq += 1
+        heapq.heappush(self._queue, (self.now() + delay, self._seq, fn, args))
+        if self.speedup:
+            self.lock.notify()
+
+    def run(self, until=None):
+        """Run events until the queue is empty (or simulated time until)"""
+        with self.lock:
+            while self._queue:
+                at = self._queue[0][0]
+                if until is not None and at > until:
+                    break
+                if self.speedup:
+                    wait = (at - self.now()) / self.speedup
+                    if wait > 0:
+                        self.lock.wait(wait)
+                        continue
+                else:
+                    self._now = at
+                _, _, fn, args = heapq.heappop(self._queue)
+                fn(*args)
+
+    def run_forever(self):
+        """Paced mode: keep running events as they come due"""
+        while True:
+            with self.lock:
+                while not self._queue:
+                    self.lock.wait()
+            self.run()
+
+
+class Resource:
+    """A PXE-server bottleneck: at most capacity nodes in a phase, the rest queue"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self.waiting = collections.deque()
+
+    def acquire(self, node, fn):
+        if self.in_use < self.capacity:
+            self.in_use += 1
+            fn()
+        else:
+            self.waiting.append((node, node.generation, fn))
+
+    def release(self):
+        while self.waiting:
+            node, generation, fn = self.waiting.popleft()
+            if node.generation == generation:
+                fn()    # the slot passes straight to the next node
+                return
+        self.in_use -= 1
+
+
+class VirtualNode:
+    def __init__(self, name, system_id=None, mac=None):
+        self.name = name
+        self.system_id = system_id
+        self.mac = mac
+        self.phase = 'off'
+        self.boot_mode = 'disk'
+        self.installed = False
+        self.failed_phase = None
+        # Bumped on every power transition; events of older ones are dropped
+        self.generation = 0
+        self.holding = None         # Resource held in the current phase
+        self.boots = 0
+
+
+class ProgressReporter:
+    """
+    Sends nodes' BootProgress to the BMC from a few threads. Updates for a
+    node still waiting to be sent are coalesced, so at high speedups the
+    BMC sees the latest phase rather than falling behind.
+    """
+
+    def __init__(self, bridge, workers=8):
+        self.bridge = bridge
+        self.pending = {}
+        self.queue = collections.deque()
+        self.in_flight = set()
+        self.cond = threading.Condition()
+        self.errors = 0
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def report(self, system_id, last_state, oem_state):
+        with self.cond:
+            queued = system_id in self.pending
+            self.pending[system_id] = (last_state, oem_state)
+            if not queued and system_id not in self.in_flight:
+                self.queue.append(system_id)
+                self.cond.notify()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                system_id = self.queue.popleft()
+                progress = self.pending.pop(system_id)
+                self.in_flight.add(system_id)
+            try:
+                self.bridge.set_boot_progress(system_id, *progress)
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1 or self.errors % 1000 == 0:
+                    print(f"BootProgress update failed ({self.errors} so far): {e}")
+            with self.cond:
+                self.in_flight.discard(system_id)
+                if system_id in self.pending:
+                    self.queue.append(system_id)
+                    self.cond.notify()
+
+
+class VirtualFleet:
+    """
+    Simulated nodes behind the VMManager methods the bridge uses
+    (start_vm, stop_vm, powerdown_vm, reset_vm, vm_status, vm_statuses,
+    vm_names, list_vms, create_vms, delete_vm), keyed by the same kind of
+    inventory.
+
+    A PXE boot goes post -> dhcp -> tftp -> kernel -> installer, then
+    reboots into post -> os_boot -> running; a disk boot of an installed
+    node goes post -> os_boot -> running. Each phase fails with its
+    configured probability and the node then hangs there until it is reset
+    or power-cycled. A failed DHCP makes a 'pxe' boot fall back to disk.
+    Power-off is immediate (no guest shutdown is modelled).
+    """
+
+    def __init__(self, loop, settings=None, inventory=None, seed=None, events_file=None,
+                 reporter=None):
+        settings = settings or {}
+        self.loop = loop
+        self.phases = dict(DEFAULT_PHASES, **(settings.get('phases') or {}))
+        self.failures = settings.get('failures') or {}
+        self.resources = {phase: Resource(capacity)
+                          for phase, capacity in (settings.get('capacity') or {}).items()}
+        self.inventory = inventory
+        self.rng = random.Random(seed)
+        self.events_file = events_file
+        self.reporter = reporter
+        self.events = 0
+        self.nodes = {}
+        self.last_system_id = 0
+        if inventory is not None:
+            for vm in inventory.all():
+                self.add_node(vm)
+
+    def add_node(self, vm_config):
+        node = VirtualNode(vm_config['name'], vm_config.get('system_id'), vm_config.get('mac'))
+        node.installed = vm_config.get('installed', False)
+        self.nodes[node.name] = node
+        return node
+
+    # Simulation
+
+    def emit(self, node, kind):
+        self.events += 1
+        if self.events_file:
+            event = {'time': round(self.loop.epoch + self.loop.now(), 3), 'vm': node.name,
+                     'source': 'sim', 'kind': kind, 'detail': None}
+            self.events_file.write(json.dumps(event) + '\n')
+
+    def enter(self, node, phase):
+        if node.holding is not None:
+            node.holding.release()
+            node.holding = None
+        node.phase = phase
+        if self.reporter and node.system_id:
+            oem = f"Failed:{node.failed_phase}" if phase == 'failed' else phase
+            self.reporter.report(node.system_id, BOOT_PROGRESS[phase], oem)
+        if phase not in self.phases:
+            return
+        resource = self.resources.get(phase)
+        generation = node.generation
+        if resource is None:
+            self.begin(node, phase, generation)
+        else:
+            resource.acquire(node, lambda: self.begin(node, phase, generation, resource))
+
+    def begin(self, node, phase, generation, resource=None):
+        if node.generation != generation:
+            if resource:
+                resource.release()
+            return
+        node.holding = resource
+        for kind in PHASE_EVENTS.get(phase, ((), ()))[0]:
+            self.emit(node, kind)
+        self.loop.schedule(sample(self.phases[phase], self.rng), self.finish, node, phase,
+                           generation)
+
+    def finish(self, node, phase, generation):
+        if node.generation != generation:
+            return
+        if self.rng.random() < self.failures.get(phase, 0):
+            if phase == 'dhcp' and node.boot_mode == 'pxe':
+                # The PXE ROM gives up and the firmware tries the disk
+                self.enter(node, self.disk_boot(node, 'dhcp'))
+            else:
+                node.failed_phase = phase
+                self.enter(node, 'failed')
+            return
+        for kind in PHASE_EVENTS.get(phase, ((), ()))[1]:
+            self.emit(node, kind)
+        if phase == 'post':
+            self.enter(node, 'dhcp' if node.boot_mode in ('pxe', 'pxe-only')
+                       else self.disk_boot(node))
+        elif phase == 'dhcp':
+            self.enter(node, 'tftp')
+        elif phase == 'tftp':
+            self.enter(node, 'kernel')
+        elif phase == 'kernel':
+            self.enter(node, 'installer')
+        elif phase == 'installer':
+            # The installer reboots into the OS it just wrote
+            node.installed = True
+            node.boot_mode = 'disk'
+            node.boots += 1
+            self.enter(node, 'post')
+        elif phase == 'os_boot':
+            self.enter(node, 'running')
+
+    def disk_boot(self, node, reason='no_os'):
+        """Next phase of a boot from disk: the OS if one is installed"""
+        if node.installed:
+            return 'os_boot'
+        node.failed_phase = reason
+        return 'failed'
+
+    def power_on(self, node, boot_mode):
+        node.generation += 1
+        node.boot_mode = boot_mode
+        node.failed_phase = None
+        node.boots += 1
+        self.enter(node, 'post')
+
+    def power_off(self, node):
+        node.generation += 1
+        self.enter(node, 'off')
+
+    # VMManager interface
+
+    def _node(self, name):
+        node = self.nodes.get(name)
+        if node is None:
+            print(f"VM '{name}' not found")
+        return node
+
+    def start_vm(self, name, boot_mode='disk', **_):
+        with self.loop.lock:
+            node = self._node(name)
+            if node is None:
+                return False
+            if node.phase != 'off':
+                print(f"VM '{name}' is already running")
+                return False
+            self.power_on(node, boot_mode)
+        print(f"VM '{name}' started ({boot_mode} boot)")
+        return True
+
+    def stop_vm(self, name, timeout=30, force=False):
+        with self.loop.lock:
+            node = self._node(name)
+            if node is None:
+                return False
+            if node.phase == 'off':
+                print(f"VM '{name}' is not running")
+                return False
+            self.power_off(node)
+        print(f"VM '{name}' stopped")
+        return True
+
+    def powerdown_vm(self, name):
+        # No guest shutdown is modelled: the node is off right away
+        return self.stop_vm(name)
+
+    def reset_vm(self, name):
+        with self.loop.lock:
+            node = self._node(name)
+            if node is None or node.phase == 'off':
+                print(f"Failed to reset VM '{name}': not running")
+                return False
+            self.power_on(node, node.boot_mode)
+        print(f"VM '{name}' reset")
+        return True
+
+    def vm_statuses(self, names):
+        with self.loop.lock:
+            return {name: {'name': name,
+                           'state': 'stopped' if node.phase == 'off' else 'running',
+                           'phase': node.phase, 'failed_phase': node.failed_phase,
+                           'pid': None}
+                    for name, node in ((n, self.nodes[n]) for n in names)}
+
+    def vm_status(self, name):
+        return self.vm_statuses([name])[name]
+
+    def vm_names(self):
+        return list(self.nodes)
+
+    def list_vms(self, names_only=False):
+        if names_only:
+            for name in self.nodes:
+                print(name)
+            return
+        counts = self.node_summary()
+        print(f"{len(self.nodes)} virtual nodes at t={counts.pop('time')}s: " +
+              ', '.join(f"{phase} {count}" for phase, count in counts['phases'].items()))
+
+    def node_summary(self):
+        """Nodes per phase and failures per phase, at the current simulated time"""
+        with self.loop.lock:
+            phases = collections.Counter(node.phase for node in self.nodes.values())
+            failed = collections.Counter(node.failed_phase for node in self.nodes.values()
+                                         if node.phase == 'failed')
+            return {'time': round(self.loop.now(), 1), 'phases': dict(phases),
+                    'failed': dict(failed), 'events': self.events}
+
+    def allocate_system_ids(self, count):
+        """
+        First of count new system ids (which also number the MACs). Ids
+        only move forward, deletes included, so a Redfish system never
+        maps to a second node.
+        """
+        last = max([self.last_system_id] +
+                   [int(node.system_id) for node in self.nodes.values()
+                    if str(node.system_id or '').isdigit()])
+        if self.inventory is not None:
+            last = max(last, int(self.inventory.get_meta('virtual_system_id') or 0))
+        self.last_system_id = last + count
+        return last + 1
+
+    def create_vms(self, prefix, count, memory=2048, cpus=2, **_):
+        """Add count nodes <prefix>-00001.., numbered as systems after all earlier ones"""
+        width = max(5, len(str(count)))
+        with self.loop.lock:
+            first = self.allocate_system_ids(count)
+        configs = []
+        for i in range(count):
+            index = first + i
+            name = f"{prefix}-{i + 1:0{width}d}"
+            if name in self.nodes:
+                continue
+            configs.append({
+                'name': name, 'memory': memory, 'cpus': cpus, 'virtual': True,
+                'system_id': str(index),
+                'mac': f"52:54:01:{index >> 16 & 0xff:02x}:{index >> 8 & 0xff:02x}:"
+                       f"{index & 0xff:02x}",
+                'state': 'stopped',
+            })
+        if self.inventory is not None:
+            with self.inventory.transaction():
+                self.inventory.add_many(configs)
+                self.inventory.set_meta('virtual_system_id', str(self.last_system_id))
+        with self.loop.lock:
+            for vm_config in configs:
+                self.add_node(vm_config)
+        print(f"Created {len(configs)} virtual nodes")
+        return [c['name'] for c in configs]
+
+    def delete_vm(self, name, force=False):
+        with self.loop.lock:
+            node = self._node(name)
+            if node is None:
+                return False
+            if node.phase != 'off' and not force:
+                print(f"VM '{name}' is running. Stop it first or use --force")
+                return False
+            self.power_off(node)
+            del self.nodes[name]
+        if self.inventory is not None:
+            self.inventory.remove(name)
+        print(f"VM '{name}' deleted successfully")
+        return True
+
+
+def load_settings(config_path='config/vms.yaml'):
+    try:
+        with open(config_path) as f:
+            return (yaml.safe_load(f) or {}).get('virtual_nodes') or {}
+    except FileNotFoundError:
+        return {}
+
+
+def simulate(settings, count, boot_mode='pxe', ramp=0.0, seed=None, events_path=None):
+    """
+    Offline run: power on count nodes spread over ramp seconds and play the
+    fleet to the end as fast as possible. Returns the summary.
+    """
+    loop = EventLoop(speedup=0)
+    events_file = open(events_path, 'w') if events_path else None
+    fleet = VirtualFleet(loop, settings, seed=seed, events_file=events_file)
+    fleet.create_vms('vnode', count)
+    for name in fleet.nodes:
+        delay = fleet.rng.uniform(0, ramp) if ramp else 0
+        loop.schedule(delay, fleet.power_on, fleet.nodes[name], boot_mode)
+    start = time.perf_counter()
+    loop.run()
+    elapsed = time.perf_counter() - start
+    if events_file:
+        events_file.close()
+    summary = fleet.node_summary()
+    summary['wall_seconds'] = round(elapsed, 3)
+    summary['speedup'] = round(summary['time'] / elapsed, 1) if elapsed else None
+    return summary
+
+
+def print_summary(summary, phases=None):
+    print(f"Simulated {summary['time']:.0f}s in {summary['wall_seconds']:.2f}s "
+          f"({summary['speedup']}x real time), {summary['events']} boot events")
+    print('Nodes: ' + ', '.join(f"{p} {c}" for p, c in summary['phases'].items()))
+    if summary['failed']:
+        print('Failed in: ' + ', '.join(f"{p} {c}" for p, c in summary['failed'].items()))
+    if phases:
+        print(f"{'phase':<12}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+        for phase, stats in phases.items():
+            print(f"{phase:<12}{stats['count']:>7}{stats['mean']:>9.1f}{stats['p50']:>9.1f}"
+                  f"{stats['p95']:>9.1f}{stats['max']:>9.1f}")
+
+
+def serve(settings, socket_path, speedup, seed=None, events_path=None, bmc_url=None,
+          inventory_path=DEFAULT_INVENTORY):
+    loop = EventLoop(speedup=speedup)
+    reporter = None
+    if bmc_url:
+        from bmc_bridge import BMCBridge
+        reporter = ProgressReporter(BMCBridge(bmc_url))
+    events_file = None
+    if events_path:
+        Path(events_path).parent.mkdir(parents=True, exist_ok=True)
+        events_file = open(events_path, 'a', buffering=1)
+    fleet = VirtualFleet(loop, settings, Inventory(inventory_path), seed, events_file, reporter)
+    Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+    threading.Thread(target=loop.run_forever, name='event-loop', daemon=True).start()
+    print(f"Simulating {len(fleet.nodes)} virtual nodes at {speedup}x real time")
+    VMDaemon(fleet, socket_path).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QEMU-less virtual nodes')
+    parser.add_argument('--config', default='config/vms.yaml',
+                        help='vms.yaml with a virtual_nodes section')
+    parser.add_argument('--seed', type=int, help='Random seed for repeatable runs')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='Serve nodes to the bridge')
+    serve_parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Daemon socket path')
+    serve_parser.add_argument('--speedup', type=float, default=10.0,
+                              help='Simulated seconds per wall-clock second')
+    serve_parser.add_argument('--events', help='Append boot_timeline events to this file')
+    serve_parser.add_argument('--bmc-url', help='Report BootProgress to this Redfish API')
+    serve_parser.add_argument('--inventory', default=DEFAULT_INVENTORY)
+
+    create_parser = subparsers.add_parser('create', help='Add virtual nodes')
+    create_parser.add_argument('--prefix', default='vnode', help='Node name prefix')
+    create_parser.add_argument('--count', type=int, required=True)
+    create_parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Daemon socket path')
+    create_parser.add_argument('--inventory', default=DEFAULT_INVENTORY)
+
+    status_parser = subparsers.add_parser('status', help='Nodes per boot phase')
+    status_parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Daemon socket path')
+
+    sim_parser = subparsers.add_parser('simulate', help='Offline fleet boot, no BMC needed')
+    sim_parser.add_argument('--count', type=int, default=10000, help='Nodes')
+    sim_parser.add_argument('--boot', choices=['disk', 'pxe', 'pxe-only'], default='pxe')
+    sim_parser.add_argument('--ramp', type=float, default=0.0,
+                            help='Spread power-ons over this many simulated seconds')
+    sim_parser.add_argument('--events', help='Write boot_timeline events to this file')
+    sim_parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+
+    args = parser.parse_args()
+    settings = load_settings(args.config)
+
+    if args.command == 'serve':
+        serve(settings, args.socket, args.speedup, args.seed, args.events, args.bmc_url,
+              args.inventory)
+    elif args.command in ('create', 'status'):
+        client = VMDaemonClient(args.socket)
+        try:
+            if args.command == 'status':
+                print(json.dumps(client.call('node_summary'), indent=2))
+            elif client.available():
+                client.call('create_vms', prefix=args.prefix, count=args.count)
+            else:
+                fleet = VirtualFleet(EventLoop(), settings, Inventory(args.inventory))
+                fleet.create_vms(args.prefix, args.count)
+        except DaemonError as e:
+            print(f"Failed to {args.command}: {e}")
+            sys.exit(1)
+    elif args.command == 'simulate':
+        summary = simulate(settings, args.count, args.boot, args.ramp, args.seed, args.events)
+        if args.events:
+            with open(args.events) as f:
+                summary['boot_phases'] = fleet_summary(
+                    timelines(json.loads(line) for line in f))['phases']
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            print_summary(summary, summary.get('boot_phases'))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
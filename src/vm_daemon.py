@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+VM Manager Daemon
+Serves VMManager operations over a local Unix socket (newline-delimited JSON)
+so callers skip interpreter startup, imports and config parsing per command
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+
+DEFAULT_SOCKET = 'images/vms/vm-manager.sock'
+
+# Methods clients may call; everything else on VMManager stays private
+METHODS = {
+    'create_vm', 'create_vms', 'start_vm', 'stop_vm', 'delete_vm', 'list_vms',
+    'vm_names', 'vm_status', 'vm_statuses', 'reset_vm', 'vm_stats', 'export_config',
+    'import_config', 'capture_image', 'list_cached_images', 'invalidate_cached_image',
+    'evict_cached_images', 'host_placement', 'balance_memory', 'density_report',
+    'list_disk_profiles', 'node_summary', 'list_boot_profiles', 'measure_boot',
+    'sync_dhcp', 'stop_vms', 'delete_vms', 'fleet_status', 'powerdown_vm',
+}
+
+
+class DaemonError(Exception):
+    """The daemon is unreachable or a call failed inside it"""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.reply({'ok': False, 'error': 'invalid JSON'})
+                continue
+            self.reply(self.server.vm_daemon.dispatch(request))
+
+    def reply(self, response):
+        self.wfile.write(json.dumps(response, default=str).encode() + b'\n')
+        self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class VMDaemon:
+    """Owns one VMManager and runs client requests against it one at a time"""
+
+    def __init__(self, manager, socket_path=DEFAULT_SOCKET):
+        self.manager = manager
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+
+    def dispatch(self, request):
+        method = request.get('method')
+        if method not in METHODS:
+            return {'id': request.get('id'), 'ok': False, 'error': f"Unknown method: {method}"}
+        output = io.StringIO()
+        # VMManager is not thread-safe and reports progress on stdout, so
+        # calls are serialized and each call's output goes back to its client.
+        with self._lock, contextlib.redirect_stdout(output):
+            try:
+                result = getattr(self.manager, method)(**request.get('params', {}))
+                response = {'ok': True, 'result': result}
+            except Exception as e:
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        response.update(id=request.get('id'), output=output.getvalue())
+        return response
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if VMDaemonClient(self.socket_path).available():
+                raise DaemonError(f"A daemon is already listening on {self.socket_path}")
+            os.unlink(self.socket_path)
+        server = _Server(self.socket_path, _Handler)
+        server.vm_daemon = self
+        os.chmod(self.socket_path, 0o600)
+        print(f"VM manager daemon listening on {self.socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.socket_path)
+            print("VM manager daemon stopped")
+
+
+class VMDaemonClient:
+    """Keeps one connection to the daemon open for any number of calls"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._next_id = 0
+
+    def connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise DaemonError(f"Cannot reach daemon at {self.socket_path}: {e}") from e
+            self._sock = sock
+            self._file = sock.makefile('rwb')
+        return self
+
+    def available(self):
+        """True if a daemon is accepting connections"""
+        if not os.path.exists(self.socket_path):
+            return False
+        try:
+            self.connect()
+            return True
+        except DaemonError:
+            return False
+
+    def call(self, method, echo=True, **params):
+        """
+        Run a VMManager method in the daemon and return its result. The
+        method's console output is printed here unless echo is False.
+        """
+        self.connect()
+        self._next_id += 1
+        request = {'id': self._next_id, 'method': method, 'params': params}
+        try:
+            self._file.write(json.dumps(request).encode() + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        except OSError as e:
+            self.close()
+            raise DaemonError(f"Daemon connection failed: {e}") from e
+        if not line:
+            self.close()
+            raise DaemonError('Daemon closed the connection')
+        response = json.loads(line)
+        if echo and response.get('output'):
+            print(response['output'], end='')
+        if not response.get('ok'):
+            raise DaemonError(response.get('error', 'call failed'))
+        return response.get('result')
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
@@ -8,16 +8,185 @@ import argparse
 import subprocess
 import json
 import os
+import select
+import selectors
+import shlex
+import signal
 import sys
+import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from addressing import AddressPlan, DEFAULT_HOSTSFILE, reload_dnsmasq, write_hostsfile
+from boot_profiles import (BOOT_PROFILES, DEFAULT_BOOT_PROFILE, MICROVM_MACHINE, connect_serial,
+                           get_boot_profile, kernel_args, wait_for_output)
+from disk_profiles import DEFAULT_PROFILE, DISK_PROFILES, create_options, drive_args, get_profile
+from density import balloon_target, enable_ksm, guest_memory, ksm_stats, meminfo, process_rss_mb
+from image_cache import ImageCache, profile_digest
+from inventory import Inventory
+from proc_status import DEFAULT_TTL, ProcessScan, is_vm_process, read_process
+from placement import HostTopology, PlacementError, PlacementPlanner, pin_threads, qemu_memory_args
+from qmp import QMPError, QMPPool
+from vm_daemon import DEFAULT_SOCKET, DaemonError, VMDaemon, VMDaemonClient
+
+
+def wait_for_exit(pid, timeout):
+    """Wait up to timeout seconds for a process (not our child) to exit"""
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        # No pidfd support: poll /proc
+        deadline = time.monotonic() + timeout
+        while os.path.exists(f'/proc/{pid}'):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    try:
+        ready, _, _ = select.select([fd], [], [], timeout)
+        return bool(ready)
+    finally:
+        os.close(fd)
+
+
+def wait_for_exits(pids, timeout):
+    """
+    Wait up to timeout seconds for several processes (not our children) to
+    exit, all at once. Returns {pid: time.monotonic() when seen exiting}
+    for those that did.
+    """
+    exited = {}
+    polled = []
+    selector = selectors.DefaultSelector()
+    try:
+        for pid in pids:
+            try:
+                selector.register(os.pidfd_open(pid), selectors.EVENT_READ, pid)
+            except ProcessLookupError:
+                exited[pid] = time.monotonic()
+            except (AttributeError, OSError):
+                # No pidfd support: poll /proc
+                polled.append(pid)
+        deadline = time.monotonic() + timeout
+        while selector.get_map() or polled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if selector.get_map():
+                events = selector.select(min(remaining, 0.05) if polled else remaining)
+            else:
+                time.sleep(min(remaining, 0.05))
+                events = []
+            now = time.monotonic()
+            for key, _ in events:
+                exited[key.data] = now
+                selector.unregister(key.fileobj)
+                os.close(key.fileobj)
+            for pid in [p for p in polled if not os.path.exists(f'/proc/{p}')]:
+                exited[pid] = now
+                polled.remove(pid)
+    finally:
+        for key in list(selector.get_map().values()):
+            os.close(key.fileobj)
+        selector.close()
+    return exited
+
+
 class VMManager:
-    def __init__(self, config_path='config/vms.yaml'):
+    def __init__(self, config_path='config/vms.yaml', inventory_path='config/inventory.db'):
         self.config_path = config_path
+        self._image_formats = {}
         self.load_config()
+        self.inventory = Inventory(inventory_path, AddressPlan.from_config(self.address_settings))
+        self.import_legacy_vms()
         self.vm_dir = Path('images/vms')
         self.vm_dir.mkdir(parents=True, exist_ok=True)
+        self._qmp = None
+        self._image_cache = None
+        self._planner = None
+        self._processes = None
+        self._statuses = None
+        self._ksm_checked = False
+    
+    @property
+    def qmp(self):
+        """QMP connections to running VMs, opened on first use and kept open"""
+        if self._qmp is None:
+            self._qmp = QMPPool()
+        return self._qmp
+    
+    @property
+    def processes(self):
+        """Cached /proc scan of running VMs, shared by status pollers"""
+        if self._processes is None:
+            settings = self.config.get('status') or {}
+            self._processes = ProcessScan(self.vm_dir, settings.get('cache_ttl', DEFAULT_TTL))
+        return self._processes
+    
+    @property
+    def image_cache(self):
+        """Golden images captured from installed VMs, keyed by install profile"""
+        if self._image_cache is None:
+            settings = self.config.get('image_cache') or {}
+            self._image_cache = ImageCache(
+                settings.get('path', 'images/cache'),
+                int(settings.get('max_size_gb', 50) * 1024**3),
+                settings.get('sources'))
+        return self._image_cache
+    
+    @property
+    def placement_settings(self):
+        return self.config.get('placement') or {}
+    
+    @property
+    def planner(self):
+        """CPU/NUMA placement for started VMs, None unless placement is enabled"""
+        settings = self.placement_settings
+        if not settings.get('enabled'):
+            return None
+        if self._planner is None:
+            self._planner = PlacementPlanner(
+                HostTopology.from_sysfs(),
+                reserved_cpus=settings.get('reserved_cpus', []),
+                cpu_overcommit=settings.get('cpu_overcommit', 1),
+                memory_reserve_mb=settings.get('memory_reserve_mb', 2048),
+                memory_overcommit=(self.density_settings.get('max_overcommit', 3)
+                                   if self.density_settings.get('enabled') else 1))
+        return self._planner
+    
+    @property
+    def address_settings(self):
+        return self.config.get('addressing') or {}
+    
+    @property
+    def density_settings(self):
+        return self.config.get('density') or {}
+    
+    def qmp_socket(self, name):
+        return self.vm_dir / f"{name}.qmp"
+    
+    def console_socket(self, name):
+        """Serial console socket when serial_console is 'unix'"""
+        return self.vm_dir / f"{name}.console"
+    
+    @property
+    def unix_console(self):
+        return self.config.get('serial_console') == 'unix'
+    
+    def read_pid(self, name):
+        """
+        PID of a running VM from its pidfile, or None if missing or stale
+        (the process is gone, or the PID now belongs to something else)
+        """
+        try:
+            pid = int((self.vm_dir / f"{name}.pid").read_text().strip())
+        except (OSError, ValueError):
+            return None
+        process = read_process(pid)
+        return pid if process is not None and is_vm_process(process, name) else None
     
     def load_config(self):
         """Load VM configuration"""
@@ -37,79 +206,437 @@ class VMManager:
                 # Fallback to empty config
                 self.config = {'defaults': {}, 'vms': {}}
     
-    def save_config(self):
-        """Save VM configuration"""
-        with open(self.config_path, 'w') as f:
-            yaml.dump(self.config, f, default_flow_style=False)
+    def import_legacy_vms(self):
+        """Move VMs defined in vms.yaml into the inventory on first use"""
+        vms = self.config.get('vms') or {}
+        if vms and not self.inventory.get_meta('yaml_imported'):
+            count = self.inventory.import_vms(vms)
+            print(f"Imported {count} VMs from {self.config_path} into inventory")
+    
+    def export_config(self, path=None):
+        """Write the inventory out in the vms.yaml format"""
+        config = dict(self.config, vms=self.inventory.export_vms())
+        with open(path or self.config_path, 'w') as f:
+            yaml.dump(config, f, default_flow_style=False)
+    
+    def import_config(self, path):
+        """Add VMs from a vms.yaml-format file to the inventory"""
+        with open(path, 'r') as f:
+            config = yaml.safe_load(f) or {}
+        count = self.inventory.import_vms(config.get('vms') or {})
+        print(f"Imported {count} VMs from {path}")
+        self.sync_dhcp()
+        return count
+    
+    def disk_profile(self, name=None):
+        """An I/O profile by name, or the configured default (disk_profile in vms.yaml)"""
+        return get_profile(name or self.config.get('disk_profile', DEFAULT_PROFILE),
+                           self.config.get('disk_profiles'))
     
-    def create_disk(self, name, size_gb=20):
-        """Create a VM disk image"""
+    def list_disk_profiles(self):
+        """Print and return the built-in and configured disk I/O profiles"""
+        profiles = dict(DISK_PROFILES, **(self.config.get('disk_profiles') or {}))
+        default = self.config.get('disk_profile', DEFAULT_PROFILE)
+        for name, profile in profiles.items():
+            marker = '*' if name == default else ' '
+            print(f"{marker} {name:<15} {profile.get('description', '')}")
+        return profiles
+    
+    def boot_profile(self, name=None):
+        """A boot profile by name, or the configured default (boot_profile in vms.yaml)"""
+        return get_boot_profile(name or self.config.get('boot_profile', DEFAULT_BOOT_PROFILE),
+                                self.config.get('boot_profiles'))
+    
+    def list_boot_profiles(self):
+        """Print and return the built-in and configured boot profiles"""
+        profiles = dict(BOOT_PROFILES, **(self.config.get('boot_profiles') or {}))
+        default = self.config.get('boot_profile', DEFAULT_BOOT_PROFILE)
+        for name, profile in profiles.items():
+            marker = '*' if name == default else ' '
+            print(f"{marker} {name:<15} {profile.get('description', '')}")
+        return profiles
+    
+    def create_disk(self, name, size_gb=20, base_image=None, quiet=False, disk_profile=None):
+        """
+        Create a VM disk image, optionally as a copy-on-write overlay of
+        base_image. Returns (path, created); created is False when the disk
+        already existed and was left as it was.
+        """
         disk_path = self.vm_dir / f'{name}.qcow2'
+        options = create_options(self.disk_profile(disk_profile), backing=bool(base_image))
         
         if disk_path.exists():
             print(f"Disk already exists: {disk_path}")
-            return str(disk_path)
+            return str(disk_path), False
         
-        cmd = [
-            'qemu-img', 'create',
-            '-f', 'qcow2',
-            str(disk_path),
-            f'{size_gb}G'
-        ]
+        if base_image:
+            # Linked clone: only blocks the guest writes land in the overlay
+            base_path = Path(base_image).resolve()
+            cmd = [
+                'qemu-img', 'create',
+                '-f', 'qcow2',
+                '-b', str(base_path),
+                '-F', self.image_format(base_path),
+                *options,
+                str(disk_path)
+            ]
+            if not quiet:
+                print(f"Creating overlay disk: {disk_path} (backing: {base_path})")
+        else:
+            cmd = [
+                'qemu-img', 'create',
+                '-f', 'qcow2',
+                *options,
+                str(disk_path),
+                f'{size_gb}G'
+            ]
+            if not quiet:
+                print(f"Creating disk: {disk_path} ({size_gb}GB)")
         
-        print(f"Creating disk: {disk_path} ({size_gb}GB)")
-        subprocess.run(cmd, check=True)
+        try:
+            # Claim the name atomically so concurrent creates agree on who made it
+            os.close(os.open(disk_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            print(f"Disk already exists: {disk_path}")
+            return str(disk_path), False
+        try:
+            subprocess.run(cmd, check=True, capture_output=quiet)
+        except BaseException:
+            disk_path.unlink(missing_ok=True)
+            raise
         
-        return str(disk_path)
+        return str(disk_path), True
+    
+    def image_format(self, path):
+        """Detect the format of an existing disk image"""
+        path = str(path)
+        if path not in self._image_formats:
+            result = subprocess.run(['qemu-img', 'info', '--output=json', path],
+                                    check=True, capture_output=True, text=True)
+            self._image_formats[path] = json.loads(result.stdout)['format']
+        return self._image_formats[path]
     
-    def create_vm(self, name, memory=2048, cpus=2, disk_size=20):
+    def create_vm(self, name, memory=2048, cpus=2, disk_size=20, base_image=None,
+                  profile=None, disk_profile=None, boot_profile=None):
         """Create a new VM configuration"""
         
-        if name in self.config['vms']:
+        if name in self.inventory:
             print(f"VM '{name}' already exists")
             return False
+        try:
+            self.disk_profile(disk_profile)
+            self.boot_profile(boot_profile)
+        except ValueError as e:
+            print(e)
+            return False
+        
+        if not self.inventory.addresses_left():
+            print("No free addresses; add ranges under addressing in vms.yaml")
+            return False
+        
+        cached = None
+        if profile:
+            cached = self.cached_image(profile)
+            if cached is None:
+                return False
+            base_image = cached['disk']
         
         # Create disk
-        disk_path = self.create_disk(name, disk_size)
+        disk_path, created = self.create_disk(name, disk_size, base_image,
+                                              disk_profile=disk_profile)
+        
+        # Create VM configuration (ports, MAC and IP are allocated by the inventory)
+        vm_config = self.new_vm_config(name, memory, cpus, disk_path, None)
+        vm_config['disk_size'] = disk_size
+        if disk_profile:
+            vm_config['disk_profile'] = disk_profile
+        if boot_profile:
+            vm_config['boot_profile'] = boot_profile
+        if base_image:
+            vm_config['base_image'] = str(Path(base_image).resolve())
+        if cached:
+            self.apply_cached_image(vm_config, cached)
+        
+        try:
+            self.inventory.add(vm_config)
+        except ValueError as e:
+            print(e)
+            # Only remove a disk this call made: an existing one may be
+            # another create's, or reused on purpose
+            if created:
+                Path(disk_path).unlink(missing_ok=True)
+            return False
+        self.sync_dhcp()
+        
+        print(f"VM '{name}' created successfully")
+        print(f"  Memory: {memory}MB")
+        print(f"  CPUs: {cpus}")
+        print(f"  Disk: {disk_path}")
+        print(f"  MAC: {vm_config['mac']}")
+        print(f"  IP: {vm_config['ip']}")
+        print(f"  VNC: :{vm_config['vnc_port']}")
         
-        # Create VM configuration
-        vm_config = {
+        return True
+    
+    def new_vm_config(self, name, memory, cpus, disk_path, mac):
+        """Build the inventory entry for a VM"""
+        return {
             'name': name,
             'memory': memory,
             'cpus': cpus,
             'disk': disk_path,
             'network': 'br0',
-            'mac': self.generate_mac(),
-            'vnc_port': self.get_next_vnc_port(),
-            'serial_port': self.get_next_serial_port(),
+            'mac': mac,
+            'vnc_port': None,
+            'serial_port': None,
             'state': 'stopped'
         }
+    
+    def create_vms(self, prefix, count, memory=2048, cpus=2, disk_size=20,
+                   base_image=None, workers=8, profile=None, disk_profile=None,
+                   boot_profile=None):
+        """
+        Create count VMs named <prefix>-001.. in one batch.
         
-        self.config['vms'][name] = vm_config
-        self.save_config()
+        MACs for the whole batch are allocated up front, disks are created in
+        a thread pool (qemu-img does the work), and the VMs and their ports
+        are committed to the inventory in one transaction at the end.
+        """
+        width = max(3, len(str(count)))
+        names = [f"{prefix}-{i:0{width}d}" for i in range(1, count + 1)]
+        existing = [n for n in names if n in self.inventory]
+        if existing:
+            print(f"Skipping existing VMs: {', '.join(existing)}")
+            names = [n for n in names if n not in self.inventory]
+        if not names:
+            return []
+        left = self.inventory.addresses_left()
+        if left < len(names):
+            print(f"Only {left} free addresses for {len(names)} VMs; "
+                  f"add ranges under addressing in vms.yaml")
+            return []
+        try:
+            self.disk_profile(disk_profile)
+            self.boot_profile(boot_profile)
+        except ValueError as e:
+            print(e)
+            return []
         
-        print(f"VM '{name}' created successfully")
-        print(f"  Memory: {memory}MB")
-        print(f"  CPUs: {cpus}")
-        print(f"  Disk: {disk_path}")
-        print(f"  MAC: {vm_config['mac']}")
-        print(f"  VNC: :{vm_config['vnc_port']}")
+        cached = None
+        if profile:
+            cached = self.cached_image(profile)
+            if cached is None:
+                return []
+            base_image = cached['disk']
+        
+        start = time.perf_counter()
+        print(f"Creating {len(names)} disks with {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.create_disk, n, disk_size, base_image, True,
+                                       disk_profile)
+                       for n in names]
+            disks = []
+            for name, future in zip(names, futures):
+                try:
+                    disks.append(future.result())
+                except subprocess.CalledProcessError as e:
+                    print(f"Failed to create disk for '{name}': {e.stderr or e}")
+                    disks.append((None, False))
+        
+        configs = []
+        created_disks = []
+        for name, (disk_path, created) in zip(names, disks):
+            if disk_path is None:
+                continue
+            if created:
+                created_disks.append(disk_path)
+            vm_config = self.new_vm_config(name, memory, cpus, disk_path, None)
+            vm_config['disk_size'] = disk_size
+            if disk_profile:
+                vm_config['disk_profile'] = disk_profile
+            if boot_profile:
+                vm_config['boot_profile'] = boot_profile
+            if base_image:
+                vm_config['base_image'] = str(Path(base_image).resolve())
+            if cached:
+                self.apply_cached_image(vm_config, cached)
+            configs.append(vm_config)
+        
+        try:
+            self.inventory.add_many(configs)
+        except ValueError as e:
+            print(e)
+            for disk_path in created_disks:
+                Path(disk_path).unlink(missing_ok=True)
+            return []
+        created = [c['name'] for c in configs]
+        # One hostsfile write and dnsmasq reload for the whole batch
+        self.sync_dhcp()
+        
+        elapsed = time.perf_counter() - start
+        print(f"Created {len(created)}/{len(names)} VMs in {elapsed:.2f}s")
+        if created:
+            print(f"  {created[0]} .. {created[-1]}")
+        return created
+    
+    def cached_image(self, profile):
+        """Usable cache entry for an install profile, or None with a hint"""
+        entry = self.image_cache.lookup(profile)
+        if entry is None:
+            print(f"No cached image for profile '{profile}'. "
+                  f"Install a VM over PXE, then run: cache capture --name <vm> --profile {profile}")
+        return entry
+    
+    def apply_cached_image(self, vm_config, entry):
+        """Point a new VM at a cache entry; with saved RAM it must match the capture"""
+        vm_config['profile'] = entry['profile']
+        if entry['state']:
+            # Resuming saved RAM needs the captured VM's device layout
+            source = self.inventory.get(entry['source_vm']) or {}
+            if source.get('disk_profile'):
+                vm_config['disk_profile'] = source['disk_profile']
+            vm_config['memory'] = entry['memory']
+            vm_config['cpus'] = entry['cpus']
+            vm_config['restore_state'] = entry['state']
+    
+    def cached_bases(self):
+        """Cache files VMs still depend on (overlay backing files, unused RAM captures)"""
+        return {path for vm in self.inventory.all()
+                for path in (vm.get('base_image'), vm.get('restore_state')) if path}
+    
+    def wait_for_migration(self, name, timeout=600):
+        """Wait for an outgoing migration (RAM state capture) to finish"""
+        socket_path = self.qmp_socket(name)
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.qmp.execute(socket_path, 'query-migrate').get('status')
+            if status == 'completed':
+                return
+            if status in ('failed', 'cancelled'):
+                raise QMPError(f"Migration {status}")
+            if time.monotonic() > deadline:
+                self.qmp.execute(socket_path, 'migrate_cancel')
+                raise QMPError(f"Migration did not finish within {timeout}s")
+            time.sleep(0.1)
+    
+    def capture_image(self, name, profile, with_state=False, timeout=600):
+        """
+        Save an installed VM's disk as the golden image for profile.
+        
+        The disk (with any backing chain flattened) is copied into the cache.
+        With with_state the VM must be running: it is paused, its RAM is
+        saved with a migration to file, and it is stopped afterwards, so new
+        VMs can resume already booted. Without it the VM must be shut down.
+        """
+        vm_config = self.inventory.get(name)
+        if vm_config is None:
+            print(f"VM '{name}' not found")
+            return False
+        
+        running = self.read_pid(name) is not None
+        if with_state and not running:
+            print(f"VM '{name}' must be running to capture its RAM state")
+            return False
+        if not with_state and running:
+            print(f"VM '{name}' is running. Shut it down first or capture with --with-state")
+            return False
+        
+        cache = self.image_cache
+        digest = profile_digest(cache.sources)
+        disk_path, state_path = cache.paths(profile, digest)
+        start = time.perf_counter()
         
+        try:
+            if with_state:
+                socket_path = self.qmp_socket(name)
+                print(f"Saving RAM state of '{name}'...")
+                self.qmp.execute(socket_path, 'stop')
+                self.qmp.execute(socket_path, 'migrate',
+                                 {'uri': f"exec:cat > {shlex.quote(str(state_path))}"})
+                self.wait_for_migration(name, timeout)
+            print(f"Copying disk of '{name}' into the cache...")
+            # -U: the paused source still has the image open
+            subprocess.run(['qemu-img', 'convert', '-U', '-O', 'qcow2',
+                            vm_config['disk'], str(disk_path)],
+                           check=True, capture_output=True, text=True)
+        except (QMPError, subprocess.CalledProcessError) as e:
+            cache.remove_partial(disk_path, state_path)
+            print(f"Failed to capture '{name}': {getattr(e, 'stderr', None) or e}")
+            if with_state:
+                try:
+                    self.qmp.execute(self.qmp_socket(name), 'cont')
+                except QMPError:
+                    pass
+            return False
+        
+        if with_state:
+            # A migrated-away source cannot safely resume writing its disk
+            self.stop_vm(name, force=True)
+        
+        entry = cache.add(profile, digest, disk_path, state_path if with_state else None,
+                          vm_config['memory'], vm_config['cpus'], name)
+        cache.evict(self.cached_bases())
+        print(f"Captured '{name}' as profile '{profile}' in "
+              f"{time.perf_counter() - start:.1f}s ({entry['size'] / 1024**3:.1f}GB)")
         return True
     
-    def build_qemu_command(self, vm_config, boot_mode='disk'):
-        """Build QEMU command line"""
+    def list_cached_images(self):
+        """Print and return the image cache entries"""
+        cache = self.image_cache
+        entries = cache.entries()
+        if not entries:
+            print("Image cache is empty")
+            return entries
+        print(f"{'Profile':<20} {'Size':<9} {'RAM':<5} {'Source VM':<15} {'Last used'}")
+        for e in entries:
+            last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(e['last_used']))
+            print(f"{e['profile']:<20} {e['size'] / 1024**3:>6.1f}GB "
+                  f"{'yes' if e['state'] else 'no':<5} {e['source_vm'] or '':<15} {last_used}")
+        print(f"Total: {cache.total_bytes() / 1024**3:.1f}GB of "
+              f"{cache.max_bytes / 1024**3:.0f}GB")
+        return entries
+    
+    def invalidate_cached_image(self, profile=None):
+        """Drop a profile's cached image (all profiles if None)"""
+        count = self.image_cache.invalidate(profile)
+        deleted = self.image_cache.evict(self.cached_bases())
+        print(f"Invalidated {count} cached image(s), deleted {len(deleted)} file(s)")
+        return count
+    
+    def evict_cached_images(self, max_gb=None):
+        """Trim the image cache to its size limit (or max_gb)"""
+        max_bytes = None if max_gb is None else int(max_gb * 1024**3)
+        deleted = self.image_cache.evict(self.cached_bases(), max_bytes)
+        print(f"Deleted {len(deleted)} cached file(s)")
+        return deleted
+    
+    def build_qemu_command(self, vm_config, boot_mode='disk', restore_state=None,
+                           placement=None, boot=None, paused=False):
+        """
+        Build QEMU command line. boot is a boot profile (default: the VM's
+        own); paused starts the guest stopped until a QMP 'cont'.
+        """
+        
+        boot = boot or self.boot_profile(vm_config.get('boot_profile'))
+        # microvm has no PCI bus or VGA: virtio-mmio devices and serial only
+        microvm = boot.get('machine') == 'microvm'
+        virtio = 'device' if microvm else 'pci'
         
         cmd = [
             'qemu-system-x86_64',
             '-name', vm_config['name'],
             '-m', str(vm_config['memory']),
             '-smp', str(vm_config['cpus']),
-            '-drive', f"file={vm_config['disk']},if=virtio,format=qcow2",
+            *(['-M', MICROVM_MACHINE, '-nodefaults', '-no-user-config', '-display', 'none']
+              if microvm else ['-vnc', f":{vm_config['vnc_port']}"]),
+            *drive_args(self.disk_profile(vm_config.get('disk_profile')), vm_config['disk'],
+                        vm_config['cpus'], vm_config.get('disk_size'), f'virtio-blk-{virtio}'),
             '-netdev', f"bridge,id=net0,br={vm_config['network']}",
-            '-device', f"virtio-net-pci,netdev=net0,mac={vm_config['mac']}",
-            '-vnc', f":{vm_config['vnc_port']}",
-            '-serial', f"telnet::{vm_config['serial_port']},server,nowait",
+            '-device', f"virtio-net-{virtio},id=nic0,netdev=net0,mac={vm_config['mac']}",
+            '-serial', (f"unix:{self.console_socket(vm_config['name'])},server,nowait"
+                        if self.unix_console else
+                        f"telnet::{vm_config['serial_port']},server,nowait"),
+            '-qmp', f"unix:{self.qmp_socket(vm_config['name'])},server,nowait",
             '-daemonize',
             '-pidfile', str(self.vm_dir / f"{vm_config['name']}.pid")
         ]
@@ -120,8 +647,12 @@ class VMManager:
         else:
             print("Warning: KVM not available, using software emulation")
         
+        if boot.get('kernel'):
+            # Load the netboot kernel/initrd straight from disk: no firmware
+            # boot menu, NIC option ROM, DHCP or TFTP round trips
+            cmd.extend(kernel_args(boot))
         # Boot order
-        if boot_mode == 'pxe':
+        elif boot_mode == 'pxe':
             cmd.extend(['-boot', 'order=nc'])  # Network, then disk
             print(f"VM will attempt PXE boot first")
         elif boot_mode == 'disk':
@@ -129,195 +660,937 @@ class VMManager:
         elif boot_mode == 'pxe-only':
             cmd.extend(['-boot', 'order=n'])  # Network only
         
+        if restore_state:
+            # Load saved RAM and stay paused until the NIC is swapped
+            cmd.extend(['-incoming', f"exec:cat {shlex.quote(restore_state)}", '-S'])
+        elif paused:
+            cmd.append('-S')
+        
+        if placement:
+            cmd.extend(qemu_memory_args(placement))
+        
+        density = self.density_settings
+        if density.get('enabled'):
+            # Let KSM merge guest RAM and give memory back through the balloon
+            balloon = f'virtio-balloon-{virtio},id=balloon0,deflate-on-oom=on'
+            if density.get('free_page_reporting', True):
+                balloon += ',free-page-reporting=on'
+            cmd.extend(['-machine', 'mem-merge=on', '-device', balloon])
+        
         return cmd
     
-    def start_vm(self, name, boot_mode='disk'):
-        """Start a VM"""
+    def finish_restore(self, name, vm_config, timeout=120):
+        """
+        Resume a VM started from saved RAM. The migration stream carries the
+        captured VM's MAC, so the NIC is unplugged and plugged back with this
+        VM's own MAC before the guest can use it.
+        """
+        socket_path = self.qmp_socket(name)
+        deadline = time.monotonic() + timeout
+        while self.qmp.execute(socket_path, 'query-status')['status'] == 'inmigrate':
+            if time.monotonic() > deadline:
+                raise QMPError(f"RAM state not loaded within {timeout}s")
+            time.sleep(0.05)
         
-        if name not in self.config['vms']:
+        self.qmp.execute(socket_path, 'set_link', {'name': 'nic0', 'up': False})
+        self.qmp.execute(socket_path, 'cont')
+        self.qmp.execute(socket_path, 'device_del', {'id': 'nic0'})
+        while any(p['name'] == 'nic0' for p in
+                  self.qmp.execute(socket_path, 'qom-list', {'path': '/machine/peripheral'})):
+            if time.monotonic() > deadline:
+                raise QMPError('Guest did not release the NIC')
+            time.sleep(0.05)
+        self.qmp.execute(socket_path, 'device_add', {
+            'driver': 'virtio-net-pci', 'id': 'nic0', 'netdev': 'net0',
+            'mac': vm_config['mac']})
+    
+    def running_placements(self):
+        """Placements of VMs that are running now"""
+        return {vm['name']: vm['placement'] for vm in self.inventory.all()
+                if vm.get('placement') and self.read_pid(vm['name'])}
+    
+    def place_vm(self, vm_config, wait=0):
+        """
+        Host CPUs and NUMA node for a VM about to start. Waits up to wait
+        seconds for running VMs to free enough room, then raises
+        PlacementError.
+        """
+        deadline = time.monotonic() + wait
+        # Hugepages can be neither merged nor ballooned
+        hugepages = (self.placement_settings.get('hugepages', False)
+                     and not self.density_settings.get('enabled'))
+        while True:
+            try:
+                return self.planner.plan(vm_config['cpus'], vm_config['memory'], hugepages,
+                                         self.running_placements().values())
+            except PlacementError:
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(1)
+    
+    def pin_vcpus(self, name, placement):
+        """Pin each vCPU thread of a started VM to its host CPU"""
+        threads = [(c['cpu-index'], c['thread-id'])
+                   for c in self.qmp.execute(self.qmp_socket(name), 'query-cpus-fast')]
+        try:
+            pin_threads(threads, placement)
+        except OSError as e:
+            print(f"Warning: could not pin vCPUs of '{name}': {e}")
+    
+    def host_placement(self):
+        """Host topology and the CPUs and memory each running VM holds"""
+        if self.planner is None:
+            return {'enabled': False}
+        placements = self.running_placements()
+        cpu_load, memory, hugepages = self.planner.usage(placements.values())
+        nodes = self.planner.topology.describe()
+        for node, info in nodes.items():
+            info['memory_used_mb'] = memory[node]
+            info['hugepages_used'] = hugepages[node]
+            info['vcpus'] = sum(cpu_load.get(c, 0) for c in self.planner.topology.cpus(node))
+        return {'enabled': True, 'nodes': nodes, 'vms': placements}
+    
+    def start_vm(self, name, boot_mode='disk', wait=0, boot_profile=None, paused=False):
+        """
+        Start a VM. With placement enabled it is pinned to host CPUs on one
+        NUMA node; if the host is full it waits up to wait seconds for room
+        and otherwise refuses to start. boot_profile overrides the VM's own
+        for this boot only.
+        """
+        
+        vm_config = self.inventory.get(name)
+        if vm_config is None:
             print(f"VM '{name}' not found")
             return False
-        
-        vm_config = self.config['vms'][name]
+        try:
+            boot = self.boot_profile(boot_profile or vm_config.get('boot_profile'))
+        except ValueError as e:
+            print(e)
+            return False
         
         # Check if already running
-        pid_file = self.vm_dir / f"{name}.pid"
-        if pid_file.exists():
+        pid = self.read_pid(name)
+        if pid is not None:
+            print(f"VM '{name}' is already running (PID: {pid})")
+            return False
+        
+        # First disk boot of a VM created from a RAM capture resumes it
+        # instead; the saved RAM only fits the firmware-booted PC machine
+        restore_state = (vm_config.get('restore_state')
+                         if boot_mode == 'disk' and not boot.get('kernel') and not paused
+                         else None)
+        
+        placement = None
+        if self.planner is not None:
             try:
-                with open(pid_file, 'r') as f:
-                    pid = int(f.read().strip())
-                if os.path.exists(f'/proc/{pid}'):
-                    print(f"VM '{name}' is already running (PID: {pid})")
-                    return False
-            except:
-                pass
+                placement = self.place_vm(vm_config, wait)
+            except PlacementError as e:
+                print(f"Not starting VM '{name}': {e}")
+                return False
         
         # Build and run QEMU command
-        cmd = self.build_qemu_command(vm_config, boot_mode)
+        try:
+            cmd = self.build_qemu_command(vm_config, boot_mode, restore_state, placement,
+                                          boot, paused)
+        except FileNotFoundError as e:
+            print(f"Not starting VM '{name}': {e}")
+            return False
         
         print(f"Starting VM '{name}'...")
         print(f"Command: {' '.join(cmd)}")
         
         try:
-            subprocess.run(cmd, check=True)
-            vm_config['state'] = 'running'
-            self.save_config()
+            if placement:
+                # QEMU's own threads stay on the VM's CPUs; vCPUs get one each below
+                cpus = set(placement['cpus'])
+                subprocess.run(cmd, check=True, preexec_fn=lambda: os.sched_setaffinity(0, cpus))
+                self.pin_vcpus(name, placement)
+            else:
+                subprocess.run(cmd, check=True)
+            if self._processes is not None:
+                self._processes.invalidate()
+            if restore_state:
+                print(f"Restoring '{name}' from saved RAM state...")
+                self.finish_restore(name, vm_config)
+                self.inventory.update(name, state='running', restore_state=None,
+                                      placement=placement)
+            else:
+                self.inventory.update(name, state='running', placement=placement)
+            if self.density_settings.get('enabled'):
+                self.poll_balloon_stats(name)
             
             print(f"VM '{name}' started successfully")
-            print(f"  VNC: localhost:{5900 + vm_config['vnc_port']}")
-            print(f"  Serial: telnet localhost {vm_config['serial_port']}")
+            if placement:
+                print(f"  Placement: NUMA node {placement['node']}, CPUs "
+                      f"{','.join(map(str, placement['cpus']))}"
+                      f"{', hugepages' if placement['hugepages'] else ''}")
+            if boot.get('machine') != 'microvm':
+                print(f"  VNC: localhost:{5900 + vm_config['vnc_port']}")
+            if self.unix_console:
+                print(f"  Serial: {self.console_socket(name)}")
+            else:
+                print(f"  Serial: telnet localhost {vm_config['serial_port']}")
             
             return True
         except subprocess.CalledProcessError as e:
             print(f"Failed to start VM: {e}")
             return False
+        except QMPError as e:
+            print(f"Failed to restore VM: {e}")
+            self.stop_vm(name, force=True)
+            return False
     
-    def stop_vm(self, name):
-        """Stop a VM"""
+    def stop_vm(self, name, timeout=30, force=False):
+        """
+        Stop a VM: ACPI power-down over QMP, then quit/SIGTERM and finally
+        SIGKILL if it has not exited within timeout seconds
+        """
         
-        if name not in self.config['vms']:
+        if name not in self.inventory:
             print(f"VM '{name}' not found")
             return False
         
-        pid_file = self.vm_dir / f"{name}.pid"
-        
-        if not pid_file.exists():
+        pid = self.read_pid(name)
+        if pid is None:
             print(f"VM '{name}' is not running")
+            self.cleanup_runtime_files(name)
+            self.inventory.update(name, state='stopped', placement=None)
             return False
         
-        try:
-            with open(pid_file, 'r') as f:
-                pid = int(f.read().strip())
-            
+        socket_path = self.qmp_socket(name)
+        exited = False
+        if not force:
+            print(f"Shutting down VM '{name}' (PID: {pid})...")
+            try:
+                self.qmp.execute(socket_path, 'system_powerdown')
+                exited = wait_for_exit(pid, timeout)
+                if not exited:
+                    print(f"VM '{name}' did not power down within {timeout}s")
+            except QMPError as e:
+                print(f"Graceful shutdown unavailable: {e}")
+        
+        if not exited:
             print(f"Stopping VM '{name}' (PID: {pid})...")
-            os.kill(pid, 15)  # SIGTERM
-            
-            pid_file.unlink()
-            
-            vm_config = self.config['vms'][name]
-            vm_config['state'] = 'stopped'
-            self.save_config()
-            
-            print(f"VM '{name}' stopped")
-            return True
-        except Exception as e:
-            print(f"Failed to stop VM: {e}")
+            try:
+                self.qmp.execute(socket_path, 'quit')
+            except QMPError:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            exited = wait_for_exit(pid, 5)
+        
+        if not exited:
+            print(f"Killing VM '{name}' (PID: {pid})")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            wait_for_exit(pid, 5)
+        
+        self.cleanup_runtime_files(name)
+        self.inventory.update(name, state='stopped', placement=None)
+        
+        print(f"VM '{name}' stopped")
+        return True
+    
+    def stop_vms(self, names=None, timeout=30, force=False):
+        """
+        Stop many VMs (default: all) together. Every VM gets its ACPI
+        power-down at once and one wait covers all QEMU processes, with a
+        shared timeout; the ones still running then get quit/SIGTERM and
+        finally SIGKILL the same way. Takes about as long as the slowest
+        VM rather than the sum.
+        
+        Returns {name: {'pid', 'stopped_by', 'seconds'}}. stopped_by is
+        powerdown, quit, kill, 'not running', or None if even SIGKILL did
+        not end the process.
+        """
+        names = self.inventory.names() if names is None else names
+        start = time.monotonic()
+        results = {}
+        pending = {}
+        for name in names:
+            if name not in self.inventory:
+                print(f"VM '{name}' not found")
+                continue
+            pid = self.read_pid(name)
+            if pid is None:
+                results[name] = {'pid': None, 'stopped_by': 'not running', 'seconds': 0.0}
+            else:
+                pending[name] = pid
+        
+        def wait(candidates, wait_timeout, step):
+            exited = wait_for_exits(candidates.values(), wait_timeout)
+            for name, pid in candidates.items():
+                if pid in exited:
+                    results[name] = {'pid': pid, 'stopped_by': step,
+                                     'seconds': round(exited[pid] - start, 3)}
+                    del pending[name]
+        
+        def send(command):
+            """QMP command to every pending VM; the names it could not reach"""
+            replies = self.qmp.execute_many(
+                [(self.qmp_socket(name), command, None) for name in pending])
+            return [name for name, reply in zip(list(pending), replies)
+                    if isinstance(reply, QMPError)]
+        
+        if pending:
+            print(f"Stopping {len(pending)} VMs...")
+        if pending and not force:
+            unreachable = send('system_powerdown')
+            wait({n: p for n, p in pending.items() if n not in unreachable}, timeout, 'powerdown')
+        if pending:
+            for name in send('quit'):
+                try:
+                    os.kill(pending[name], signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            wait(dict(pending), 5, 'quit')
+        if pending:
+            for pid in pending.values():
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            wait(dict(pending), 5, 'kill')
+        for name, pid in pending.items():
+            results[name] = {'pid': pid, 'stopped_by': None,
+                             'seconds': round(time.monotonic() - start, 3)}
+        
+        stopped = [n for n, r in results.items() if r['stopped_by'] is not None]
+        for name in stopped:
+            self.cleanup_runtime_files(name)
+        with self.inventory.transaction():
+            for name in stopped:
+                self.inventory.update(name, state='stopped', placement=None)
+        
+        ran = {n: r for n, r in results.items() if r['pid'] is not None}
+        if ran:
+            print(f"{'Name':<20} {'PID':>8} {'Stopped by':<11} {'Seconds':>8}")
+            for name, result in sorted(ran.items(), key=lambda item: item[1]['seconds']):
+                print(f"{name:<20} {result['pid']:>8} {result['stopped_by'] or 'STILL RUNNING':<11} "
+                      f"{result['seconds']:>8.2f}")
+        print(f"Stopped {sum(1 for r in ran.values() if r['stopped_by'])} VMs in "
+              f"{time.monotonic() - start:.2f}s"
+              + (f"; {len(results) - len(ran)} were not running" if len(results) > len(ran) else ''))
+        return results
+    
+    def cleanup_runtime_files(self, name):
+        """Forget the QMP connection and remove pidfile/sockets of a stopped VM"""
+        if self._qmp is not None:
+            self._qmp.drop(self.qmp_socket(name))
+        (self.vm_dir / f"{name}.pid").unlink(missing_ok=True)
+        self.qmp_socket(name).unlink(missing_ok=True)
+        self.console_socket(name).unlink(missing_ok=True)
+        if self._processes is not None:
+            self._processes.invalidate()
+    
+    def vm_statuses(self, names):
+        """
+        Live state of VMs: query-status over each VM's QMP connection,
+        falling back to the pidfile when the monitor is unreachable.
+        """
+        pids = {name: self.read_pid(name) for name in names}
+        running = [name for name in names if pids[name]]
+        replies = self.qmp.execute_many(
+            [(self.qmp_socket(name), 'query-status', None) for name in running])
+        replies = dict(zip(running, replies))
+        
+        statuses = {}
+        for name in names:
+            reply = replies.get(name)
+            if pids[name] is None:
+                state = 'stopped'
+            elif isinstance(reply, dict):
+                state = 'running' if reply.get('running') else reply.get('status', 'unknown')
+            else:
+                state = 'unresponsive'
+            statuses[name] = {'name': name, 'state': state, 'pid': pids[name]}
+        return statuses
+    
+    def vm_status(self, name):
+        return self.vm_statuses([name])[name]
+    
+    def reset_vm(self, name):
+        """Hard-reset a running VM"""
+        try:
+            self.qmp.execute(self.qmp_socket(name), 'system_reset')
+        except QMPError as e:
+            print(f"Failed to reset VM '{name}': {e}")
             return False
+        print(f"VM '{name}' reset")
+        return True
+    
+    def powerdown_vm(self, name):
+        """
+        Send the ACPI power button press and return without waiting; the
+        caller watches vm_status and follows up with stop_vm (force)
+        """
+        try:
+            self.qmp.execute(self.qmp_socket(name), 'system_powerdown')
+        except QMPError as e:
+            print(f"Failed to power down VM '{name}': {e}")
+            return False
+        print(f"VM '{name}' powering down")
+        return True
+    
+    def measure_boot(self, name, boot_profiles=None, runs=3, boot_mode='disk',
+                     pattern=None, timeout=60):
+        """
+        Time cold boots of a stopped VM under each boot profile: seconds from
+        launching QEMU to the first byte on the serial console, and to the
+        first match of pattern (a regex, e.g. 'login:') if given.
+        
+        QEMU starts paused so the console is attached before the guest runs
+        and no early output is lost; the VM is killed after each run.
+        """
+        if name not in self.inventory:
+            print(f"VM '{name}' not found")
+            return None
+        if self.read_pid(name) is not None:
+            print(f"VM '{name}' must be stopped to measure boots")
+            return None
+        
+        vm_config = self.inventory.get(name)
+        if self.unix_console:
+            address = self.console_socket(name)
+        else:
+            address = ('127.0.0.1', vm_config['serial_port'])
+        regex = pattern.encode() if pattern else None
+        
+        results = {}
+        for profile in boot_profiles or [vm_config.get('boot_profile')
+                                         or self.config.get('boot_profile', DEFAULT_BOOT_PROFILE)]:
+            samples = []
+            for _ in range(runs):
+                start = time.monotonic()
+                if not self.start_vm(name, boot_mode, boot_profile=profile, paused=True):
+                    break
+                try:
+                    sock = connect_serial(address)
+                    try:
+                        self.qmp.execute(self.qmp_socket(name), 'cont')
+                        samples.append(wait_for_output(sock, start, timeout, regex))
+                    finally:
+                        sock.close()
+                finally:
+                    self.stop_vm(name, force=True)
+            first = [s[0] for s in samples if s[0] is not None]
+            matched = [s[1] for s in samples if s[1] is not None]
+            results[profile] = {
+                'runs': len(samples),
+                'first_output_s': round(sorted(first)[len(first) // 2], 3) if first else None,
+                'pattern_s': round(sorted(matched)[len(matched) // 2], 3) if matched else None,
+            }
+        
+        print(f"{'Profile':<15} {'Runs':>4} {'First output':>13} {'Pattern':>9}")
+        for profile, result in results.items():
+            first = f"{result['first_output_s']:.3f}s" if result['first_output_s'] is not None else '-'
+            matched = f"{result['pattern_s']:.3f}s" if result['pattern_s'] is not None else '-'
+            print(f"{profile:<15} {result['runs']:>4} {first:>13} {matched:>9}")
+        return results
     
-    def list_vms(self):
-        """List all VMs"""
+    def vm_stats(self, name):
+        """Block device and vCPU statistics from QMP"""
+        socket_path = self.qmp_socket(name)
+        blockstats, cpus = self.qmp.execute_many([
+            (socket_path, 'query-blockstats', None),
+            (socket_path, 'query-cpus-fast', None),
+        ])
+        for reply in (blockstats, cpus):
+            if isinstance(reply, Exception):
+                raise QMPError(str(reply))
+        return {
+            'block': [{'device': b.get('device') or b.get('qdev'), **b['stats']}
+                      for b in blockstats],
+            'cpus': [{'cpu': c['cpu-index'], 'thread_id': c['thread-id']}
+                     for c in cpus],
+        }
+    
+    def poll_balloon_stats(self, name):
+        """Ask the guest's balloon driver to report memory statistics"""
+        try:
+            self.qmp.execute(self.qmp_socket(name), 'qom-set', {
+                'path': '/machine/peripheral/balloon0',
+                'property': 'guest-stats-polling-interval',
+                'value': self.density_settings.get('interval', 5)})
+        except QMPError as e:
+            print(f"Warning: no balloon statistics for '{name}': {e}")
+    
+    def balance_memory(self):
+        """
+        One pass of the density controller: size every running VM's balloon
+        to what its guest uses plus some headroom, reclaiming harder while
+        host MemAvailable is below host_low_mb. Returns the resized VMs.
+        """
+        settings = self.density_settings
+        if not settings.get('enabled'):
+            return {}
+        if settings.get('ksm', True) and not self._ksm_checked:
+            self._ksm_checked = True
+            stats = ksm_stats()
+            if stats is not None and not stats['run'] and not enable_ksm():
+                print("Warning: KSM is off and could not be enabled (needs root)")
+        
+        host_pressure = meminfo().get('MemAvailable', 0) < settings.get('host_low_mb', 2048)
+        vms = {vm['name']: vm for vm in self.inventory.all() if self.read_pid(vm['name'])}
+        requests = []
+        for name in vms:
+            socket_path = self.qmp_socket(name)
+            requests.append((socket_path, 'query-balloon', None))
+            requests.append((socket_path, 'qom-get', {'path': '/machine/peripheral/balloon0',
+                                                      'property': 'guest-stats'}))
+        replies = self.qmp.execute_many(requests)
+        
+        resized = {}
+        for i, (name, vm) in enumerate(vms.items()):
+            balloon, stats = replies[2 * i], replies[2 * i + 1]
+            if isinstance(balloon, Exception) or isinstance(stats, Exception):
+                continue    # not a density VM or not answering
+            usage = guest_memory(stats)
+            if usage is None:
+                self.poll_balloon_stats(name)
+                continue
+            actual_mb = balloon['actual'] // (1024 * 1024)
+            target = balloon_target(vm['memory'], actual_mb, usage['used_mb'], settings,
+                                    host_pressure)
+            if target is None:
+                continue
+            try:
+                self.qmp.execute(self.qmp_socket(name), 'balloon',
+                                 {'value': target * 1024 * 1024})
+            except QMPError as e:
+                print(f"Failed to resize balloon of '{name}': {e}")
+                continue
+            print(f"{name}: {actual_mb} -> {target} MB (guest uses {usage['used_mb']} MB)")
+            resized[name] = target
+        return resized
+    
+    def density_report(self):
+        """
+        Memory promised to running VMs against what the host has and what
+        the VMs really occupy, with KSM savings and per-VM balloon sizes
+        """
+        host = meminfo()
+        ksm = ksm_stats()
+        vms = {vm['name']: vm for vm in self.inventory.all() if self.read_pid(vm['name'])}
+        replies = self.qmp.execute_many(
+            [(self.qmp_socket(name), 'query-balloon', None) for name in vms])
+        report = {}
+        for (name, vm), balloon in zip(vms.items(), replies):
+            report[name] = {
+                'memory_mb': vm['memory'],
+                'balloon_mb': (None if isinstance(balloon, Exception)
+                               else balloon['actual'] // (1024 * 1024)),
+                'rss_mb': process_rss_mb(self.read_pid(name)),
+            }
+        committed = sum(vm['memory_mb'] for vm in report.values())
+        saved = ksm['saved_mb'] if ksm else 0
+        resident = max(sum(vm['rss_mb'] for vm in report.values()) - saved, 1)
+        return {
+            'host_memory_mb': host.get('MemTotal', 0),
+            'host_available_mb': host.get('MemAvailable', 0),
+            'committed_mb': committed,
+            'resident_mb': resident,
+            'ksm_saved_mb': saved,
+            'ksm_running': bool(ksm and ksm['run']),
+            # Guest memory per MB of host RAM, and per MB the VMs really hold
+            'overcommit_ratio': round(committed / max(host.get('MemTotal', 0), 1), 2),
+            'effective_ratio': round(committed / resident, 2) if report else 0,
+            'vms': report,
+        }
+    
+    def vm_names(self):
+        """VM names in creation order"""
+        return self.inventory.names()
+    
+    def fleet_status(self, names=None, max_age=None):
+        """
+        Status of VMs (default: all) as dicts for scripts and dashboards:
+        inventory settings plus state, PID, CPU and RSS from the cached
+        /proc scan. No QMP round trips, so thousands of VMs take
+        milliseconds; max_age overrides the cache TTL (0 forces a rescan).
+        """
+        processes = self.processes.scan(max_age)
+        version = self.inventory.version()
+        # Rebuilt only after a rescan or an inventory change
+        cached = self._statuses
+        if cached is None or cached[0] is not processes or cached[1] != version:
+            cached = self._statuses = (processes, version, self._build_statuses(processes))
+        statuses = cached[2]
+        if names is None:
+            return list(statuses)
+        wanted = set(names)
+        return [status for status in statuses if status['name'] in wanted]
+    
+    def _build_statuses(self, processes):
+        """fleet_status rows for every inventory VM"""
+        disk_default = self.config.get('disk_profile', DEFAULT_PROFILE)
+        boot_default = self.config.get('boot_profile', DEFAULT_BOOT_PROFILE)
+        statuses = []
+        for vm in self.inventory.all():
+            process = processes.get(vm['name'], {})
+            statuses.append({
+                'name': vm['name'],
+                'state': 'running' if process else 'stopped',
+                'pid': process.get('pid'),
+                'memory': vm['memory'],
+                'cpus': vm['cpus'],
+                'mac': vm.get('mac'),
+                'ip': vm.get('ip'),
+                'vnc_port': 5900 + vm['vnc_port'],
+                'serial_port': vm['serial_port'],
+                'disk_profile': vm.get('disk_profile') or disk_default,
+                'boot_profile': vm.get('boot_profile') or boot_default,
+                'cpu_seconds': process.get('cpu_seconds'),
+                'cpu_percent': process.get('cpu_percent'),
+                'rss_mb': process.get('rss_mb'),
+                'uptime_s': process.get('uptime_s'),
+            })
+        return statuses
+    
+    def list_vms(self, names_only=False, output='table'):
+        """List all VMs as a table, JSON, or one JSON object per line (ndjson)"""
         
-        if not self.config['vms']:
+        if names_only:
+            for name in self.inventory.names():
+                print(name)
+            return
+        
+        statuses = self.fleet_status()
+        if output == 'json':
+            print(json.dumps(statuses, indent=2))
+            return
+        if output == 'ndjson':
+            for status in statuses:
+                print(json.dumps(status))
+            return
+        
+        if not statuses:
             print("No VMs configured")
             return
         
         print("\nConfigured VMs:")
-        print("-" * 80)
-        print(f"{'Name':<15} {'State':<10} {'Memory':<10} {'CPUs':<6} {'MAC Address':<18}")
-        print("-" * 80)
-        
-        for name, vm in self.config['vms'].items():
-            # Check actual running state
-            pid_file = self.vm_dir / f"{name}.pid"
-            state = 'running' if pid_file.exists() else 'stopped'
-            
-            print(f"{name:<15} {state:<10} {vm['memory']:<10} {vm['cpus']:<6} {vm['mac']:<18}")
+        print("-" * 96)
+        print(f"{'Name':<15} {'State':<10} {'Memory':<10} {'CPUs':<6} {'MAC Address':<18} {'IP':<15} "
+              f"{'CPU%':>6} {'RSS MB':>8}")
+        print("-" * 96)
+        
+        for vm in statuses:
+            cpu = f"{vm['cpu_percent']:.1f}" if vm['pid'] else '-'
+            rss = vm['rss_mb'] if vm['pid'] else '-'
+            print(f"{vm['name']:<15} {vm['state']:<10} {vm['memory']:<10} {vm['cpus']:<6} "
+                  f"{vm['mac'] or '-':<18} {vm['ip'] or '-':<15} {cpu:>6} {rss:>8}")
     
-    def delete_vm(self, name, force=False):
+    def delete_vm(self, name, force=False, timeout=30):
         """Delete a VM and its disk"""
-        if name not in self.config['vms']:
+        if name not in self.inventory:
             print(f"VM '{name}' not found")
             return False
+        return name in self.delete_vms([name], force, timeout)
+    
+    def delete_vms(self, names=None, force=False, timeout=30):
+        """
+        Delete VMs (default: all) and their disks. Running VMs are refused
+        unless force, which stops them all together first (stop_vms) and
+        only deletes those whose QEMU has exited. Disks are unlinked in
+        parallel and the inventory entries removed in one transaction.
+        Returns {name: seconds until deleted}.
+        """
+        start = time.monotonic()
+        names = self.inventory.names() if names is None else names
+        missing = [n for n in names if n not in self.inventory]
+        for name in missing:
+            print(f"VM '{name}' not found")
+        names = [n for n in names if n not in missing]
         
-        # Check if running
-        pid_file = self.vm_dir / f"{name}.pid"
-        if pid_file.exists():
-            if not force:
-                print(f"VM '{name}' is running. Stop it first or use --force")
-                return False
-            else:
-                print(f"Force stopping VM '{name}'...")
-                self.stop_vm(name)
-        
-        # Remove disk image
-        disk_path = self.vm_dir / f"{name}.qcow2"
-        if disk_path.exists():
-            print(f"Deleting disk: {disk_path}")
-            disk_path.unlink()
+        running = [n for n in names if self.read_pid(n) is not None]
+        if running and not force:
+            print(f"Running, stop first or use --force: {', '.join(running)}")
+            names = [n for n in names if n not in running]
+        elif running:
+            stuck = [n for n, r in self.stop_vms(running, timeout).items() if r['stopped_by'] is None]
+            if stuck:
+                print(f"Not deleting VMs whose QEMU is still running: {', '.join(stuck)}")
+                names = [n for n in names if n not in stuck]
+        if not names:
+            return {}
         
-        # Remove from config
-        del self.config['vms'][name]
-        self.save_config()
+        vm_configs = [self.inventory.get(n) for n in names]
+        for name in names:
+            self.cleanup_runtime_files(name)
+        # Unlinking big qcow2 files can block on the filesystem, so in parallel
+        with ThreadPoolExecutor(max_workers=min(16, len(names))) as executor:
+            list(executor.map(lambda n: (self.vm_dir / f"{n}.qcow2").unlink(missing_ok=True), names))
+        self.inventory.remove_many(names)
+        self.sync_dhcp()
+        if any(vm.get('profile') for vm in vm_configs):
+            # Their bases may be retired cache images waiting for their last user
+            self.image_cache.evict(self.cached_bases())
         
-        print(f"VM '{name}' deleted successfully")
-        return True
+        elapsed = round(time.monotonic() - start, 3)
+        if len(names) == 1:
+            print(f"VM '{names[0]}' deleted successfully")
+        else:
+            print(f"Deleted {len(names)} VMs in {elapsed:.2f}s")
+        return {name: elapsed for name in names}
     
-    def generate_mac(self):
-        """Generate a MAC address"""
-        import random
-        mac = [0x52, 0x54, 0x00,
-               random.randint(0x00, 0xff),
-               random.randint(0x00, 0xff),
-               random.randint(0x00, 0xff)]
-        return ':'.join(f'{b:02x}' for b in mac)
-    
-    def get_next_vnc_port(self):
-        """Get next available VNC port"""
-        used_ports = [vm.get('vnc_port', 0) for vm in self.config['vms'].values()]
-        return max(used_ports, default=0) + 1
-    
-    def get_next_serial_port(self):
-        """Get next available serial port"""
-        used_ports = [vm.get('serial_port', 5000) for vm in self.config['vms'].values()]
-        return max(used_ports, default=5000) + 1
+    def sync_dhcp(self, reload=True):
+        """
+        Write a static DHCP reservation for every VM to the dnsmasq
+        hostsfile, giving addresses to VMs created before the allocator
+        first, and have dnsmasq reread it (no restart) if it changed
+        """
+        assigned = self.inventory.assign_addresses()
+        if assigned:
+            print(f"Assigned addresses to {len(assigned)} existing VMs")
+        path = self.address_settings.get('hostsfile', DEFAULT_HOSTSFILE)
+        vms = self.inventory.all()
+        changed = write_hostsfile(vms, path)
+        reloaded = changed and reload and reload_dnsmasq(self.address_settings.get('reload_command'))
+        return {'reservations': sum(1 for vm in vms if vm.get('ip')), 'hostsfile': path,
+                'changed': changed, 'reloaded': bool(reloaded)}
+
+
+def call_manager(method, params, use_daemon=True, socket_path=DEFAULT_SOCKET):
+    """Run a VMManager method in the daemon if one is running, else in-process"""
+    if use_daemon:
+        client = VMDaemonClient(socket_path)
+        if client.available():
+            try:
+                return client.call(method, **params)
+            finally:
+                client.close()
+    return getattr(VMManager(), method)(**params)
+
+
+def run_density_controller(args):
+    """Call balance_memory every interval, in the daemon when one is running"""
+    manager = VMManager()
+    settings = manager.density_settings
+    if not settings.get('enabled'):
+        print("Density mode is off (density.enabled in config/vms.yaml)")
+        return
+    client = None if args.no_daemon else VMDaemonClient(args.socket)
+    if client is not None and client.available():
+        balance = lambda: client.call('balance_memory')
+    else:
+        balance = manager.balance_memory
+    interval = args.interval or settings.get('interval', 5)
+    print(f"Balancing guest memory every {interval}s")
+    try:
+        while True:
+            try:
+                balance()
+            except (QMPError, DaemonError) as e:
+                print(f"Balance pass failed: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
     parser = argparse.ArgumentParser(description='VM Manager for BMC Emulator')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Daemon socket path')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Run in this process even if a daemon is running')
     subparsers = parser.add_subparsers(dest='command', help='Commands')
     
+    # Daemon
+    subparsers.add_parser('daemon', help='Serve VM operations on a Unix socket')
+    
     # Create VM
     create_parser = subparsers.add_parser('create', help='Create a new VM')
-    create_parser.add_argument('--name', required=True, help='VM name')
+    create_parser.add_argument('--name', required=True, help='VM name (name prefix with --count)')
     create_parser.add_argument('--memory', type=int, default=2048, help='Memory in MB')
     create_parser.add_argument('--cpus', type=int, default=2, help='Number of CPUs')
     create_parser.add_argument('--disk', type=int, default=20, help='Disk size in GB')
+    create_parser.add_argument('--count', type=int, help='Create a batch of VMs named <name>-001..')
+    create_parser.add_argument('--from-base', metavar='IMAGE',
+                               help='Create disks as copy-on-write overlays of IMAGE')
+    create_parser.add_argument('--workers', type=int, default=8,
+                               help='Parallel disk creations for --count')
+    create_parser.add_argument('--profile',
+                               help='Create from the cached golden image of an install profile')
+    create_parser.add_argument('--disk-profile',
+                               help='Disk I/O profile (see disk-profiles; default from vms.yaml)')
+    create_parser.add_argument('--boot-profile',
+                               help='Boot profile (see boot-profiles; default from vms.yaml)')
     
     # Start VM
     start_parser = subparsers.add_parser('start', help='Start a VM')
     start_parser.add_argument('--name', required=True, help='VM name')
     start_parser.add_argument('--boot', choices=['disk', 'pxe', 'pxe-only'], 
                              default='disk', help='Boot mode')
+    start_parser.add_argument('--wait', type=int, default=0,
+                              help='Seconds to wait for host CPUs/memory when placement is on')
+    start_parser.add_argument('--boot-profile', help="Boot profile for this boot (default: the VM's)")
     
     # Stop VM
-    stop_parser = subparsers.add_parser('stop', help='Stop a VM')
-    stop_parser.add_argument('--name', required=True, help='VM name')
+    stop_parser = subparsers.add_parser('stop', help='Stop VMs')
+    stop_target = stop_parser.add_mutually_exclusive_group(required=True)
+    stop_target.add_argument('--name', nargs='+', help='VM name(s)')
+    stop_target.add_argument('--all', action='store_true', help='Every VM in the inventory')
+    stop_parser.add_argument('--timeout', type=int, default=30,
+                             help='Seconds to wait for ACPI power-down before forcing')
+    stop_parser.add_argument('--force', action='store_true', help='Skip graceful power-down')
+    
+    # Status / reset / stats over QMP
+    status_parser = subparsers.add_parser('status', help='Show live VM state')
+    status_parser.add_argument('--name', required=True, help='VM name')
+    reset_parser = subparsers.add_parser('reset', help='Hard-reset a VM')
+    reset_parser.add_argument('--name', required=True, help='VM name')
+    stats_parser = subparsers.add_parser('stats', help='Show block and vCPU statistics')
+    stats_parser.add_argument('--name', required=True, help='VM name')
+    
+    subparsers.add_parser('placement', help='Show host topology and VM placements')
+    
+    # Memory density
+    density_parser = subparsers.add_parser('density', help='Balloon/KSM memory overcommit')
+    density_subparsers = density_parser.add_subparsers(dest='density_command')
+    run_parser = density_subparsers.add_parser('run', help='Keep resizing balloons')
+    run_parser.add_argument('--interval', type=float, help='Seconds between passes')
+    density_subparsers.add_parser('report', help='Show the overcommit ratio and KSM savings')
+    
+    subparsers.add_parser('disk-profiles', help='List disk I/O profiles')
+    subparsers.add_parser('boot-profiles', help='List boot profiles')
+    
+    # Static DHCP reservations
+    dhcp_parser = subparsers.add_parser('dhcp', help='Rewrite the dnsmasq hostsfile from the inventory')
+    dhcp_parser.add_argument('--no-reload', action='store_true', help='Do not signal dnsmasq')
+    
+    # Boot timing
+    boot_bench_parser = subparsers.add_parser('boot-bench',
+                                              help='Time to first serial output per boot profile')
+    boot_bench_parser.add_argument('--name', required=True, help='VM name (must be stopped)')
+    boot_bench_parser.add_argument('--boot-profiles', nargs='+', help="Profiles (default: the VM's)")
+    boot_bench_parser.add_argument('--runs', type=int, default=3, help='Boots per profile')
+    boot_bench_parser.add_argument('--boot', choices=['disk', 'pxe', 'pxe-only'], default='disk',
+                                   help='Boot mode for firmware profiles')
+    boot_bench_parser.add_argument('--pattern', help="Also time the first match, e.g. 'login:'")
+    boot_bench_parser.add_argument('--timeout', type=float, default=60, help='Seconds per boot')
     
     # List VMs
     list_parser = subparsers.add_parser('list', help='List all VMs')
+    list_parser.add_argument('--names', action='store_true', help='Print VM names only')
+    list_parser.add_argument('--format', choices=['table', 'json', 'ndjson'], default='table',
+                             help='Output format (json/ndjson for scripts)')
+    
+    # Export / import inventory in vms.yaml format
+    export_parser = subparsers.add_parser('export', help='Write inventory as YAML')
+    export_parser.add_argument('--output', help='Output file (default: config/vms.yaml)')
+    import_parser = subparsers.add_parser('import', help='Add VMs from a YAML file')
+    import_parser.add_argument('--input', required=True, help='vms.yaml-format file')
+    
+    # Golden-image cache
+    cache_parser = subparsers.add_parser('cache', help='Manage cached golden images')
+    cache_subparsers = cache_parser.add_subparsers(dest='cache_command')
+    capture_parser = cache_subparsers.add_parser('capture', help='Capture an installed VM')
+    capture_parser.add_argument('--name', required=True, help='VM name')
+    capture_parser.add_argument('--profile', required=True, help='Install profile name')
+    capture_parser.add_argument('--with-state', action='store_true',
+                                help='Also save RAM so new VMs resume already booted')
+    cache_subparsers.add_parser('list', help='List cached images')
+    invalidate_parser = cache_subparsers.add_parser('invalidate', help='Drop cached images')
+    invalidate_parser.add_argument('--profile', help='Profile to drop (default: all)')
+    evict_parser = cache_subparsers.add_parser('evict', help='Trim the cache to its size limit')
+    evict_parser.add_argument('--max-gb', type=float, help='Override the size limit')
     
     # Delete VM
-    delete_parser = subparsers.add_parser('delete', help='Delete a VM')
-    delete_parser.add_argument('--name', required=True, help='VM name')
-    delete_parser.add_argument('--force', action='store_true', help='Force delete even if running')
+    delete_parser = subparsers.add_parser('delete', help='Delete VMs')
+    delete_target = delete_parser.add_mutually_exclusive_group(required=True)
+    delete_target.add_argument('--name', nargs='+', help='VM name(s)')
+    delete_target.add_argument('--all', action='store_true', help='Every VM in the inventory')
+    delete_parser.add_argument('--force', action='store_true', help='Stop running VMs first')
+    delete_parser.add_argument('--timeout', type=int, default=30,
+                               help='Seconds to wait for ACPI power-down with --force')
     
     args = parser.parse_args()
     
-    manager = VMManager()
+    if args.command == 'daemon':
+        VMDaemon(VMManager(), args.socket).serve_forever()
+        return
     
     if args.command == 'create':
-        manager.create_vm(args.name, args.memory, args.cpus, args.disk)
+        if args.count:
+            call = ('create_vms', {'prefix': args.name, 'count': args.count,
+                                   'memory': args.memory, 'cpus': args.cpus,
+                                   'disk_size': args.disk, 'base_image': args.from_base,
+                                   'workers': args.workers, 'profile': args.profile,
+                                   'disk_profile': args.disk_profile,
+                                   'boot_profile': args.boot_profile})
+        else:
+            call = ('create_vm', {'name': args.name, 'memory': args.memory, 'cpus': args.cpus,
+                                  'disk_size': args.disk, 'base_image': args.from_base,
+                                  'profile': args.profile, 'disk_profile': args.disk_profile,
+                                  'boot_profile': args.boot_profile})
     elif args.command == 'start':
-        manager.start_vm(args.name, args.boot)
+        call = ('start_vm', {'name': args.name, 'boot_mode': args.boot, 'wait': args.wait,
+                             'boot_profile': args.boot_profile})
     elif args.command == 'stop':
-        manager.stop_vm(args.name)
+        if args.all or len(args.name) > 1:
+            call = ('stop_vms', {'names': None if args.all else args.name,
+                                 'timeout': args.timeout, 'force': args.force})
+        else:
+            call = ('stop_vm', {'name': args.name[0], 'timeout': args.timeout, 'force': args.force})
+    elif args.command == 'status':
+        call = ('vm_status', {'name': args.name})
+    elif args.command == 'reset':
+        call = ('reset_vm', {'name': args.name})
+    elif args.command == 'stats':
+        call = ('vm_stats', {'name': args.name})
+    elif args.command == 'placement':
+        call = ('host_placement', {})
+    elif args.command == 'density' and args.density_command == 'report':
+        call = ('density_report', {})
+    elif args.command == 'density' and args.density_command == 'run':
+        run_density_controller(args)
+        return
+    elif args.command == 'disk-profiles':
+        call = ('list_disk_profiles', {})
+    elif args.command == 'dhcp':
+        call = ('sync_dhcp', {'reload': not args.no_reload})
+    elif args.command == 'boot-profiles':
+        call = ('list_boot_profiles', {})
+    elif args.command == 'boot-bench':
+        call = ('measure_boot', {'name': args.name, 'boot_profiles': args.boot_profiles,
+                                 'runs': args.runs, 'boot_mode': args.boot,
+                                 'pattern': args.pattern, 'timeout': args.timeout})
     elif args.command == 'list':
-        manager.list_vms()
+        call = ('list_vms', {'names_only': args.names, 'output': args.format})
+    elif args.command == 'export':
+        call = ('export_config', {'path': args.output})
+    elif args.command == 'import':
+        call = ('import_config', {'path': args.input})
     elif args.command == 'delete':
-        manager.delete_vm(args.name, args.force)
+        if args.all or len(args.name) > 1:
+            call = ('delete_vms', {'names': None if args.all else args.name,
+                                   'force': args.force, 'timeout': args.timeout})
+        else:
+            call = ('delete_vm', {'name': args.name[0], 'force': args.force,
+                                  'timeout': args.timeout})
+    elif args.command == 'cache' and args.cache_command == 'capture':
+        call = ('capture_image', {'name': args.name, 'profile': args.profile,
+                                  'with_state': args.with_state})
+    elif args.command == 'cache' and args.cache_command == 'list':
+        call = ('list_cached_images', {})
+    elif args.command == 'cache' and args.cache_command == 'invalidate':
+        call = ('invalidate_cached_image', {'profile': args.profile})
+    elif args.command == 'cache' and args.cache_command == 'evict':
+        call = ('evict_cached_images', {'max_gb': args.max_gb})
     else:
         parser.print_help()
-
+        return
+    
+    try:
+        result = call_manager(*call, use_daemon=not args.no_daemon, socket_path=args.socket)
+    except (QMPError, DaemonError) as e:
+        print(f"Failed to {args.command}: {e}")
+        sys.exit(1)
+    
+    if args.command in ('status', 'stats', 'placement', 'density'):
+        print(json.dumps(result, indent=2))
 
 if __name__ == '__main__':
     main()
@@ -50,9 +50,11 @@ echo ""
 echo "Starting OpenBMC container..."
 # Note: Using host networking due to WSL2 port forwarding issues
 # This means BMC services are directly on host network
+# Host PID namespace lets the sensor engine read QEMU CPU usage from /proc
 $CONTAINER_ENGINE run -d \
     --name bmc-openbmc \
     --network host \
+    --pid host \
     -v "$SCRIPT_DIR/logs:/var/log/openbmc" \
     dc-openbmc
 
@@ -68,15 +70,28 @@ echo "Starting PXE server container..."
 # Copy netboot files to container volume location
 mkdir -p "$SCRIPT_DIR/pxe-data/tftp"
 mkdir -p "$SCRIPT_DIR/pxe-data/http"
+mkdir -p "$SCRIPT_DIR/pxe-data/dhcp"
 
-if [ -d "$SCRIPT_DIR/images/ubuntu" ]; then
-    echo "Copying PXE boot files..."
+if [ -d "$SCRIPT_DIR/images/ubuntu" ] || [ -d "$SCRIPT_DIR/images/assets" ]; then
+    echo "Linking PXE boot files..."
     # Remove existing files to avoid conflicts with symlinks/directories
     # Use sudo since files may be owned by root from previous container runs
     sudo rm -rf "$SCRIPT_DIR/pxe-data/tftp/"*
-    cp -rL "$SCRIPT_DIR/images/ubuntu/." "$SCRIPT_DIR/pxe-data/tftp/"
+    # Hardlinks into the asset store, with anything added or edited under
+    # images/ubuntu copied on top; a plain copy if the store has nothing
+    python3 "$SCRIPT_DIR/src/pxe_assets.py" serve || \
+        cp -rL "$SCRIPT_DIR/images/ubuntu/." "$SCRIPT_DIR/pxe-data/tftp/"
 fi
 
+# DHCP/TFTP and HTTP logs for the boot timeline (src/boot_timeline.py).
+# Created here so they stay readable without sudo.
+mkdir -p "$SCRIPT_DIR/logs/pxe"
+touch "$SCRIPT_DIR/logs/pxe/dnsmasq.log" "$SCRIPT_DIR/logs/pxe/nginx-access.log"
+
+# Static DHCP reservations for the VMs in the inventory
+python3 "$SCRIPT_DIR/src/vm_manager.py" dhcp --no-reload > /dev/null || true
+touch "$SCRIPT_DIR/pxe-data/dhcp/hosts"
+
 # Use host network so PXE server can serve DHCP on the bridge interface
 $CONTAINER_ENGINE run -d \
     --name bmc-pxe \
@@ -84,6 +99,8 @@ $CONTAINER_ENGINE run -d \
     --cap-add NET_ADMIN \
     -v "$SCRIPT_DIR/pxe-data/tftp:/tftp" \
     -v "$SCRIPT_DIR/pxe-data/http:/var/www/html/ubuntu" \
+    -v "$SCRIPT_DIR/pxe-data/dhcp:/etc/dnsmasq.d/hosts" \
+    -v "$SCRIPT_DIR/logs/pxe:/var/log/pxe" \
     dc-pxe
 
 echo "PXE Server started at:"
@@ -24,10 +24,9 @@ fi
 # Stop all VMs
 echo ""
 echo "Stopping all VMs..."
-if [ -f "config/vms.yaml" ]; then
-    for vm in $(python3 -c "import yaml; print(' '.join(yaml.safe_load(open('config/vms.yaml'))['vms'].keys()))" 2>/dev/null); do
-        python3 src/vm_manager.py stop --name "$vm" 2>/dev/null || true
-    done
+if [ -f "config/inventory.db" ] || [ -f "config/vms.yaml" ]; then
+    # All VMs power down together; takes as long as the slowest one
+    python3 src/vm_manager.py stop --all 2>/dev/null || true
 fi
 
 # Stop containers
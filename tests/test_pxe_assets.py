@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Asset store tests against a local HTTP stand-in for the netboot mirrors:
+ranged, resumable downloads, checksum checks, deduplication and serving
+"""
+
+import hashlib
+import io
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from pxe_assets import AssetError, AssetStore, Downloader, serve  # noqa: E402
+
+CHUNK = 64 * 1024
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """GET with single Range support over the server's files dict"""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range') or '')
+        if match is None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(body) - 1)
+        if start in self.server.fail_offsets:
+            self.send_error(503)
+            return
+        self.send_response(206)
+        self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(body[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mirror(files):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MirrorHandler)
+    server.files = files
+    server.requests = []
+    server.fail_offsets = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_archive(files, symlinks=()):
+    """tar.gz of {path: bytes} plus (path, target) symlinks"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        for path, target in symlinks:
+            info = tarfile.TarInfo(path)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+    return buffer.getvalue()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class AssetStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        # Random data does not compress, so the archive spans several chunks
+        self.kernel = os.urandom(200 * 1024)
+        self.menu = b'default install\nlabel install\n  kernel linux\n'
+        self.archive = make_archive(
+            {'./amd64/linux': self.kernel, './amd64/pxelinux.cfg/default': self.menu},
+            [('./pxelinux.cfg', 'amd64/pxelinux.cfg')])
+        self.mirrors = [start_mirror({'/netboot.tar.gz': self.archive,
+                                      '/SHA256SUMS': f"{sha256(self.archive)}  ./netboot.tar.gz\n".encode()})
+                        for _ in range(2)]
+        for mirror in self.mirrors:
+            self.addCleanup(mirror.server_close)
+            self.addCleanup(mirror.shutdown)
+        self.store = AssetStore(self.tmp / 'store')
+
+    def profile(self, **extra):
+        base = [f"http://127.0.0.1:{m.server_address[1]}" for m in self.mirrors]
+        return dict({'urls': [f"{b}/netboot.tar.gz" for b in base],
+                     'checksums': [f"{b}/SHA256SUMS" for b in base],
+                     'checksum_name': './netboot.tar.gz'}, **extra)
+
+    def fetch(self, name, profile, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return self.store.fetch(name, profile, workers=4, chunk_size=CHUNK, **kwargs)
+
+    def ranges(self):
+        return [r for m in self.mirrors for path, r in m.requests
+                if path == '/netboot.tar.gz' and r and r != 'bytes=0-0']
+
+    def test_interrupted_download_resumes(self):
+        chunks = (len(self.archive) + CHUNK - 1) // CHUNK
+        self.assertGreater(chunks, 2)
+        for mirror in self.mirrors:
+            mirror.fail_offsets.add(CHUNK)
+        dest = self.tmp / 'netboot.part'
+        with redirect_stdout(io.StringIO()):
+            with self.assertRaises(AssetError):
+                Downloader(workers=2, chunk_size=CHUNK).fetch(self.profile()['urls'], dest)
+        self.assertTrue(dest.with_name(dest.name + '.state').exists())
+
+        for mirror in self.mirrors:
+            mirror.fail_offsets.clear()
+            mirror.requests.clear()
+        with redirect_stdout(io.StringIO()) as output:
+            Downloader(workers=2, chunk_size=CHUNK).fetch(self.profile()['urls'], dest)
+        self.assertIn('Resuming', output.getvalue())
+        self.assertEqual(dest.read_bytes(), self.archive)
+        self.assertFalse(dest.with_name(dest.name + '.state').exists())
+        # Only the chunk that failed is fetched again
+        self.assertEqual(self.ranges(), [f"bytes={CHUNK}-{2 * CHUNK - 1}"])
+
+    def test_chunks_spread_over_mirrors(self):
+        self.fetch('netboot', self.profile())
+        for mirror in self.mirrors:
+            self.assertTrue(any(r and r != 'bytes=0-0' for _, r in mirror.requests))
+
+    def test_checksum_mismatch_is_rejected(self):
+        with self.assertRaises(AssetError):
+            self.fetch('netboot', self.profile(sha256='0' * 64))
+        self.assertIsNone(self.store.manifest('netboot'))
+        self.assertEqual(list((self.store.root / 'downloads').iterdir()), [])
+
+        for mirror in self.mirrors:
+            mirror.files['/SHA256SUMS'] = f"{'1' * 64}  ./netboot.tar.gz\n".encode()
+        with self.assertRaises(AssetError):
+            self.fetch('netboot', self.profile())
+        self.assertIsNone(self.store.manifest('netboot'))
+
+    def test_missing_checksum_needs_no_verify(self):
+        profile = self.profile(checksums=[])
+        with self.assertRaises(AssetError):
+            self.fetch('netboot', profile)
+        manifest = self.fetch('netboot', profile, verify=False)
+        self.assertFalse(manifest['verified'])
+
+    def test_profiles_share_objects_and_warm_fetch_is_cached(self):
+        first = self.fetch('focal', self.profile())
+        second = self.fetch('focal-copy', self.profile())
+        self.assertEqual(first['files'], second['files'])
+        objects = [p for p in (self.store.root / 'objects').rglob('*') if p.is_file()]
+        self.assertEqual(len(objects), 2)
+
+        for mirror in self.mirrors:
+            mirror.requests.clear()
+        self.fetch('focal', self.profile())
+        self.assertEqual([r for m in self.mirrors for r in m.requests], [])
+
+    def test_link_hardlinks_large_files_and_copies_small_ones(self):
+        self.fetch('netboot', self.profile())
+        with redirect_stdout(io.StringIO()):
+            self.store.link('netboot', self.tmp / 'a')
+            self.store.link('netboot', self.tmp / 'b')
+        kernel = self.store.object_path(sha256(self.kernel))
+        self.assertEqual(kernel.stat().st_nlink, 3)
+        self.assertTrue(os.path.samefile(kernel, self.tmp / 'a/amd64/linux'))
+
+        # The symlinked directory is materialized, and its small files are copies
+        menu = self.tmp / 'a/pxelinux.cfg/default'
+        self.assertEqual(menu.read_bytes(), self.menu)
+        self.assertFalse(os.path.samefile(menu, self.store.object_path(sha256(self.menu))))
+        menu.write_bytes(b'edited\n')
+        self.assertEqual(self.store.object_path(sha256(self.menu)).read_bytes(), self.menu)
+
+    def test_serve_overlays_local_files_without_touching_the_store(self):
+        self.fetch('netboot', self.profile())
+        local = self.tmp / 'ubuntu'
+        with redirect_stdout(io.StringIO()):
+            self.store.link('netboot', local)
+        (local / 'pxelinux.cfg/default').write_bytes(b'default install console=ttyS0\n')
+        (local / 'http').mkdir()
+        (local / 'http/preseed.cfg').write_bytes(b'd-i debian-installer/locale string en_US\n')
+        # Overwriting a stored file's name in the overlay must replace, not write through
+        (local / 'amd64/linux').unlink()
+        (local / 'amd64/linux').write_bytes(b'custom kernel')
+
+        tftp = self.tmp / 'tftp'
+        with redirect_stdout(io.StringIO()):
+            serve(self.store, ['netboot'], {}, tftp, self.tmp / 'http', overlay=local)
+        self.assertEqual((tftp / 'pxelinux.cfg/default').read_bytes(),
+                         b'default install console=ttyS0\n')
+        self.assertTrue((tftp / 'http/preseed.cfg').exists())
+        self.assertEqual((tftp / 'amd64/linux').read_bytes(), b'custom kernel')
+        self.assertEqual(self.store.object_path(sha256(self.kernel)).read_bytes(), self.kernel)
+
+        # Unchanged local files are left as the store's hardlinks
+        (local / 'amd64/linux').unlink()
+        os.link(self.store.object_path(sha256(self.kernel)), local / 'amd64/linux')
+        with redirect_stdout(io.StringIO()):
+            serve(self.store, ['netboot'], {}, tftp, self.tmp / 'http', overlay=local)
+        self.assertTrue(os.path.samefile(tftp / 'amd64/linux',
+                                         self.store.object_path(sha256(self.kernel))))
+
+
+if __name__ == '__main__':
+    unittest.main()